@@ -11,6 +11,8 @@ import time
 import random
 import pathlib
 import asyncio
+import datetime
+import functools
 import tempfile
 import http.client
 import threading
@@ -20,8 +22,7 @@ from urllib.request import urlretrieve
 
 import discord
 
-from PIL import Image
-from bridgesystem import BridgeBase, util
+from bridgesystem import BridgeBase, BridgeEvent, util
 
 class Bridge(BridgeBase):
     configuration = None
@@ -34,6 +35,203 @@ class Bridge(BridgeBase):
         The discord thread running the discord connection.
     """
 
+    steady_state_resident_bytes = None
+    """
+        The resident set size of the process measured STEADY_STATE_DELAY after starting, if measured yet.
+    """
+
+    bucket_scheduler = None
+    """
+        The scheduler tracking Discord's rate limit buckets. It outlives the Discord thread so a reconnect does not
+        forget a parked bucket.
+    """
+
+    polled = False
+    """
+        When running on an event loop, the Discord thread wakes the loop whenever a message arrives.
+    """
+
+    outbound_drained_on_core = False
+    """
+        The Discord thread drains the outbound queue, so the block policy may wait on it.
+    """
+
+    THREAD_CHECK_TIME = datetime.timedelta(seconds=5)
+    """
+        How often to check that the Discord thread is still alive.
+    """
+
+    RATE_LIMIT = (50.0, 50)
+    """
+        Discord accepts about fifty requests per second from a bot across every route.
+    """
+
+    DESTINATION_RATE_LIMIT = (1.0, 5)
+    """
+        Discord accepts about five messages every five seconds in any single channel.
+    """
+
+    COALESCE_LIMIT = 1900
+    """
+        Discord messages may be up to 2000 characters, leaving room for formatting.
+    """
+
+    ATTACHMENT_HEADERS = {
+        "accept": "image/webp,image/apng,image/*,*/*;q=0.8",
+        "accept-language": "en-US,en;q=0.8",
+        "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.90 Safari/537.36"
+    }
+    """
+        The headers sent when downloading attachments. No compressed encodings are accepted, as attachments are
+        streamed to disk exactly as they arrive.
+    """
+
+    BUCKET_RESET_SECONDS = 1.0
+    """
+        How long a channel is parked after a rate limited response that does not say when its bucket resets.
+    """
+
+    MAX_SEND_ATTEMPTS = 5
+    """
+        How many times a message is sent to a rate limited channel before it is given up on.
+    """
+
+    MAX_CHANNEL_BACKLOG = 256
+    """
+        The most messages taken from the outbound queue into the per channel queues at once. Anything beyond this
+        waits in the outbound queue, where its capacity and overflow policy apply.
+    """
+
+    LEAN_MESSAGE_CACHE = 100
+    """
+        How many messages a lean client keeps cached. This is the smallest cache discord.py allows and the only
+        cache a lean client can shrink under discord.py 0.16.7.
+    """
+
+    STEADY_STATE_DELAY = datetime.timedelta(minutes=5)
+    """
+        How long after starting the process's resident set size is measured and reported, giving the client time to
+        receive every server it is in.
+    """
+
+    class BucketScheduler(object):
+        """
+            Tracks Discord's rate limit buckets from the headers of rate limited responses. A channel whose bucket is
+            exhausted is parked until the bucket resets, and every channel is parked when the global bucket is, so
+            messages wait in their channel's queue rather than being sent only to be refused again. Only the Discord
+            thread updates the scheduler.
+
+            This is a fallback only. discord.py 0.16.7 does not expose the headers of successful responses and retries
+            most rate limited requests itself, so the scheduler only learns from the 429 responses that the library
+            gives up on and raises as an HTTPException. It cannot park a channel ahead of its bucket running out.
+        """
+
+        reset_times = None
+        """
+            A dictionary mapping channel names to the monotonic time their bucket resets.
+        """
+
+        global_reset_time = None
+        """
+            The monotonic time the global bucket resets.
+        """
+
+        limited_count = None
+        """
+            The total number of rate limited responses.
+        """
+
+        waited_count = None
+        """
+            The total number of messages that waited for a bucket to reset.
+        """
+
+        waited_seconds = None
+        """
+            The total number of seconds messages waited for buckets to reset.
+        """
+
+        lock = None
+        """
+            The lock guarding the reset times, as metrics are collected from the core thread.
+        """
+
+        def __init__(self):
+            self.reset_times = {}
+            self.global_reset_time = 0.0
+            self.limited_count = 0
+            self.waited_count = 0
+            self.waited_seconds = 0.0
+            self.lock = threading.Lock()
+
+        def get_reset_after(self, headers):
+            """
+                Returns how many seconds until the bucket of a rate limited response resets.
+            """
+            reset_after = headers.get("X-RateLimit-Reset-After")
+            if reset_after is not None:
+                return float(reset_after)
+
+            reset = headers.get("X-RateLimit-Reset")
+            if reset is not None:
+                return float(reset) - time.time()
+
+            retry_after = headers.get("Retry-After")
+            if retry_after is not None:
+                return float(retry_after)
+            return Bridge.BUCKET_RESET_SECONDS
+
+        def park(self, channel_name, headers):
+            """
+                Parks a channel, or every channel if the global bucket is exhausted, until the bucket named in the
+                headers of a rate limited response resets.
+
+                :param channel_name: The name of the channel the response was for.
+                :param headers: The headers of the response.
+            """
+            try:
+                reset_after = self.get_reset_after(headers)
+            except ValueError as e:
+                reset_after = Bridge.BUCKET_RESET_SECONDS
+            reset_time = time.monotonic() + max(reset_after, 0.0)
+
+            with self.lock:
+                self.limited_count += 1
+                if headers.get("X-RateLimit-Global", "").lower() == "true":
+                    self.global_reset_time = max(self.global_reset_time, reset_time)
+                else:
+                    self.reset_times[channel_name] = max(self.reset_times.get(channel_name, 0.0), reset_time)
+
+        def get_wait(self, channel_name):
+            """
+                Returns how many seconds until the given channel may be sent to.
+            """
+            now = time.monotonic()
+            with self.lock:
+                reset_time = max(self.global_reset_time, self.reset_times.get(channel_name, 0.0))
+                if reset_time <= now:
+                    self.reset_times.pop(channel_name, None)
+                    return 0.0
+                return reset_time - now
+
+        def record_wait(self, seconds):
+            with self.lock:
+                self.waited_count += 1
+                self.waited_seconds += seconds
+
+        def collect_metrics(self, metrics, labels):
+            """
+                Reports the parked channels and how long messages waited to the given metrics registry.
+            """
+            now = time.monotonic()
+            with self.lock:
+                parked_count = sum(1 for reset_time in self.reset_times.values() if reset_time > now)
+                metrics.set_gauge("pybridge_discord_parked_channels", labels, parked_count)
+                metrics.set_gauge("pybridge_discord_global_parked", labels, 1 if self.global_reset_time > now else 0)
+                metrics.set_counter("pybridge_discord_rate_limited_total", labels, self.limited_count)
+                metrics.set_counter("pybridge_discord_bucket_waits_total", labels, self.waited_count)
+                metrics.set_counter("pybridge_discord_bucket_wait_seconds_total", labels, self.waited_seconds)
+
     class DiscordThread(threading.Thread):
         """
             A class representing an independent thread of execution for running the discord bots in.
@@ -50,14 +248,10 @@ class Bridge(BridgeBase):
             All messages waiting to be sent from Discord to the IRC.
         """
 
-        incoming_lock = None
-        """
-            A thread lock for the incoming message list.
-        """
-
         incoming_messages = None
         """
-            All messages waiting to be sent from the IRC to Discord.
+            The bridge's bounded outbound queue of (channels, message, timestamp) items waiting to be sent from the IRC
+            to Discord.
         """
 
         configuration = None
@@ -80,15 +274,68 @@ class Bridge(BridgeBase):
             The discord connection in use for this thread.
         """
 
-        def __init__(self, configuration):
+        write_callback = None
+        """
+            If set, called with the timestamp of every queued message once it has been sent to Discord.
+        """
+
+        wake_callback = None
+        """
+            A thread safe callable used to notify the main event loop that outgoing messages are waiting. If None,
+            the outgoing messages are instead picked up on the next update tick.
+        """
+
+        rate_limiter = None
+        """
+            The bridge's rate limiter every queued message must be permitted by before it is sent, if any.
+        """
+
+        channel_index = None
+        """
+            A dictionary mapping channel names to Discord channels, rebuilt whenever servers or channels change. None
+            until the connection is ready.
+        """
+
+        channel_queues = None
+        """
+            A dictionary mapping channel names to the asyncio queues of (message, timestamp) entries their send tasks
+            work through.
+        """
+
+        channel_backlog = None
+        """
+            The number of messages waiting in the per channel queues.
+        """
+
+        drain_scheduled = None
+        """
+            Whether or not a pickup of incoming_messages is already scheduled on the Discord loop.
+        """
+
+        bucket_scheduler = None
+        """
+            The scheduler parking channels whose Discord rate limit buckets are exhausted.
+        """
+
+        wait_callback = None
+        """
+            If set, called with how many seconds every message waited on rate limits before it was sent.
+        """
+
+        def __init__(self, configuration, incoming_messages, wake_callback=None, write_callback=None, rate_limiter=None,
+                     bucket_scheduler=None, wait_callback=None):
             super(Bridge.DiscordThread, self).__init__()
 
             self.configuration = configuration
+            self.wake_callback = wake_callback
+            self.write_callback = write_callback
+            self.rate_limiter = rate_limiter
+            self.bucket_scheduler = bucket_scheduler
+            self.wait_callback = wait_callback
             self.outgoing_lock = threading.Lock()
             self.outgoing_messages = []
 
-            self.incoming_lock = threading.Lock()
-            self.incoming_messages = []
+            self.incoming_messages = incoming_messages
 
             self.should_run = True
 
@@ -104,7 +351,12 @@ class Bridge(BridgeBase):
                 self.loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(self.loop)
 
-                self.discord_connection = discord.Client()
+                self.discord_connection = self.create_client()
+                self.channel_index = None
+                self.requeue_channel_backlog()
+                self.channel_queues = {}
+                self.channel_backlog = 0
+                self.drain_scheduled = False
 
                 # Only process incoming messages if the configuration allows for it
                 if self.configuration.bridge_generic_config.broadcast_messages:
@@ -116,39 +368,180 @@ class Bridge(BridgeBase):
                             self.outgoing_messages.append(message)
                             self.outgoing_lock.release()
 
+                            if self.wake_callback is not None:
+                                self.wake_callback()
+
+                # The channel index only changes with the servers and channels we can see.
+                @self.discord_connection.event
+                @asyncio.coroutine
+                def on_ready():
+                    self.rebuild_channel_index()
+                    self.drain_incoming()
+
+                for event_name in ("on_server_join", "on_server_remove", "on_server_available", "on_server_unavailable"):
+                    self.discord_connection.event(self.create_index_handler(event_name))
+                for event_name in ("on_channel_create", "on_channel_delete", "on_channel_update"):
+                    self.discord_connection.event(self.create_index_handler(event_name))
+
                 try:
-                    self.discord_connection.loop.create_task(self.process_input_messages())
                     self.discord_connection.run(self.configuration.bridge_internal_config["token"])
                 except Exception as e:
                     print("!!! Discord connection threw an exception: %s" % str(e))
 
-        @asyncio.coroutine
-        def process_input_messages(self):
-            yield from self.discord_connection.wait_until_ready()
+        def create_client(self):
+            """
+                Creates the Discord client. If the bridge is configured with leanClient, the client caches only the
+                last LEAN_MESSAGE_CACHE messages instead of the default 5000. discord.py 0.16.7 has no gateway intents
+                or member cache options, so servers, channels and members are still cached in full.
+            """
+            if self.configuration.bridge_internal_config.get("leanClient", False) is False:
+                return discord.Client()
+            return discord.Client(max_messages=Bridge.LEAN_MESSAGE_CACHE)
 
-            while self.discord_connection.is_closed is False:
-                self.incoming_lock.acquire()
+        def create_index_handler(self, event_name):
+            """
+                Returns a Discord event handler with the given name that rebuilds the channel index.
+            """
+            @asyncio.coroutine
+            def handler(*args):
+                self.rebuild_channel_index()
+            handler.__name__ = event_name
+            return handler
 
-                queued_calls = []
-                discord_channels = self.discord_connection.get_all_channels()
-                discord_channels = {channel.name: channel for channel in discord_channels}
+        def rebuild_channel_index(self):
+            """
+                Rebuilds the index of channel names to channels. This runs on the Discord loop.
+            """
+            self.channel_index = {channel.name: channel for channel in self.discord_connection.get_all_channels()}
 
-                for recipient_channels, message in self.incoming_messages:
-                    if type(recipient_channels) is not list:
-                        recipient_channels = [recipient_channels]
+        def notify(self):
+            """
+                Wakes the Discord loop to pick up the messages queued on incoming_messages. This may be called from any
+                thread, and only schedules a single pickup however many messages are queued before it runs.
+            """
+            loop = self.loop
+            if loop is None or self.drain_scheduled:
+                return
+
+            self.drain_scheduled = True
+            try:
+                loop.call_soon_threadsafe(self.drain_incoming)
+            except RuntimeError as e:
+                # The loop has closed. Whatever is queued is picked up once the connection is back.
+                self.drain_scheduled = False
+
+        def requeue_channel_backlog(self):
+            """
+                Returns the messages still waiting in the per channel queues of a lost connection to the front of
+                incoming_messages, so they are sent once the connection is back.
+            """
+            if self.channel_queues is None:
+                return
 
-                    for recipient_channel in recipient_channels:
-                        if recipient_channel in discord_channels:
-                            # FIXME: If not found, report an error.
-                            recipient_channel = discord_channels[recipient_channel]
-                            queued_calls.append(self.discord_connection.send_message(recipient_channel, message))
+            for channel_name, channel_queue in self.channel_queues.items():
+                waiting_messages = []
+                while channel_queue.empty() is False:
+                    waiting_messages.append(channel_queue.get_nowait())
+                for message, timestamp in reversed(waiting_messages):
+                    self.incoming_messages.push_front(([channel_name], message, timestamp))
 
-                self.incoming_messages = []
-                self.incoming_lock.release()
+        def drain_incoming(self):
+            """
+                Moves the messages queued on incoming_messages onto the queues of the channels they are sent to. This
+                runs on the Discord loop.
+            """
+            self.drain_scheduled = False
+            if self.channel_index is None:
+                # Not ready yet. on_ready drains again.
+                return
+
+            # Only take from incoming_messages while the channel queues are short, so its capacity and overflow policy
+            # keep applying while Discord is slow or a channel is parked.
+            while self.channel_backlog < Bridge.MAX_CHANNEL_BACKLOG:
+                queued_item = self.incoming_messages.get()
+                if queued_item is None:
+                    break
+
+                recipient_channels, message, timestamp = queued_item
+                if type(recipient_channels) is not list:
+                    recipient_channels = [recipient_channels]
+
+                for recipient_channel in recipient_channels:
+                    if recipient_channel not in self.channel_index:
+                        # FIXME: If not found, report an error.
+                        continue
+
+                    channel_queue = self.channel_queues.get(recipient_channel)
+                    if channel_queue is None:
+                        channel_queue = self.channel_queues[recipient_channel] = asyncio.Queue()
+                        discord.compat.create_task(self.process_channel_queue(recipient_channel, channel_queue), loop=self.loop)
+                    channel_queue.put_nowait((message, timestamp))
+                    self.channel_backlog += 1
 
-                for queued_call in queued_calls:
-                    yield from queued_call
-                yield from asyncio.sleep(0.02)
+        @asyncio.coroutine
+        def process_channel_queue(self, channel_name, channel_queue):
+            """
+                Sends the messages queued for a single channel in order. Every channel has its own task, so a slow
+                channel never holds up the others.
+            """
+            while self.discord_connection.is_closed is False:
+                message, timestamp = yield from channel_queue.get()
+                start_time = time.monotonic()
+
+                # Room has opened up, so pick up anything held back in incoming_messages.
+                self.channel_backlog -= 1
+                self.drain_incoming()
+
+                for attempt in range(Bridge.MAX_SEND_ATTEMPTS):
+                    # Waiting here only holds up this channel, never the core thread or any other channel.
+                    if self.bucket_scheduler is not None:
+                        yield from self.wait_for_bucket(channel_name, start_time)
+                    if self.rate_limiter is not None:
+                        yield from self.wait_for_rate_limiter(channel_name)
+
+                    channel = self.channel_index.get(channel_name)
+                    if channel is None:
+                        break
+
+                    wait_time = time.monotonic() - start_time
+                    try:
+                        yield from self.discord_connection.send_message(channel, message)
+                    except discord.errors.HTTPException as e:
+                        if getattr(e.response, "status", None) == 429 and self.bucket_scheduler is not None:
+                            self.bucket_scheduler.park(channel_name, e.response.headers)
+                            continue
+                        print("!!! Failed to send a message to Discord channel %s: %s" % (channel_name, str(e)))
+                        break
+
+                    if self.wait_callback is not None:
+                        self.wait_callback(wait_time)
+                    if timestamp is not None and self.write_callback is not None:
+                        self.write_callback(timestamp)
+                    break
+                else:
+                    print("!!! Giving up on a message to Discord channel %s after %u rate limited attempts." % (channel_name, Bridge.MAX_SEND_ATTEMPTS))
+
+        @asyncio.coroutine
+        def wait_for_bucket(self, channel_name, start_time):
+            """
+                Waits until the given channel is no longer parked by the bucket scheduler.
+            """
+            wait = self.bucket_scheduler.get_wait(channel_name)
+            if wait > 0:
+                while wait > 0:
+                    yield from asyncio.sleep(wait)
+                    wait = self.bucket_scheduler.get_wait(channel_name)
+                self.bucket_scheduler.record_wait(time.monotonic() - start_time)
+
+        @asyncio.coroutine
+        def wait_for_rate_limiter(self, channel_name):
+            """
+                Waits until the bridge's rate limiter permits a send to the given channel, taking its tokens.
+            """
+            wait = self.rate_limiter.acquire(channel_name)
+            while wait > 0:
+                yield from asyncio.sleep(wait)
+                wait = self.rate_limiter.acquire(channel_name)
 
         def stop(self):
             """
@@ -176,6 +569,7 @@ class Bridge(BridgeBase):
         super(Bridge, self).__init__(application, home_path, configuration, global_configuration)
 
         self.discord_user_color_maps = {}
+        self.bucket_scheduler = Bridge.BucketScheduler()
 
     def stop(self):
         """
@@ -183,6 +577,8 @@ class Bridge(BridgeBase):
         """
         self.discord_thread.stop()
 
+        super(Bridge, self).stop()
+
     def start(self):
         """
             Starts the addon after it has been initialized and all connections associated. This is called after
@@ -195,13 +591,39 @@ class Bridge(BridgeBase):
 
         self.initialize_discord_connection()
 
+        self.application.timers.call_every(self.THREAD_CHECK_TIME, lambda delta_time: self.check_discord_thread())
+        self.application.timers.call_later(self.STEADY_STATE_DELAY, self.measure_steady_state)
+
+    def measure_steady_state(self):
+        """
+            Measures and reports the resident set size of the process once the Discord client has settled.
+        """
+        self.steady_state_resident_bytes = util.get_resident_bytes()
+        if self.steady_state_resident_bytes is not None:
+            print("Process steady state resident set size measured by Discord bridge %s: %.1f MB (%s client)" % (self.configuration.name, self.steady_state_resident_bytes / 1048576.0,
+                  "lean" if self.configuration.bridge_internal_config.get("leanClient", False) else "default"))
+
     def initialize_discord_connection(self):
         """
             Initializes the connection to discord.
         """
-        self.discord_thread = Bridge.DiscordThread(self.configuration)
+        wake_callback = None
+        if self.application.event_loop is not None:
+            wake_callback = lambda: self.application.event_loop.call_soon_threadsafe(self.process_outgoing_messages)
+
+        self.discord_thread = Bridge.DiscordThread(self.configuration, self.outbound_queue, wake_callback=wake_callback,
+                                                   write_callback=self.record_relay_latency, rate_limiter=self.rate_limiter,
+                                                   bucket_scheduler=self.bucket_scheduler, wait_callback=self.record_send_wait)
         self.discord_thread.start()
 
+    def check_discord_thread(self):
+        """
+            Ensures that the thread is still running. If for some reason it exploded, reconnect.
+        """
+        if self.discord_thread.is_alive() is False:
+            print("!!! Discord thread has died. Reinitializing.")
+            self.initialize_discord_connection()
+
     def register_addon(self, application):
         """
             Registers this addon with the given IRC connection.
@@ -218,74 +640,103 @@ class Bridge(BridgeBase):
 
         super(Bridge, self).update(delta_time)
 
-        # Ensure that the thread is still running. If for some reason it exploded, reconnect.
-        if self.discord_thread.is_alive() is False:
-            print("!!! Discord thread has died. Reinitializing.")
-            self.initialize_discord_connection()
+        self.process_outgoing_messages()
 
+    def process_outgoing_messages(self):
+        """
+            Relays all messages received from Discord to the rest of the domain. The lock is only held long enough to
+            take the waiting messages, so the Discord thread is never blocked by attachment handling.
+        """
         self.discord_thread.outgoing_lock.acquire()
-        for message in self.discord_thread.outgoing_messages:
-            author = message.author.name.rsplit("#", 1)[0].rstrip().lstrip()
-
-            message_content = message.clean_content
-            if len(message.attachments) != 0:
-                message_content = "No Comment" if message_content is None or len(message_content) == 0 else message_content
-
-                if self.global_configuration.global_configuration.image_hosting.enabled:
-                    generated_urls = []
-                    for attachment in message.attachments:
-                        parsed_url = urlparse(attachment["url"])
-                        connection = http.client.HTTPSConnection(parsed_url.netloc)
-                        connection.request("GET", parsed_url.path, headers={
-                            "authority": parsed_url.netloc,
-                            "path": parsed_url.path,
-                            "scheme": "https",
-                            "accept": "image/webp,image/apng,image/*,*/*;q=0.8",
-                            "accept-encoding": "gzip, deflate, br",
-                            "accept-language": "en-US,en;q=0.8",
-                            "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.90 Safari/537.36"
-                        })
-
-                        # Get the response and save it
-                        response = connection.getresponse()
-                        response_data = response.read()
-                        _, temp_path = tempfile.mkstemp()
-                        with open(temp_path, "wb") as handle:
-                            handle.write(response_data)
-
-                        # Attmept to convert it.
-                        try:
-                            image_handle = Image.open(temp_path)
-                            image_handle.save(temp_path, "PNG")
-                            image_handle.close()
-
-                            generated_name = self.get_hosted_image_from_path(temp_path, extension=".png")
-                            generated_urls.append(self.get_hosted_image_url(generated_name))
-                        except OSError as e:
-                            os.remove(temp_path)
-                            generated_urls.append("Failed to generate URL: %s" % str(e))
-
-                    message_content = "(Discord Attachment: %s): %s" % (message_content, "\n".join(generated_urls))
-                else:
-                    message_content = "(Discord Attachment: %s): %s" % (message_content, "\n".join([attachment["url"] for attachment in message.attachments]))
-
-            if self.configuration.bridge_generic_config.broadcast_messages and author not in self.configuration.bridge_generic_config.ignore_senders:
-                self.application.broadcast_event("on_receive_message",
-                sender=self,
-                sender_name=author,
-                message=message_content,
-                target_channels=[message.channel.name])
-
+        outgoing_messages = self.discord_thread.outgoing_messages
         self.discord_thread.outgoing_messages = []
         self.discord_thread.outgoing_lock.release()
 
+        for message in outgoing_messages:
+            self.relay_message(message)
+
+    def download_attachment(self, url, handle):
+        """
+            Streams a Discord attachment into the given file-like object. This runs on a download thread.
+        """
+        self.application.downloader.download(url, handle, headers=self.ATTACHMENT_HEADERS)
+
+    def relay_message(self, message):
+        """
+            Relays a single message received from Discord. When attachments are hosted, the message is relayed right
+            away with a placeholder and the hosted URLs follow in a separate message once they are ready.
+        """
+        author = message.author.name.rsplit("#", 1)[0].rstrip().lstrip()
+        if self.configuration.bridge_generic_config.broadcast_messages is False or author in self.configuration.bridge_generic_config.ignore_senders:
+            return
+
+        message_content = message.clean_content
+        attachment_urls = [attachment["url"] for attachment in message.attachments]
+        if len(attachment_urls) != 0:
+            message_content = "No Comment" if message_content is None or len(message_content) == 0 else message_content
+
+            if self.application.image_pipeline is not None:
+                futures = [self.host_image(functools.partial(self.download_attachment, url)) for url in attachment_urls]
+                self.relay_when_ready(futures, functools.partial(self.relay_attachments, author, message.channel.name), key=author)
+                message_content = "(Discord Attachment: %s): %u attachment(s) to follow" % (message_content, len(futures))
+            else:
+                message_content = "(Discord Attachment: %s): %s" % (message_content, "\n".join(attachment_urls))
+
+        self.application.dispatch_event(BridgeEvent("on_receive_message", self, author, [message.channel.name], message_content, attachments=attachment_urls))
+
+    def relay_attachments(self, author, channel_name, futures):
+        """
+            Relays the hosted URLs of a message's attachments once they have all been processed. Follow-ups from the
+            same author are relayed in the order their messages were received.
+
+            :param futures: The futures hosting each attachment.
+        """
+        generated_urls = []
+        for future in futures:
+            try:
+                generated_urls.append(self.get_hosted_image_url(future.result()))
+            except Exception as e:
+                # Anything from a failed download to a decompression bomb or a dead transcoding pool lands here.
+                generated_urls.append("Failed to generate URL: %s" % str(e))
+
+        self.application.dispatch_event(BridgeEvent("on_receive_message", self, author, [channel_name], "(Discord Attachment): %s" % "\n".join(generated_urls)))
+
+    def record_send_wait(self, seconds):
+        """
+            Records how long a message waited on rate limits before it was sent to Discord. This is called from the
+            Discord thread.
+        """
+        self.application.metrics.observe("pybridge_discord_send_wait_seconds", self.metric_labels, seconds)
+
+    def collect_metrics(self):
+        """
+            Reports the bucket scheduler and steady state memory alongside the metrics every bridge reports.
+        """
+        super(Bridge, self).collect_metrics()
+
+        self.bucket_scheduler.collect_metrics(self.application.metrics, self.metric_labels)
+        if self.steady_state_resident_bytes is not None:
+            # The whole process is measured, so it is reported without bridge labels. Every Discord bridge in the
+            # process sets the same series.
+            self.application.metrics.set_gauge("pybridge_process_steady_state_resident_bytes", (), self.steady_state_resident_bytes)
+
     def get_commands(self):
         return {}
 
     def send(self, sender, message, target_channels):
-        self.discord_thread.incoming_lock.acquire()
-        self.discord_thread.incoming_messages.append((target_channels, message))
-        self.discord_thread.incoming_lock.release()
+        self.outbound_queue.put((target_channels, message, self.get_relay_timestamp()))
+        self.discord_thread.notify()
+
+    def coalesce_outbound(self, queued_item, new_item):
+        """
+            Messages to the same channels are merged as long as they fit in a single Discord message. The merged
+            message keeps the older timestamp.
+        """
+        queued_channels, queued_message, queued_timestamp = queued_item
+        new_channels, new_message, new_timestamp = new_item
+        if queued_channels == new_channels and len(queued_message) + len(new_message) + 1 <= self.COALESCE_LIMIT:
+            return (queued_channels, "%s\n%s" % (queued_message, new_message), queued_timestamp)
+        return None
 
     def on_receive_message(self, sender, sender_name, message, target_channels):
         if self.configuration.bridge_generic_config.receive_messages and sender_name not in self.configuration.bridge_generic_config.ignore_senders:
@@ -294,12 +745,8 @@ class Bridge(BridgeBase):
 
     def on_receive_join(self, sender, joined_name, target_channels):
         if self.configuration.bridge_generic_config.receive_join_leaves and joined_name not in self.configuration.bridge_generic_config.ignore_senders:
-            self.discord_thread.incoming_lock.acquire()
-            self.discord_thread.incoming_messages.append((target_channels, "**<%s: %s>** joined %s." % (sender.configuration.name, joined_name, ", ".join(target_channels))))
-            self.discord_thread.incoming_lock.release()
+            self.send_coalesced(joined_name, target_channels, "**<%s: %s>** joined %s." % (sender.configuration.name, joined_name, ", ".join(target_channels)), self.send)
 
     def on_receive_leave(self, sender, left_name, target_channels):
         if self.configuration.bridge_generic_config.receive_join_leaves and left_name not in self.configuration.bridge_generic_config.ignore_senders:
-            self.discord_thread.incoming_lock.acquire()
-            self.discord_thread.incoming_messages.append((target_channels, "**<%s: %s>** left %s." % (sender.configuration.name, left_name, ", ".join(target_channels))))
-            self.discord_thread.incoming_lock.release()
+            self.send_coalesced(left_name, target_channels, "**<%s: %s>** left %s." % (sender.configuration.name, left_name, ", ".join(target_channels)), self.send)
@@ -13,6 +13,7 @@ import errno
 import socket
 import asyncio
 import datetime
+import collections
 import threading
 import importlib
 
@@ -87,8 +88,88 @@ class Connection(object):
 
     received_user_lists = False
 
+    reactor = None
+    """
+        The shared reactor this connection registers its socket with. If None, update polls the socket with a
+        short timeout instead.
+    """
+
+    timers = None
+    """
+        The timer service this connection schedules its pings and timeout checks with when registered with a
+        reactor. If None, update checks them every tick instead.
+    """
+
+    last_receive_time = None
+    """
+        The last time data was received from the server. Only used when registered with a reactor.
+    """
+
+    keepalive_timer = None
+    """
+        The pending timer used to send pings and detect timeouts.
+    """
+
+    outbound_queue = None
+    """
+        The bounded queue of (encoded line, timestamp, destination) items waiting to be written to the server. If None,
+        lines are written directly.
+    """
+
+    control_output = None
+    """
+        A deque of (encoded line, timestamp) items for protocol lines, such as PONG, NICK and JOIN, waiting to be
+        written ahead of the outbound queue. They are never rate limited or dropped.
+    """
+
+    pending_output = None
+    """
+        The remainder of a line that was only partially written to the server.
+    """
+
+    pending_timestamp = None
+    """
+        The timestamp queued with the partially written line.
+    """
+
+    pending_destination = None
+    """
+        The channel or nickname the pending line is addressed to, or None for other commands.
+    """
+
+    pending_permitted = None
+    """
+        Whether or not the rate limiter has permitted the pending line to be written.
+    """
+
+    rate_limiter = None
+    """
+        The rate limiter every queued line must be permitted by before it is written, if any.
+    """
+
+    rate_limit_timer = None
+    """
+        The pending timer used to resume writing once the rate limiter permits the next line.
+    """
+
+    write_callback = None
+    """
+        If set, called with the timestamp of every queued line once it has been completely written to the server.
+    """
+
+    max_buffer_length = None
+    """
+        The longest the receive buffer may grow without a complete line before it is discarded.
+    """
+
+    discarded_buffer_count = None
+    """
+        How many times the receive buffer has been discarded for growing past max_buffer_length.
+    """
+
     def __init__(self, address, port, username, channels, password=None, ping_delay=None,
-    timeout_delay=datetime.timedelta(seconds=60), receive_length=4096, event_handlers={}):
+    timeout_delay=datetime.timedelta(seconds=60), receive_length=4096, event_handlers={}, reactor=None, timers=None,
+    outbound_queue=None, max_buffer_length=65536, write_callback=None, rate_limiter=None):
 
         """
          {
@@ -115,6 +196,14 @@ class Connection(object):
         self.ping_delay = ping_delay
         self.connection_info = (address, port)
         self.event_handlers = event_handlers
+        self.reactor = reactor
+        self.timers = timers
+        self.outbound_queue = outbound_queue
+        self.control_output = collections.deque()
+        self.write_callback = write_callback
+        self.rate_limiter = rate_limiter
+        self.max_buffer_length = max_buffer_length
+        self.discarded_buffer_count = 0
         self.last_ping_time = datetime.datetime.now()
         self.total_timeout_time = datetime.timedelta(seconds=0)
         self.debug_prints_enabled = False
@@ -137,6 +226,9 @@ class Connection(object):
         self.send("NICK %s" % self.username)
         self.send("USER %s" % self.nickname)
 
+        if self.reactor is not None and self.timers is not None:
+            self.schedule_keepalive()
+
     def dispatch_event(self, name, *args, **kwargs):
         if name in self.event_handlers:
             for handler in self.event_handlers[name]:
@@ -146,28 +238,204 @@ class Connection(object):
         """
             Closes the connection with the IRC server.
         """
+        if self.keepalive_timer is not None:
+            self.keepalive_timer.cancel()
+            self.keepalive_timer = None
+
+        if self.rate_limit_timer is not None:
+            self.rate_limit_timer.cancel()
+            self.rate_limit_timer = None
+
+        if self.reactor is not None:
+            self.reactor.unregister(self.socket)
         self.socket.close()
 
     def reconnect(self):
         self.buffer = ""
+
+        # Anything still waiting to be written was meant for the old connection.
+        self.pending_output = None
+        self.control_output.clear()
+        if self.outbound_queue is not None:
+            self.outbound_queue.drain()
         if self.socket is not None:
+            if self.reactor is not None:
+                self.reactor.unregister(self.socket)
             self.socket.close()
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect(self.connection_info)
         self.socket.setblocking(False)
-        self.socket.settimeout(0.03)
+        self.last_receive_time = datetime.datetime.now()
+
+        # With a reactor we are called back when data arrives, otherwise update polls with a short timeout.
+        if self.reactor is not None:
+            self.reactor.register(self.socket, self.handle_readable)
+        else:
+            self.socket.settimeout(0.03)
         return True
 
-    def send(self, string):
-        self.socket.send(bytes("%s\r\n" % string, "utf8"))
+    def schedule_keepalive(self):
+        """
+            Arms the timer that sends pings and checks for a server timeout.
+        """
+        keepalive_delay = self.timeout_delay if self.ping_delay is None else min(self.ping_delay, self.timeout_delay)
+        self.keepalive_timer = self.timers.call_later(keepalive_delay, self.process_keepalive)
+
+    def process_keepalive(self):
+        """
+            Timer callback used to send pings and reconnect if the server has gone quiet.
+        """
+        self.check_keepalive()
+        self.schedule_keepalive()
 
-    def say(self, string, channel):
+    def check_keepalive(self):
+        """
+            Sends a ping if one is due and reconnects if the server has been quiet for too long. Only used when
+            registered with a reactor.
+        """
+        current_time = datetime.datetime.now()
+        if current_time - self.last_receive_time >= self.timeout_delay:
+            if self.debug_prints_enabled is True:
+                print("Server connection has timed out -- attempting reconnection ...")
+            self.reconnect()
+        elif self.ping_delay is not None and current_time - self.last_ping_time >= self.ping_delay:
+            self.send("PING :DRAGON\r\n")
+            self.last_ping_time = current_time
+
+    def handle_readable(self):
+        """
+            Called by the reactor when the socket has data waiting. Reads everything available and then
+            processes all complete lines.
+        """
+        try:
+            while True:
+                received_data = self.socket.recv(self.receive_length)
+                if len(received_data) == 0:
+                    raise ConnectionResetError("The server closed the connection.")
+
+                self.buffer += received_data.decode("utf8")
+                self.last_receive_time = datetime.datetime.now()
+        except BlockingIOError as e:
+            pass
+        except socket.error as e:
+            if self.debug_prints_enabled is True:
+                print("Disconnected from server -- attempting reconnection ...")
+                print("Reason: %s" % str(e))
+
+            self.reconnect()
+            return
+
+        self.process_buffer()
+
+    def send(self, string, timestamp=None):
+        """
+            Sends a protocol line to the server. Protocol lines are written ahead of queued messages and are never
+            rate limited or dropped, so a backlog of chat cannot delay a PONG into a ping timeout.
+        """
+        data = bytes("%s\r\n" % string, "utf8")
+        if self.outbound_queue is None:
+            self.write_line(data, timestamp)
+            return
+
+        self.control_output.append((data, timestamp))
+        self.flush_outbound()
+
+    def say(self, string, channel, timestamp=None):
         for string in util.chunk_string(string, 450):
-            self.socket.send(bytes('PRIVMSG #%s :%s\r\n' % (channel, string), "utf8"))
+            self.write_line(bytes('PRIVMSG #%s :%s\r\n' % (channel, string), "utf8"), timestamp, "#%s" % channel)
 
-    def say_to(self, name, string):
+    def say_to(self, name, string, timestamp=None):
         for string in util.chunk_string(string, 450):
-            self.socket.send(bytes('PRIVMSG %s :%s\r\n' % (name, string), "utf8"))
+            self.write_line(bytes('PRIVMSG %s :%s\r\n' % (name, string), "utf8"), timestamp, name)
+
+    def write_line(self, data, timestamp=None, destination=None):
+        """
+            Writes an encoded line to the server, passing it through the outbound queue if there is one.
+
+            :param data: The encoded line including its line terminator.
+            :param timestamp: If specified, passed to the write callback once the line has been written.
+            :param destination: The channel or nickname the line is addressed to, used for rate limiting.
+        """
+        if self.outbound_queue is None:
+            self.socket.send(data)
+            if timestamp is not None and self.write_callback is not None:
+                self.write_callback(timestamp)
+            return
+
+        self.outbound_queue.put((data, timestamp, destination))
+        self.flush_outbound()
+
+    def flush_outbound(self):
+        """
+            Writes as much of the outbound queue as the socket and rate limiter will accept. If the socket fills up,
+            the remainder is written once the reactor reports the socket is writable again. If the rate limiter
+            refuses a line, writing resumes once the expected wait has passed. Without a reactor or timers, both are
+            retried on the next update.
+        """
+        try:
+            while True:
+                # Protocol lines go ahead of the queue, and ahead of a rate limited line that has not been started.
+                if len(self.control_output) != 0 and (self.pending_output is None or self.pending_permitted is False):
+                    control_line, control_timestamp = self.control_output[0]
+                    sent_length = self.socket.send(control_line)
+                    if sent_length < len(control_line):
+                        self.control_output[0] = (control_line[sent_length:], control_timestamp)
+                    else:
+                        self.control_output.popleft()
+                        if control_timestamp is not None and self.write_callback is not None:
+                            self.write_callback(control_timestamp)
+                    continue
+
+                if self.pending_output is None:
+                    queued_item = self.outbound_queue.get()
+                    if queued_item is None:
+                        break
+                    self.pending_output, self.pending_timestamp, self.pending_destination = queued_item
+                    self.pending_permitted = self.rate_limiter is None
+
+                if self.pending_permitted is False:
+                    wait = self.rate_limiter.acquire(self.pending_destination)
+                    if wait > 0:
+                        self.schedule_rate_limited_flush(wait)
+                        break
+                    self.pending_permitted = True
+
+                sent_length = self.socket.send(self.pending_output)
+                if sent_length < len(self.pending_output):
+                    self.pending_output = self.pending_output[sent_length:]
+                else:
+                    self.pending_output = None
+                    if self.pending_timestamp is not None and self.write_callback is not None:
+                        self.write_callback(self.pending_timestamp)
+        except (BlockingIOError, socket.timeout) as e:
+            pass
+        except socket.error as e:
+            # The read side notices the disconnection and reconnects, which discards the queue.
+            if self.debug_prints_enabled is True:
+                print("Failed to write to the server: %s" % str(e))
+            return
+
+        if self.reactor is not None:
+            if len(self.control_output) != 0 or (self.pending_output is not None and self.pending_permitted is not False):
+                self.reactor.set_writer(self.socket, self.flush_outbound)
+            else:
+                self.reactor.clear_writer(self.socket)
+
+    def schedule_rate_limited_flush(self, wait):
+        """
+            Arms the timer that resumes writing once the rate limiter permits the next line.
+
+            :param wait: The expected wait in seconds.
+        """
+        if self.timers is not None and self.rate_limit_timer is None:
+            self.rate_limit_timer = self.timers.call_later(wait, self.process_rate_limit_timer)
+
+    def process_rate_limit_timer(self):
+        """
+            Timer callback used to resume writing after the rate limiter refused a line.
+        """
+        self.rate_limit_timer = None
+        self.flush_outbound()
 
     def update(self, delta_time):
         """
@@ -175,14 +443,23 @@ class Connection(object):
 
             :param delta_time: The time since the last time this update function was called.
         """
+        for addon in self.addons:
+            addon.update(delta_time)
+
+        if self.outbound_queue is not None and (self.reactor is None or self.timers is None):
+            self.flush_outbound()
+
+        # Reads are dispatched by the reactor, so only the keepalive may need checking here.
+        if self.reactor is not None:
+            if self.timers is None:
+                self.check_keepalive()
+            return
+
         current_time = datetime.datetime.now()
         if self.ping_delay is not None and current_time - self.last_ping_time >= self.ping_delay:
             self.send("PING :DRAGON\r\n")
             self.last_ping_time = datetime.datetime.now()
 
-        for addon in self.addons:
-            addon.update(delta_time)
-
         received_data = None
         try:
             while True:
@@ -215,6 +492,18 @@ class Connection(object):
         except BlockingIOError as e:
             pass
 
+        self.process_buffer()
+
+    def process_buffer(self):
+        """
+            Processes every complete line currently in the receive buffer.
+        """
+        # A server that never terminates its lines must not grow the buffer without bound.
+        if len(self.buffer) > self.max_buffer_length and "\r\n" not in self.buffer:
+            self.buffer = ""
+            self.discarded_buffer_count += 1
+            return
+
         if "\r\n" in self.buffer:
             split = self.buffer.split("\r\n")
             self.buffer = split.pop()
@@ -278,7 +567,7 @@ class Connection(object):
 
                     # Handles for nick
                     elif words[1] == "NOTICE" and "nickserv" in words[0].lower() and not self.performed_identification and "registered" in return_buffer and self.password is not None:
-                        self.say_to("NickServ", "IDENTIFY %s" % self.password)
+                        self.send("PRIVMSG NickServ :IDENTIFY %s" % self.password)
                         self.performed_identification = True
                         self.password = None
                     elif words[1] == "NICK":
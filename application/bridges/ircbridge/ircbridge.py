@@ -17,7 +17,7 @@ import threading
 import collections
 
 from .irc import Connection
-from bridgesystem import BridgeBase, util
+from bridgesystem import BridgeBase, BridgeEvent, util
 
 class Bridge(BridgeBase):
     connection = None
@@ -30,6 +30,28 @@ class Bridge(BridgeBase):
         A map mapping user names to colors.
     """
 
+    polled = False
+    """
+        The IRC connection registers its socket with the reactor and its keepalive and rate limit timers with the
+        application's timers.
+    """
+
+    RATE_LIMIT = (0.5, 5)
+    """
+        IRC servers penalize every line a client sends by about two seconds and disconnect it for flooding once it is
+        more than ten seconds ahead, so the connection as a whole is limited to match.
+    """
+
+    COALESCE_LIMIT = 450
+    """
+        Every PRIVMSG is sent in 450 byte chunks, so coalesced messages are kept to a single chunk.
+    """
+
+    COALESCE_SEPARATOR = " | "
+    """
+        Each line of a message is sent as its own PRIVMSG, so coalesced messages share a line instead.
+    """
+
     def handle_strikethrough_format(self, match_data):
         """
             Handles processing of strike throughs on Discord.
@@ -48,6 +70,7 @@ class Bridge(BridgeBase):
         """
             Stops the addon.
         """
+        super(Bridge, self).stop()
 
     def start(self):
         """
@@ -70,10 +93,7 @@ class Bridge(BridgeBase):
             "OnPart": self.handle_irc_part,
         }
 
-        # Initialize the IRC formats in a specific order
-        self.DISCORD_TO_IRC_FORMATS["(\*{1,3})([^\*]+)\\1"] = ["\x1D%s\x1D", "\x02%s\x02", "\x02\x1D%s\x1D\x02"]
-        self.DISCORD_TO_IRC_FORMATS["(\_{1,4})([^_]+)\\1"] = ["\x1D%s\x1D", "\x1F%s\x1F", "\x1D\x1F%s\x1F\x1D", "\x1F%s\x1F"]
-        self.DISCORD_TO_IRC_FORMATS["(~{2,})([^_]+)\\1"] = self.handle_strikethrough_format
+        self.initialize_formats()
 
         channels = set(self.configuration.bridge_generic_config.broadcasting_channels + self.configuration.bridge_generic_config.receiving_channels)
         self.connection = Connection(address=self.configuration.bridge_internal_config["host"],
@@ -82,31 +102,51 @@ class Bridge(BridgeBase):
                                      ping_delay=datetime.timedelta(seconds=self.configuration.bridge_internal_config["pingSeconds"]),
                                      channels=list(channels),
                                      password=self.configuration.bridge_internal_config["password"] if "password" in self.configuration.bridge_internal_config else None,
-                                     event_handlers=event_handlers)
+                                     event_handlers=event_handlers,
+                                     reactor=self.application.reactor,
+                                     outbound_queue=self.outbound_queue,
+                                     write_callback=self.record_relay_latency,
+                                     rate_limiter=self.rate_limiter,
+                                     timers=self.application.timers)
 
         self.userlist = {}
 
+    def initialize_formats(self):
+        """
+            Initializes the IRC formats in a specific order.
+        """
+        self.DISCORD_TO_IRC_FORMATS["(\*{1,3})([^\*]+)\\1"] = ["\x1D%s\x1D", "\x02%s\x02", "\x02\x1D%s\x1D\x02"]
+        self.DISCORD_TO_IRC_FORMATS["(\_{1,4})([^_]+)\\1"] = ["\x1D%s\x1D", "\x1F%s\x1F", "\x1D\x1F%s\x1F\x1D", "\x1F%s\x1F"]
+        self.DISCORD_TO_IRC_FORMATS["(~{2,})([^_]+)\\1"] = self.handle_strikethrough_format
+
     def handle_irc_join(self, username, channel, hostmask):
         if self.configuration.bridge_generic_config.broadcast_join_leaves:
-            self.application.broadcast_event("on_receive_join", sender=self, joined_name=username, target_channels=[channel])
+            self.application.dispatch_event(BridgeEvent("on_receive_join", self, username, [channel]))
 
     def handle_irc_part(self, username, channel, hostmask, message):
         if self.configuration.bridge_generic_config.broadcast_join_leaves:
-            self.application.broadcast_event("on_receive_leave", sender=self, left_name=username, target_channels=[channel])
+            self.application.dispatch_event(BridgeEvent("on_receive_leave", self, username, [channel]))
 
     def handle_irc_quit(self, username, message, hostmask, channels):
         if self.configuration.bridge_generic_config.broadcast_join_leaves:
-            self.application.broadcast_event("on_receive_leave", sender=self, left_name=username, target_channels=channels)
+            self.application.dispatch_event(BridgeEvent("on_receive_leave", self, username, channels))
 
     def handle_irc_message(self, username, message, channel):
         if self.configuration.bridge_generic_config.broadcast_messages:
-            self.application.broadcast_event("on_receive_message", sender=self, sender_name=username, message=message, target_channels=[channel])
+            self.application.dispatch_event(BridgeEvent("on_receive_message", self, username, [channel], message))
+
+    def get_message_length(self, message):
+        """
+            IRC limits lines in bytes rather than characters.
+        """
+        return len(message.encode("utf8"))
 
     def send(self, sender, message, target_channels):
         message_lines = message.replace("\r", "").split("\n")
+        timestamp = self.get_relay_timestamp()
         for channel in target_channels:
             for line in message_lines:
-                self.connection.say(line, channel)
+                self.connection.say(line, channel, timestamp)
 
     def on_receive_message(self, sender, sender_name, message, target_channels):
         if sender_name not in self.configuration.bridge_generic_config.ignore_senders:
@@ -148,42 +188,7 @@ class Bridge(BridgeBase):
             if user_color is not None:
                 sender_name = "\x03%s%s\x03" % (user_color, sender_name)
 
-            # Produce the replacements before altering the string we are searching
-            while True:
-                generated_replacements = {}
-                for discord_pattern, irc_patterns in zip(self.DISCORD_TO_IRC_FORMATS.keys(), self.DISCORD_TO_IRC_FORMATS.values()):
-                    for match in re.finditer(discord_pattern, message):
-
-                        #    We need to perform processing for locating URL's in our matching sequences so the underscore characters
-                        #    aren't formatted into IRC URL's and screwing them.
-                        match_start = match.start()
-                        http_location = message.rfind("http://", None, match_start)
-                        https_location = message.rfind("https://", None, match_start)
-
-                        hypertext_start = None
-                        if http_location != -1:
-                            hypertext_start = http_location
-                        elif https_location != -1:
-                            hypertext_start = https_location
-
-                        # If there is a found hypertext, check if there is any spaces
-                        if hypertext_start is not None:
-                            potential_url = message[hypertext_start:match.end()]
-                            if " " not in potential_url:
-                                continue
-
-                        irc_pattern_index = len(match.group(1)) - 1
-                        if callable(irc_patterns) is True:
-                            generated_replacements[match.group(0)] = irc_patterns(match)
-                        else:
-                            generated_replacements[match.group(0)] = irc_patterns[irc_pattern_index] % match.group(2)
-
-                if len(generated_replacements) == 0:
-                    break
-
-                # Generate the final output message
-                for replaced_value, new_value in zip(generated_replacements.keys(), generated_replacements.values()):
-                    message = message.replace(replaced_value, new_value)
+            message = self.convert_discord_formatting(message)
 
             # Generate final output.
             message = "\x02<%s: %s>\x02 %s" % (sender.configuration.name, sender_name, message)
@@ -191,6 +196,51 @@ class Bridge(BridgeBase):
             # Send the message.
             self.send_buffered_message(sender=old_sender, target_channels=target_channels, message=message, buffer_size=450, send_function=self.send)
 
+    def convert_discord_formatting(self, message):
+        """
+            Translates Discord markdown in the given message to IRC formatting codes.
+
+            :param message: The message to translate.
+        """
+        # Produce the replacements before altering the string we are searching
+        while True:
+            generated_replacements = {}
+            for discord_pattern, irc_patterns in zip(self.DISCORD_TO_IRC_FORMATS.keys(), self.DISCORD_TO_IRC_FORMATS.values()):
+                for match in re.finditer(discord_pattern, message):
+
+                    #    We need to perform processing for locating URL's in our matching sequences so the underscore characters
+                    #    aren't formatted into IRC URL's and screwing them.
+                    match_start = match.start()
+                    http_location = message.rfind("http://", None, match_start)
+                    https_location = message.rfind("https://", None, match_start)
+
+                    hypertext_start = None
+                    if http_location != -1:
+                        hypertext_start = http_location
+                    elif https_location != -1:
+                        hypertext_start = https_location
+
+                    # If there is a found hypertext, check if there is any spaces
+                    if hypertext_start is not None:
+                        potential_url = message[hypertext_start:match.end()]
+                        if " " not in potential_url:
+                            continue
+
+                    irc_pattern_index = len(match.group(1)) - 1
+                    if callable(irc_patterns) is True:
+                        generated_replacements[match.group(0)] = irc_patterns(match)
+                    else:
+                        generated_replacements[match.group(0)] = irc_patterns[irc_pattern_index] % match.group(2)
+
+            if len(generated_replacements) == 0:
+                break
+
+            # Generate the final output message
+            for replaced_value, new_value in zip(generated_replacements.keys(), generated_replacements.values()):
+                message = message.replace(replaced_value, new_value)
+
+        return message
+
     def register_connection(self, connection):
         """
             Registers this addon with the given IRC connection.
@@ -10,16 +10,22 @@ import sys
 import time
 import random
 import socket
+import secrets
 import asyncio
 import datetime
+import functools
 import threading
+import traceback
 import tempfile
 import collections
+import concurrent.futures
+from urllib.parse import urlparse
 
 import telegram
+import telegram.utils.request
 
-from PIL import Image
-from bridgesystem import BridgeBase
+from bridgesystem import BridgeBase, BridgeEvent, MediaCache
+from bridgesystem.workers import Inbox, BridgeWorker
 
 class Bridge(BridgeBase):
     connection = None
@@ -27,9 +33,29 @@ class Bridge(BridgeBase):
         The telegram bot connection.
     """
 
-    most_recent_update_id = None
+    receive_thread = None
     """
-        The identifier of the most recent update.
+        The thread long polling the Bot API for updates.
+    """
+
+    inbox = None
+    """
+        The inbox the receive thread or webhook listener delivers updates to the core thread through.
+    """
+
+    webhook_path = None
+    """
+        When receiving by webhook, the path registered with the application's webhook listener.
+    """
+
+    webhook_lock = None
+    """
+        When receiving by webhook, the lock serializing deliveries so updates reach the inbox in order.
+    """
+
+    last_update_id = None
+    """
+        When receiving by webhook, the identifier of the last update delivered, used to drop redeliveries.
     """
 
     chat_mapping = None
@@ -37,10 +63,223 @@ class Bridge(BridgeBase):
         A mapping of chat channel names to ID's.
     """
 
+    chat_channels = None
+    """
+        A mapping of chat ID's to channel names, the reverse of chat_mapping.
+    """
+
+    sender = None
+    """
+        The worker sending messages to Telegram on a pool of SEND_THREADS threads.
+    """
+
+    chat_queues = None
+    """
+        A dictionary mapping chat ID's to deques of [message, timestamp, attempts] entries waiting to be sent.
+    """
+
+    chat_backlog = None
+    """
+        The total number of entries waiting in the chat queues.
+    """
+
+    sending_chats = None
+    """
+        The set of chat ID's with a message in flight.
+    """
+
+    chat_retry_times = None
+    """
+        A dictionary mapping chat ID's Telegram has rate limited to the monotonic time they may be sent to again.
+    """
+
+    send_timer = None
+    """
+        The pending timer used to schedule sends once the rate limiter permits the next message.
+    """
+
+    media_cache = None
+    """
+        The cache mapping Telegram's unique file ID's to hosted images when image hosting is enabled, so repeated
+        stickers and photos are never downloaded again.
+    """
+
+    SEND_THREADS = 8
+    """
+        The number of messages sent to Telegram at once, each to a different chat.
+    """
+
+    MAX_CHAT_BACKLOG = 256
+    """
+        The most messages held in the chat queues. Anything more waits in the outbound queue.
+    """
+
+    MAX_SEND_ATTEMPTS = 5
+    """
+        How many times a message Telegram rate limits is tried before it is dropped.
+    """
+
+    MEDIA_CACHE_CAPACITY = 4096
+    """
+        The most files remembered by the media cache.
+    """
+
+    LONG_POLL_SECONDS = 30
+    """
+        How long the Bot API holds each request for updates open while there are none.
+    """
+
+    RECEIVE_RETRY_SECONDS = 5
+    """
+        How long the receive thread waits before polling again after an error.
+    """
+
+    WEBHOOK_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+    """
+        The header Telegram presents the webhook's secret token in.
+    """
+
+    polled = False
+    """
+        Updates arrive through the receive thread's inbox and outbound messages are sent by the send threads and
+        the application's timers, so this bridge does not need to be updated every tick.
+    """
+
+    class ReceiveThread(threading.Thread):
+        """
+            Long polls the Bot API for updates on its own thread. Each request is held open by Telegram until an
+            update arrives or LONG_POLL_SECONDS pass, so updates are delivered as soon as they are sent while an idle
+            bridge makes one request every LONG_POLL_SECONDS.
+        """
+
+        bridge = None
+        """
+            The bridge updates are received for.
+        """
+
+        offset = None
+        """
+            The identifier of the next update to receive. Requesting it confirms every update before it.
+        """
+
+        running = None
+        """
+            Whether or not the thread should keep polling.
+        """
+
+        offset_path = None
+        """
+            The path the offset is saved to, so a restarted bridge resumes where it stopped instead of skipping
+            whatever was sent in between.
+        """
+
+        def __init__(self, bridge, offset_path):
+            super(Bridge.ReceiveThread, self).__init__(name="%s-receive" % bridge.configuration.name, daemon=True)
+            self.bridge = bridge
+            self.offset_path = offset_path
+            self.running = True
+
+            try:
+                with open(self.offset_path, "r") as handle:
+                    self.offset = int(handle.read().strip())
+            except (OSError, ValueError) as e:
+                self.offset = None
+
+        def save_offset(self):
+            try:
+                with open(self.offset_path, "w") as handle:
+                    handle.write("%u\n" % self.offset)
+            except OSError as e:
+                print("!!! Failed to save the Telegram update offset: %s" % str(e))
+
+        def run(self):
+            connection = self.bridge.connection
+            while self.running:
+                try:
+                    if self.offset is None:
+                        # Polling fails while a webhook from an earlier run is set.
+                        connection.delete_webhook()
+
+                        # Skip anything sent before the bridge first ran. An offset of -1 returns only the latest update.
+                        updates = connection.get_updates(offset=-1, timeout=0)
+                        self.offset = updates[-1].update_id + 1 if len(updates) != 0 else 0
+                        self.save_offset()
+                        continue
+
+                    updates = connection.get_updates(offset=self.offset, timeout=self.bridge.LONG_POLL_SECONDS)
+                except telegram.error.TimedOut as e:
+                    continue
+                except telegram.error.TelegramError as e:
+                    print("!!! Failed to receive Telegram updates: %s" % str(e))
+                    time.sleep(self.bridge.RECEIVE_RETRY_SECONDS)
+                    continue
+                except Exception as e:
+                    print("!!! Receiving Telegram updates threw an exception: %s" % traceback.format_exc())
+                    time.sleep(self.bridge.RECEIVE_RETRY_SECONDS)
+                    continue
+
+                if len(updates) == 0 or self.running is False:
+                    continue
+
+                # Confirm the updates before handling them, so one that cannot be handled is not received forever.
+                self.offset = max(update.update_id for update in updates) + 1
+                self.save_offset()
+
+                try:
+                    relayed_messages = self.bridge.receive_updates(updates)
+                except Exception as e:
+                    print("!!! Handling Telegram updates threw an exception: %s" % traceback.format_exc())
+                    continue
+
+                if len(relayed_messages) != 0:
+                    self.bridge.inbox.put(self.bridge.relay_updates, relayed_messages)
+
+        def stop(self):
+            """
+                Stops polling. A request already in flight is abandoned rather than waited for.
+            """
+            self.running = False
+
+    RATE_LIMIT = (30.0, 30)
+    """
+        The Bot API accepts about thirty messages per second across all chats.
+    """
+
+    DESTINATION_RATE_LIMIT = (1.0, 3)
+    """
+        The Bot API accepts about one message per second in any single chat, with short bursts tolerated.
+    """
+
+    COALESCE_LIMIT = 4000
+    """
+        Telegram messages may be up to 4096 characters, leaving room for formatting.
+    """
+
     def stop(self):
         """
             Stops the addon.
         """
+        if self.receive_thread is not None:
+            self.receive_thread.stop()
+            self.receive_thread = None
+
+        if self.webhook_path is not None:
+            self.application.webhook_server.unregister(self.webhook_path)
+            self.webhook_path = None
+
+        if self.send_timer is not None:
+            self.send_timer.cancel()
+            self.send_timer = None
+
+        if self.sender is not None:
+            self.sender.shutdown()
+            self.sender = None
+
+        if self.media_cache is not None:
+            self.media_cache.close()
+            self.media_cache = None
+
+        super(Bridge, self).stop()
 
     def start(self):
         """
@@ -51,29 +290,217 @@ class Bridge(BridgeBase):
         self.register_event("on_receive_message", self.on_receive_message)
         self.register_event("on_receive_leave", self.on_receive_leave)
         self.register_event("on_receive_join", self.on_receive_join)
-        self.connection = telegram.Bot(token=self.configuration.bridge_internal_config["token"])
+        # Pool enough keep-alive connections for every send thread, the receive thread and file lookups.
+        self.connection = telegram.Bot(token=self.configuration.bridge_internal_config["token"],
+                                       request=telegram.utils.request.Request(con_pool_size=self.SEND_THREADS + 2))
 
         self.chat_mapping = self.configuration.bridge_internal_config["chatMapping"]
+        self.chat_channels = {}
+        for channel_name, identifiers in self.chat_mapping.items():
+            for identifier in identifiers:
+                self.chat_channels.setdefault(identifier, channel_name)
+
+        if self.application.image_pipeline is not None:
+            self.media_cache = MediaCache(self.get_data_path("mediaCache.index"), capacity=self.MEDIA_CACHE_CAPACITY)
+        self.sender = BridgeWorker(self.application, "%s-send" % self.configuration.name, worker_threads=self.SEND_THREADS)
+        self.chat_queues = {}
+        self.chat_backlog = 0
+        self.sending_chats = set()
+        self.chat_retry_times = {}
+
+        self.inbox = Inbox(self.application)
+        internal_config = self.configuration.bridge_internal_config
+        if internal_config.get("receiveMode", "poll") == "webhook":
+            self.start_webhook(internal_config["webhookURL"], internal_config.get("webhookSecret"))
+        else:
+            self.receive_thread = Bridge.ReceiveThread(self, self.get_data_path("updateOffset"))
+            self.receive_thread.start()
+
+    def start_webhook(self, url, secret_token=None):
+        """
+            Receives updates by webhook instead of polling. The bridge registers with the application's webhook
+            listener, which the given URL must reach, and has Telegram deliver to it.
 
-    def on_receive_join(self, sender, joined_name, target_channels):
+            :param url: The public URL Telegram posts updates to. Its path is the path registered with the listener.
+            :param secret_token: The secret Telegram presents with every delivery. If None, a random one is used.
+        """
+        # Telegram only accepts letters, digits, underscores and hyphens in secret tokens.
+        secret_token = secret_token if secret_token else secrets.token_urlsafe(32)
+
+        self.webhook_path = urlparse(url).path or "/"
+        self.webhook_lock = threading.Lock()
+        self.last_update_id = -1
+        self.application.webhook_server.register(self.webhook_path, self.receive_webhook, secret_header=self.WEBHOOK_SECRET_HEADER,
+                                                 secret_token=secret_token)
+
+        try:
+            # Bot.set_webhook in the pinned library drops any parameter it does not know, including secret_token, so
+            # the request is posted directly. A single connection keeps deliveries in order.
+            self.connection._request.post("%s/setWebhook" % self.connection.base_url, {"url": url, "max_connections": 1,
+                                                                                        "secret_token": secret_token})
+        except telegram.error.TelegramError as e:
+            print("!!! Failed to set the Telegram webhook for '%s': %s" % (self.configuration.name, str(e)))
+
+    def receive_webhook(self, payload):
+        """
+            Handles an update delivered by webhook. This runs on a webhook listener thread.
+
+            :param payload: The decoded JSON of the update.
+        """
+        update = telegram.Update.de_json(payload, self.connection)
+        with self.webhook_lock:
+            # Telegram delivers an update again if it did not see the previous delivery acknowledged.
+            if update is None or update.update_id <= self.last_update_id:
+                return
+            self.last_update_id = update.update_id
+
+            relayed_messages = self.receive_updates([update])
+            if len(relayed_messages) != 0:
+                self.inbox.put(self.relay_updates, relayed_messages)
+
+    def get_event_channels(self, name):
+        """
+            Only channels with a chat mapping are relayed to Telegram.
+        """
+        channels = super(Bridge, self).get_event_channels(name)
+        if channels is None:
+            channels = set(self.configuration.bridge_internal_config["chatMapping"].keys())
+        return channels
+
+    def get_chat_identifiers(self, target_channels):
+        """
+            Returns the chat ID's mapped to the given channels, in order.
+        """
+        chat_identifiers = []
         for channel in target_channels:
             if channel in self.chat_mapping.keys():
-                for chat_id in self.chat_mapping[channel]:
-                    generated_message = "<%s: %s> joined %s" % (sender.configuration.name, joined_name, ", ".join(target_channels))
-                    self.connection.send_message(text=generated_message, chat_id=chat_id)
+                chat_identifiers += self.chat_mapping[channel]
+        return chat_identifiers
+
+    def queue_chat_message(self, chat_identifiers, message):
+        """
+            Queues a message for the given chats on the outbound queue and schedules whatever can be sent.
+        """
+        if len(chat_identifiers) == 0:
+            return
+
+        self.outbound_queue.put((chat_identifiers, message, self.get_relay_timestamp()))
+        self.schedule_sends()
+
+    def schedule_sends(self):
+        """
+            Moves messages from the outbound queue into the per chat queues and starts a send for every chat that
+            has none in flight and that the rate limiter permits. If the rate limiter holds any chat back, a timer
+            calls this again once the earliest one is permitted. This is always called on the core thread.
+        """
+        if self.sender is None:
+            return
+
+        # Only take from the outbound queue while the chat queues are short, so its capacity and overflow policy
+        # keep applying while Telegram is slow.
+        while self.chat_backlog < self.MAX_CHAT_BACKLOG:
+            queued_item = self.outbound_queue.get()
+            if queued_item is None:
+                break
+
+            chat_identifiers, message, timestamp = queued_item
+            for chat_id in chat_identifiers:
+                self.chat_queues.setdefault(chat_id, collections.deque()).append([message, timestamp, 0])
+                self.chat_backlog += 1
+
+        now = time.monotonic()
+        next_wait = None
+        for chat_id, chat_queue in self.chat_queues.items():
+            if chat_id in self.sending_chats or len(chat_queue) == 0:
+                continue
+
+            wait = self.chat_retry_times.get(chat_id, now) - now
+            if wait <= 0:
+                wait = self.rate_limiter.acquire(chat_id)
+            if wait > 0:
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+                continue
+
+            # Only one message per chat is in flight, so every chat receives its messages in order.
+            self.chat_retry_times.pop(chat_id, None)
+            self.sending_chats.add(chat_id)
+            message, timestamp, attempts = chat_queue.popleft()
+            self.chat_backlog -= 1
+            self.sender.submit(self.send_chat_message, chat_id, message, on_complete=functools.partial(self.complete_send, chat_id, [message, timestamp, attempts + 1]))
+
+        # Drop the queues of chats that have gone quiet.
+        if len(self.chat_queues) > len(self.sending_chats) + self.MAX_CHAT_BACKLOG:
+            self.chat_queues = {chat_id: chat_queue for chat_id, chat_queue in self.chat_queues.items() if len(chat_queue) != 0 or chat_id in self.sending_chats}
+
+        if next_wait is not None and self.send_timer is None:
+            self.send_timer = self.application.timers.call_later(next_wait, self.process_send_timer)
+
+    def process_send_timer(self):
+        """
+            Timer callback used once the rate limiter permits the next message.
+        """
+        self.send_timer = None
+        self.schedule_sends()
+
+    def send_chat_message(self, chat_id, message):
+        """
+            Sends a message to a single chat. This runs on a send thread.
+
+            :return: None if the message was sent or failed for good, otherwise the number of seconds Telegram asked
+                us to wait before retrying it.
+        """
+        try:
+            self.connection.send_message(text=message, chat_id=chat_id)
+        except telegram.error.RetryAfter as e:
+            return float(e.retry_after)
+        except telegram.error.TelegramError as e:
+            print("!!! Failed to send a message to Telegram chat %s: %s" % (chat_id, str(e)))
+            return None
+        return 0.0
+
+    def complete_send(self, chat_id, entry, retry_after):
+        """
+            Called on the core thread once a send has finished. A message Telegram rate limited is put back at the
+            front of its chat's queue and retried once the server's retry after has passed.
+
+            :param entry: The [message, timestamp, attempts] entry that was sent.
+            :param retry_after: The result of send_chat_message.
+        """
+        self.sending_chats.discard(chat_id)
+
+        if retry_after == 0:
+            self.record_relay_latency(entry[1])
+        elif retry_after is not None:
+            if entry[2] < self.MAX_SEND_ATTEMPTS:
+                self.chat_queues.setdefault(chat_id, collections.deque()).appendleft(entry)
+                self.chat_backlog += 1
+                self.chat_retry_times[chat_id] = time.monotonic() + retry_after
+            else:
+                print("!!! Dropping a message to Telegram chat %s after %u rate limited attempts." % (chat_id, entry[2]))
+
+        self.schedule_sends()
+
+    def coalesce_outbound(self, queued_item, new_item):
+        """
+            Messages to the same chats are merged as long as they fit in a single Telegram message. The merged message
+            keeps the older timestamp.
+        """
+        queued_chats, queued_message, queued_timestamp = queued_item
+        new_chats, new_message, new_timestamp = new_item
+        if queued_chats == new_chats and len(queued_message) + len(new_message) + 1 <= self.COALESCE_LIMIT:
+            return (queued_chats, "%s\n%s" % (queued_message, new_message), queued_timestamp)
+        return None
+
+    def on_receive_join(self, sender, joined_name, target_channels):
+        generated_message = "<%s: %s> joined %s" % (sender.configuration.name, joined_name, ", ".join(target_channels))
+        self.send_coalesced(joined_name, target_channels, generated_message, self.send)
 
     def on_receive_leave(self, sender, left_name, target_channels):
-        for channel in target_channels:
-            if channel in self.chat_mapping.keys():
-                for chat_id in self.chat_mapping[channel]:
-                    generated_message = "<%s: %s> left %s" % (sender.configuration.name, left_name, ", ".join(target_channels))
-                    self.connection.send_message(text=generated_message, chat_id=chat_id)
+        generated_message = "<%s: %s> left %s" % (sender.configuration.name, left_name, ", ".join(target_channels))
+        self.send_coalesced(left_name, target_channels, generated_message, self.send)
 
     def send(self, sender, message, target_channels):
-        for channel in target_channels:
-            if channel in self.chat_mapping.keys():
-                for chat_id in self.chat_mapping[channel]:
-                    self.connection.send_message(text=message, chat_id=chat_id)
+        self.queue_chat_message(self.get_chat_identifiers(target_channels), message)
 
     def on_receive_message(self, sender, sender_name, message, target_channels):
         if sender_name not in self.configuration.bridge_generic_config.ignore_senders:
@@ -87,110 +514,145 @@ class Bridge(BridgeBase):
             :param connection: The IRC connection we are being associated with.
         """
 
-    def get_most_recent_update(self, updates):
-        most_recent = None
-        for update in updates:
-            if update.message is not None:
-                if most_recent is None:
-                    most_recent = update
-                elif update.message.date > most_recent.message.date:
-                    most_recent = update
-        return most_recent
-
     def get_channel_from_identifier(self, identifier):
-        for channel_name, identifiers in zip(self.chat_mapping.keys(), self.chat_mapping.values()):
-            if identifier in identifiers:
-                return channel_name
-        return None
+        return self.chat_channels.get(identifier)
 
     def update(self, delta_time):
         """
-            Process an update tick.
+            Process an update tick. On the fixed tick loop, this delivers updates from the receive thread and the
+            results of sends.
 
             :param delta_time: The time since the last time addon updates were processed.
         """
-
         super(Bridge, self).update(delta_time)
+        self.inbox.drain()
+        if self.sender is not None:
+            self.sender.drain()
 
+    def relay_updates(self, relayed_messages):
+        """
+            Broadcasts the messages produced by receive_updates. This is always called on the core thread, through
+            the inbox. Messages with an image are relayed right away with a placeholder and the hosted URL follows
+            once it is ready.
+
+            :param relayed_messages: A list of (sender name, message, channel name, image) tuples.
+        """
+        if self.configuration.bridge_generic_config.broadcast_messages:
+            for sender_name, message_text, channel_name, image in relayed_messages:
+                if image is not None:
+                    future, image_type, caption = image
+                    self.relay_when_ready((future,), functools.partial(self.relay_image, sender_name, channel_name, image_type), key=sender_name)
+                    message_text = "(%s to follow): %s" % (image_type, caption)
+
+                self.application.dispatch_event(BridgeEvent("on_receive_message", self, sender_name, [channel_name], message_text))
+
+    def relay_image(self, sender_name, channel_name, image_type, futures):
+        """
+            Relays the hosted URL of an image once it has been processed. Follow-ups from the same sender are relayed
+            in the order their messages were received.
+
+            :param futures: The future hosting the image.
+        """
         try:
-            updates = self.connection.get_updates(offset=self.most_recent_update_id)
+            message_text = "(%s %s )" % (image_type, self.get_hosted_image_url(futures[0].result()))
+        except Exception as e:
+            # Anything from a failed download to a decompression bomb or a dead transcoding pool lands here.
+            message_text = "(%s Failed to generate URL: %s)" % (image_type, str(e))
 
-            if self.most_recent_update_id is None:
-                readback_time = datetime.datetime.now() + datetime.timedelta(seconds=10)
-                most_recent_update = self.get_most_recent_update(updates)
+        self.application.dispatch_event(BridgeEvent("on_receive_message", self, sender_name, [channel_name], message_text))
 
-                if most_recent_update is not None:
-                    self.most_recent_update_id = most_recent_update.update_id
-                updates = [update for update in updates if update.message is not None and update.message.date >= readback_time]
-            else:
-                updates = [update for update in updates if update.update_id != self.most_recent_update_id]
-
-            # Group by channels
-            chat_updates = {}
-            for update in updates:
-                if update.message is not None:
-                    chat_identifier = update.message.chat_id
-                    chat_updates.setdefault(chat_identifier, [])
-                    chat_updates[chat_identifier].append(update)
-
-            # Record the most recent ipdate ID
-            most_recent_update = self.get_most_recent_update(updates)
-            if most_recent_update is not None:
-                self.most_recent_update_id = most_recent_update.update_id
-
-            # Process all of the channel messages now
-            for chat_identifier, updates in zip(chat_updates.keys(), chat_updates.values()):
-                # Look up the channel name
-                channel_name = self.get_channel_from_identifier(chat_identifier)
-                if channel_name is None or channel_name not in self.configuration.bridge_generic_config.broadcasting_channels:
+    def receive_updates(self, updates):
+        """
+            Turns updates from the Bot API into messages to relay and starts hosting any attached images. This runs
+            on the receive thread or a webhook listener thread.
+
+            :param updates: The updates received, in order.
+            :return: A list of (sender name, message, channel name, image) tuples to relay.
+        """
+        relayed_messages = []
+        broadcasting_channels = self.configuration.bridge_generic_config.broadcasting_channels
+
+        for update in updates:
+            if update.message is not None:
+                channel_name = self.get_channel_from_identifier(update.message.chat_id)
+                if channel_name is None or channel_name not in broadcasting_channels:
                     continue
 
-                for update in updates:
-                    message_text = "(No Comment)" if update.message.text is None else update.message.text
-
-                    # Download the file if necessary.
-                    if self.global_configuration.global_configuration.image_hosting.enabled:
-                        file_id = None
-                        image_type = None
-
-                        if update.message.sticker is not None:
-                            image_type = "Telegram Sticker"
-                            file_id = update.message.sticker.file_id
-                        elif update.message.photo is not None and len(update.message.photo) != 0:
-                            image_type = "Telegram Photo"
-                            largest_photo = update.message.photo[0]
-                            for photo_size in update.message.photo:
-                                if photo_size.width >= largest_photo.width and photo_size.height >= largest_photo.height:
-                                    largest_photo = photo_size
-                            file_id = largest_photo.file_id
-
-                        # Handle the image hosting. FIXME: Handle re-generation of URL's from stuff already on file.
-                        if file_id is not None:
-                            handle = self.connection.get_file(file_id=file_id)
-                            _, temp_path = tempfile.mkstemp()
-                            handle.download(custom_path=temp_path)
-
-                            # Convert the image and ensure it's in PNG
-                            try:
-                                image_handle = Image.open(temp_path)
-                                image_handle.save(temp_path, "PNG")
-                                image_handle.close()
-
-                                generated_name = self.get_hosted_image_from_path(temp_path, extension=".png")
-                                generated_url = self.get_hosted_image_url(generated_name)
-                                message_text = "(%s %s ): %s" % (image_type, generated_url, "No Caption" if update.message.caption is None else update.message.caption)
-                            except OSError as e:
-                                os.remove(temp_path)
-                                message_text = "(%s Failed to generate URL: %s): %s" % (image_type, str(e), "No Caption" if update.message.caption is None else update.message.caption)
-
-                    if self.configuration.bridge_generic_config.broadcast_messages:
-                        self.application.broadcast_event("on_receive_message",
-                        sender=self,
-                        sender_name=update.message.from_user.username,
-                        message=message_text,
-                        target_channels=[channel_name])
-        except telegram.error.TimedOut as e:
-            pass
+                message_text = "(No Comment)" if update.message.text is None else update.message.text
+                image = None
+
+                # Download the file if necessary.
+                if self.application.image_pipeline is not None:
+                    media = None
+                    image_type = None
+
+                    if update.message.sticker is not None:
+                        image_type = "Telegram Sticker"
+                        media = update.message.sticker
+                    elif update.message.photo is not None and len(update.message.photo) != 0:
+                        image_type = "Telegram Photo"
+                        media = update.message.photo[0]
+                        for photo_size in update.message.photo:
+                            if photo_size.width >= media.width and photo_size.height >= media.height:
+                                media = photo_size
+
+                    # Handle the image hosting. Files hosted before are found by their unique ID without any
+                    # request, and images already on file are recognized by their content and are not transcoded
+                    # or stored again. Transcoding finishes in the pipeline's processes.
+                    if media is not None:
+                        caption = "No Caption" if update.message.caption is None else update.message.caption
+                        image = (self.host_file(media), image_type, caption)
+
+                relayed_messages.append((update.message.from_user.username, message_text, channel_name, image))
+
+        return relayed_messages
+
+    def host_file(self, media):
+        """
+            Hosts a Telegram file, answering from the media cache if it has been hosted before.
+
+            :param media: The sticker or photo size to host.
+            :return: A future resolving to the name of the hosted image.
+        """
+        # The unique ID is the same for every bot and never changes, unlike the file ID used to download it.
+        unique_id = getattr(media, "file_unique_id", None) or media.file_id
+
+        name = self.media_cache.get(unique_id)
+        if name is not None:
+            if self.application.image_store.lookup(name):
+                future = concurrent.futures.Future()
+                future.set_result(name)
+                return future
+            self.media_cache.remove(unique_id)
+
+        future = self.host_image(functools.partial(self.download_file, media.file_id))
+        future.add_done_callback(lambda future: self.cache_hosted_file(unique_id, future))
+        return future
+
+    def cache_hosted_file(self, unique_id, future):
+        """
+            Records a newly hosted file in the media cache. This runs on the thread that completed the future.
+        """
+        if future.cancelled() is False and future.exception() is None and self.media_cache is not None:
+            self.media_cache.put(unique_id, future.result())
+
+    def download_file(self, file_id, output):
+        """
+            Downloads a Telegram file into the given file-like object over the application's pooled connections. This
+            runs on a download thread.
+        """
+        handle = self.connection.get_file(file_id=file_id)
+        self.application.downloader.download(handle.file_path, output)
+
+    def collect_metrics(self):
+        """
+            Reports the media cache alongside the metrics every bridge reports.
+        """
+        super(Bridge, self).collect_metrics()
+
+        if self.media_cache is not None:
+            self.application.metrics.set_counter("pybridge_media_cache_hits_total", self.metric_labels, self.media_cache.hit_count)
+            self.application.metrics.set_counter("pybridge_media_cache_misses_total", self.metric_labels, self.media_cache.miss_count)
 
     def get_commands(self):
         return {}
@@ -13,7 +13,7 @@ import datetime
 import threading
 import collections
 
-from bridgesystem import BridgeBase
+from bridgesystem import BridgeBase, BridgeEvent
 
 class Bridge(BridgeBase):
     """
@@ -45,6 +45,37 @@ class Bridge(BridgeBase):
         The last time a heartbeat was received from the Tribes 2 server.
     """
 
+    heartbeat_timer = None
+    """
+        The pending timer that considers the Tribes 2 server dead if no heartbeat arrives before it fires.
+    """
+
+    reconnect_timer = None
+    """
+        The pending timer for the next connection attempt, if any.
+    """
+
+    pending_output = None
+    """
+        The remainder of a message that was only partially written to the Tribes 2 server.
+    """
+
+    pending_timestamp = None
+    """
+        The timestamp queued with the partially written message.
+    """
+
+    rate_limit_timer = None
+    """
+        The pending timer used to resume writing once the rate limiter permits the next message.
+    """
+
+    polled = False
+    """
+        Received data is handled by the reactor and heartbeats and reconnects by the application's timers, so this
+        bridge does not need to be updated every tick.
+    """
+
     RECONNECT_ATTEMPT_TIME = datetime.timedelta(seconds=5)
     """
         How long between connection attempts to wait.
@@ -65,21 +96,87 @@ class Bridge(BridgeBase):
         """
             Stops the addon.
         """
+        if self.heartbeat_timer is not None:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+
+        if self.reconnect_timer is not None:
+            self.reconnect_timer.cancel()
+            self.reconnect_timer = None
+
+        if self.rate_limit_timer is not None:
+            self.rate_limit_timer.cancel()
+            self.rate_limit_timer = None
+
+        super(Bridge, self).stop()
 
     def on_receive_message(self, sender, sender_name, message, target_channels):
         for target_channel in target_channels:
             if target_channel in self.configuration["channels"] and self.tribal_connection is not None and sender_name not in self.configuration["ignoreSenders"]:
                 produced_message = bytes("MESSAGE\r\n%s\r\n%s\r\n%s\r\n" % (sender_name, sender.configuration["name"], message), "ascii", errors="replace")
-                self.tribal_connection.send(produced_message)
+                self.outbound_queue.put((produced_message, self.get_relay_timestamp()))
+                self.flush_outbound()
                 return
 
+    def flush_outbound(self):
+        """
+            Writes as much of the outbound queue as the socket and rate limiter will accept. If the socket fills up,
+            the remainder is written once the reactor reports the socket is writable again. If the rate limiter
+            refuses a message, writing resumes once the expected wait has passed.
+        """
+        if self.tribal_connection is None:
+            return
+
+        try:
+            while True:
+                if self.pending_output is None:
+                    if len(self.outbound_queue) == 0:
+                        break
+
+                    wait = self.rate_limiter.acquire()
+                    if wait > 0:
+                        if self.rate_limit_timer is None:
+                            self.rate_limit_timer = self.application.timers.call_later(wait, self.process_rate_limit_timer)
+                        break
+
+                    queued_item = self.outbound_queue.get()
+                    if queued_item is None:
+                        break
+                    self.pending_output, self.pending_timestamp = queued_item
+
+                sent_length = self.tribal_connection.send(self.pending_output)
+                if sent_length < len(self.pending_output):
+                    self.pending_output = self.pending_output[sent_length:]
+                else:
+                    self.pending_output = None
+                    self.record_relay_latency(self.pending_timestamp)
+        except (BlockingIOError, InterruptedError) as e:
+            pass
+        except socket.error as e:
+            self.close_connection("a socket error")
+            return
+
+        if self.pending_output is not None:
+            self.application.reactor.set_writer(self.tribal_connection, self.flush_outbound)
+        else:
+            self.application.reactor.clear_writer(self.tribal_connection)
+
+    def process_rate_limit_timer(self):
+        """
+            Timer callback used to resume writing after the rate limiter refused a message.
+        """
+        self.rate_limit_timer = None
+        self.flush_outbound()
+
     def establish_connection(self):
         now = datetime.datetime.now()
+        self.reconnect_timer = None
 
         try:
             self.tribal_connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.tribal_connection.connect((self.configuration["address"], self.configuration["port"]))
-            self.tribal_connection.settimeout(0.2)
+            self.tribal_connection.setblocking(False)
+            self.application.reactor.register(self.tribal_connection, self.handle_readable)
 
             if self.last_connection_attempt is not None:
                 self.application.broadcast_event("on_receive_message",
@@ -88,8 +185,13 @@ class Bridge(BridgeBase):
                 message="Successfully established a connection to the Tribes 2 server after previous connectivity problems.",
                 target_channels=self.configuration["channels"])
             self.last_heartbeat_time = now
+            self.schedule_heartbeat_check()
+
+            # Anything still queued when the previous connection was lost goes out now.
+            self.flush_outbound()
         except ConnectionRefusedError as e:
             self.tribal_connection = None
+            self.schedule_reconnect()
 
             if self.last_connection_attempt is None:
                 self.application.broadcast_event("on_receive_message",
@@ -99,6 +201,55 @@ class Bridge(BridgeBase):
                 target_channels=self.configuration["channels"])
         self.last_connection_attempt = now
 
+    def close_connection(self, reason):
+        """
+            Closes the connection to the Tribes 2 server and lets the domain know that we will reconnect.
+
+            :param reason: A description of why the connection was lost.
+        """
+        if self.heartbeat_timer is not None:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+
+        self.application.reactor.unregister(self.tribal_connection)
+        self.tribal_connection.close()
+        self.tribal_connection = None
+
+        # The rest of a partially written message is meaningless to a new connection.
+        self.pending_output = None
+        self.schedule_reconnect()
+
+        self.application.broadcast_event("on_receive_message",
+        sender=self,
+        sender_name="Internal System",
+        message="Lost the connection to the Tribes 2 server due to %s. Will attempt to reconnect on a delay of %s." % (reason, self.RECONNECT_ATTEMPT_TIME),
+        target_channels=self.configuration["channels"])
+        self.last_connection_attempt = datetime.datetime.now()
+
+    def schedule_heartbeat_check(self):
+        """
+            Restarts the heartbeat timeout. Called whenever we hear from the Tribes 2 server, so the timer only fires
+            once it has been quiet for HEARTBEAT_ERROR_TIME.
+        """
+        if self.heartbeat_timer is not None:
+            self.heartbeat_timer.cancel()
+        self.heartbeat_timer = self.application.timers.call_later(self.HEARTBEAT_ERROR_TIME, self.process_heartbeat_timeout)
+
+    def process_heartbeat_timeout(self):
+        """
+            Timer callback used when the Tribes 2 server has missed its heartbeats.
+        """
+        self.heartbeat_timer = None
+        if self.tribal_connection is not None:
+            self.close_connection("a timeout")
+
+    def schedule_reconnect(self):
+        """
+            Arms the timer for the next connection attempt, if one is not armed already.
+        """
+        if self.reconnect_timer is None:
+            self.reconnect_timer = self.application.timers.call_later(self.RECONNECT_ATTEMPT_TIME, self.establish_connection)
+
     def start(self):
         """
             Starts the addon after it has been initialized and all connections associated. This is called after
@@ -108,85 +259,41 @@ class Bridge(BridgeBase):
         self.register_event("on_receive_message", self.on_receive_message)
         self.establish_connection()
 
-    def update(self, delta_time):
+    def handle_readable(self):
         """
-            Process an update tick.
-
-            :param delta_time: The time since the last time addon updates were processed.
+            Called by the reactor when the Tribes 2 server has sent us data.
         """
+        try:
+            received_data = self.tribal_connection.recv(self.receive_buffer_size)
+        except socket.error as e:
+            socket_error = e.args[0]
+            if socket_error != errno.EWOULDBLOCK and socket_error != errno.EAGAIN:
+                self.close_connection("a socket error")
+            return
 
-        now = datetime.datetime.now()
-        if self.tribal_connection is not None:
-            received_data = None
-            try:
-                received_data = self.tribal_connection.recv(self.receive_buffer_size)
-            except socket.error as e:
-                socket_error = e.args[0]
-                if socket_error != errno.EWOULDBLOCK and socket_error != errno.EAGAIN and socket_error != "timed out":
-                    self.tribal_connection.close()
-                    self.tribal_connection = None
-
-                    self.application.broadcast_event("on_receive_message",
-                    sender=self,
-                    sender_name="Internal System",
-                    message="Lost the connection to the Tribes 2 server due to a socket error. Will attempt to reconnect on a delay of %s." % self.RECONNECT_ATTEMPT_TIME,
-                    target_channels=self.configuration["channels"])
-                    self.last_connection_attempt = now
-                    return
-                elif now - self.last_heartbeat_time >= self.HEARTBEAT_ERROR_TIME:
-                    self.tribal_connection.close()
-                    self.tribal_connection = None
-
-                    self.application.broadcast_event("on_receive_message",
-                    sender=self,
-                    sender_name="Internal System",
-                    message="Lost the connection to the Tribes 2 server due to a timeout. Will attempt to reconnect on a delay of %s." % self.RECONNECT_ATTEMPT_TIME,
-                    target_channels=self.configuration["channels"])
-                    self.last_connection_attempt = now
-                    return
-
-            if received_data is not None:
-                self.message_buffer += received_data.decode("ascii", errors="replace")
-
-            if "\r\n" in self.message_buffer:
-                received_messages = self.message_buffer.split("\r\n")
-                self.message_buffer = received_messages.pop()
-
-                for received_message in received_messages:
-                    message_components = received_message.split("\n")
-
-                    message_type = message_components[0]
-                    if message_type == "MESSAGE":
-                        self.application.broadcast_event("on_receive_message",
-                        sender=self,
-                        sender_name=message_components[1],
-                        message=message_components[2],
-                        target_channels=self.configuration["channels"])
-                    elif message_type == "CONNECT":
-                        self.application.broadcast_event("on_receive_join",
-                        sender=self,
-                        joined_name=message_components[1],
-                        target_channels=self.configuration["channels"])
-                    elif message_type == "DISCONNECT":
-                        self.application.broadcast_event("on_receive_leave",
-                        sender=self,
-                        left_name=message_components[1],
-                        target_channels=self.configuration["channels"])
-                    elif message_type == "HEARTBEAT":
-                        self.last_heartbeat_time = now
-            elif now - self.last_heartbeat_time >= self.HEARTBEAT_ERROR_TIME:
-                self.tribal_connection.close()
-                self.tribal_connection = None
+        if len(received_data) == 0:
+            self.close_connection("a socket error")
+            return
 
-                self.application.broadcast_event("on_receive_message",
-                sender=self,
-                sender_name="Internal System",
-                message="Lost the connection to the Tribes 2 server due to a timeout. Will attempt to reconnect on a delay of %s." % self.RECONNECT_ATTEMPT_TIME,
-                target_channels=self.configuration["channels"])
-                self.last_connection_attempt = now
-                return
-        elif now - self.last_connection_attempt >= self.RECONNECT_ATTEMPT_TIME:
-            self.establish_connection()
+        self.message_buffer += received_data.decode("ascii", errors="replace")
+
+        if "\r\n" in self.message_buffer:
+            received_messages = self.message_buffer.split("\r\n")
+            self.message_buffer = received_messages.pop()
+
+            for received_message in received_messages:
+                message_components = received_message.split("\n")
+
+                message_type = message_components[0]
+                if message_type == "MESSAGE":
+                    self.application.dispatch_event(BridgeEvent("on_receive_message", self, message_components[1], self.configuration["channels"], message_components[2]))
+                elif message_type == "CONNECT":
+                    self.application.dispatch_event(BridgeEvent("on_receive_join", self, message_components[1], self.configuration["channels"]))
+                elif message_type == "DISCONNECT":
+                    self.application.dispatch_event(BridgeEvent("on_receive_leave", self, message_components[1], self.configuration["channels"]))
+                elif message_type == "HEARTBEAT":
+                    self.last_heartbeat_time = datetime.datetime.now()
+                    self.schedule_heartbeat_check()
 
     def get_commands(self):
         return {}
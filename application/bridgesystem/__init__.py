@@ -1,3 +1,18 @@
 from .util import *
+from .reactor import Reactor
+from .routing import RoutingTable
+from .metrics import Metrics, MetricsServer
+from .webhooks import WebhookServer
+from .profiling import Profiler
+from .eventloop import EventLoop
+from .timers import TimerService
+from .ratelimit import RateLimiter
+from .imagestore import ImageStore
+from .downloader import Downloader
+from .imagepipeline import ImagePipeline
+from .mediacache import MediaCache
+from .workers import BridgeWorker
+from .supervisor import Supervisor
 from .bridgebase import BridgeBase
 from .configuration import Configuration
+from .events import BridgeEvent, EVENT_ARGUMENTS
@@ -3,13 +3,15 @@
 """
 
 import os
+import time
 import base64
-import random
 import datetime
 import inspect
-import shutil
+import collections
 
 from bridgesystem import util
+from bridgesystem.queues import BoundedQueue
+from bridgesystem.ratelimit import RateLimiter
 
 class AddonError(Exception):
     pass
@@ -21,11 +23,25 @@ class AddonConfigurationError(AddonError):
     pass
 
 class BridgeBase(object):
+    EVENT_RECEIVE_SETTINGS = {
+        "on_receive_message": "receive_messages",
+        "on_receive_join": "receive_join_leaves",
+        "on_receive_leave": "receive_join_leaves",
+    }
+    """
+        A dictionary mapping event names to the generic configuration setting that controls whether they are received.
+    """
+
     event_map = None
     """
         A dictionary mapping events to each other.
     """
 
+    envelope_map = None
+    """
+        A dictionary mapping events to responders that receive the BridgeEvent envelope itself.
+    """
+
     application = None
     """
         The main application instance we are associated with.
@@ -38,16 +54,119 @@ class BridgeBase(object):
 
     long_block_buffers = None
     """
-        A dictionary mapping message senders to their long block buffers.
+        A dictionary mapping message senders to a deque of their pending (target channels, block, send function,
+        timestamp) entries.
     """
 
     last_long_block_process = None
     """
-        The last times long blocks were processed.
+        A dictionary mapping message senders with pending long blocks to the monotonic time their last block was sent.
+    """
+
+    long_block_schedule = None
+    """
+        A deque of (due time, sender) entries holding the monotonic time each sender with pending long blocks may
+        send its next block. Every sender waits the same delay after a send, so appending keeps the entries sorted
+        by due time and the senders that are due are always at the front.
     """
 
     global_configuration = None
 
+    polled = True
+    """
+        Whether or not this bridge relies on update being called on a fixed tick. Bridges that have been ported to
+        the event driven runtime set this to False and register readiness callbacks and timers with the
+        application's event loop instead.
+    """
+
+    outbound_drained_on_core = True
+    """
+        Whether or not the outbound queue is drained on the core thread. The core thread is also the producer, so a
+        put could never make room by waiting and the block policy is refused for such bridges.
+    """
+
+    long_block_timer = None
+    """
+        The pending application timer used to process long blocks once the next sender is due.
+    """
+
+    outbound_queue = None
+    """
+        The bounded queue every message sent by this bridge passes through on its way to the remote.
+    """
+
+    rate_limiter = None
+    """
+        The token buckets limiting how quickly this bridge sends to its remote and to each destination on it.
+    """
+
+    RATE_LIMIT = None
+    """
+        The default (sends per second, burst) permitted for the bridge as a whole, or None if unlimited. Bridges set
+        this to the limits of their remote and the rateLimitPerSecond and rateLimitBurst options override it.
+    """
+
+    DESTINATION_RATE_LIMIT = None
+    """
+        The default (sends per second, burst) permitted per destination, or None if unlimited. The
+        destinationRateLimitPerSecond and destinationRateLimitBurst options override it.
+    """
+
+    COALESCE_LIMIT = None
+    """
+        The longest message the coalescing stage may produce for this bridge's remote, or None if the bridge does
+        not support coalescing. Lengths are measured by get_message_length.
+    """
+
+    COALESCE_SEPARATOR = "\n"
+    """
+        The text placed between coalesced messages.
+    """
+
+    coalesce_buffers = None
+    """
+        A dictionary mapping (send function, target channels) to the [sender, messages, length, timestamp, timer]
+        batch waiting in the coalescing stage. The channels of the pending batches never overlap, so flushing them in
+        any order keeps every channel's messages in order.
+    """
+
+    coalesced_message_count = None
+    """
+        The total number of messages merged into a pending batch by the coalescing stage.
+    """
+
+    long_block_count = None
+    """
+        The total number of blocks waiting in the long block buffers.
+    """
+
+    long_block_dropped_count = None
+    """
+        The total number of long blocks dropped because the buffers were at the outbound queue capacity.
+    """
+
+    metric_labels = None
+    """
+        The labels identifying this bridge in the application's metrics.
+    """
+
+    relay_timestamp = None
+    """
+        While sending a buffered long block, the receipt timestamp of the event the block belongs to.
+    """
+
+    pending_relays = None
+    """
+        A dictionary mapping relay keys to deques of (futures, relay function) entries waiting on hosted images, in
+        the order they were queued.
+    """
+
+    awaited_futures = None
+    """
+        A dictionary mapping relay keys to the future the head of their queue is waiting on, so completion is only
+        requested once per future.
+    """
+
     def __init__(self, application, home_path, configuration, global_configuration):
         """
             Base initialize function to create empty lambdas for the base event types. Events of other types may be specified,
@@ -57,12 +176,34 @@ class BridgeBase(object):
         """
         self.home_path = home_path
         self.event_map = {}
+        self.envelope_map = {}
         self.application = application
         self.configuration = configuration
         self.global_configuration = global_configuration
 
         self.long_block_buffers = {}
         self.last_long_block_process = {}
+        self.long_block_schedule = collections.deque()
+        self.long_block_count = 0
+        self.long_block_dropped_count = 0
+        self.coalesce_buffers = {}
+        self.coalesced_message_count = 0
+        self.pending_relays = {}
+        self.awaited_futures = {}
+
+        self.metric_labels = (("bridge", self.configuration.name),)
+        self.application.metrics.add_collector(self.collect_metrics)
+
+        generic_config = self.configuration.bridge_generic_config
+        if generic_config.outbound_queue_policy == "block" and self.outbound_drained_on_core:
+            raise AddonConfigurationError("Bridge '%s' drains its outbound queue on the core thread, so its outboundQueuePolicy cannot be block." % self.configuration.name)
+        self.outbound_queue = BoundedQueue(capacity=generic_config.outbound_queue_capacity, policy=generic_config.outbound_queue_policy,
+                                           block_seconds=generic_config.outbound_queue_block_seconds, coalesce_function=self.coalesce_outbound)
+
+        rate, burst = self.get_rate_limit(self.RATE_LIMIT, generic_config.rate_limit_per_second, generic_config.rate_limit_burst)
+        destination_rate, destination_burst = self.get_rate_limit(self.DESTINATION_RATE_LIMIT, generic_config.destination_rate_limit_per_second,
+                                                                  generic_config.destination_rate_limit_burst)
+        self.rate_limiter = RateLimiter(rate=rate, burst=burst, destination_rate=destination_rate, destination_burst=destination_burst)
 
         self.register_event("on_receive_message", lambda sender, sender_name, message, target_channels: True)
         self.register_event("on_receive_join", lambda sender, joined_name, target_channels: True)
@@ -80,6 +221,10 @@ class BridgeBase(object):
         if name not in self.event_map:
             return
 
+        profiler = self.application.profiler
+        if profiler is not None:
+            call_start = time.monotonic()
+
         for responder in self.event_map[name]:
             try:
                 responder(*args, **kwargs)
@@ -87,10 +232,24 @@ class BridgeBase(object):
                 pass
                 # FIXME: Process and log the error in some way.
 
-    def register_event(self, name, responder):
+        if profiler is not None:
+            profiler.record(self.configuration.name, name, time.monotonic() - call_start)
+
+    def register_event(self, name, responder, envelope=False):
         """
             Registers an event to be processed by this addon.
+
+            :param name: The name of the event.
+            :param responder: The function to call when the event is received.
+            :param envelope: If True, the responder is called with the BridgeEvent envelope as its only argument
+                rather than with the event's unpacked arguments.
         """
+        if envelope is True:
+            self.envelope_map.setdefault(name, [])
+            self.envelope_map[name].append(responder)
+            self.update_routes()
+            return
+
         self.event_map.setdefault(name, [])
 
         # Verify that all functions have the same signature if we have any events defined already
@@ -104,52 +263,294 @@ class BridgeBase(object):
             if first_responder.__code__.co_argcount != responder_argument_count:
                 raise AddonMismatchedEventArgsError("Attempted to register a responder to event '%s' using a function accepting %u parameters! Expected %u." % (name, responder.__code__.co_argcount, first_responder.__code__.co_argcount))
         self.event_map[name].append(responder)
+        self.update_routes()
+
+    def update_routes(self):
+        """
+            Lets the application's routing table know that the events this bridge accepts have changed.
+        """
+        routing_table = self.application.routing_table
+        if routing_table is not None:
+            routing_table.update_bridge(self)
+
+    def get_event_channels(self, name):
+        """
+            Returns the set of channels this bridge accepts the given event on, None if it accepts the event on every
+            channel or an empty set if it refuses the event outright. This is used to compile the routing table so
+            bridges should override it to describe any channel filtering they perform.
+
+            :param name: The name of the event.
+        """
+        if name in self.EVENT_RECEIVE_SETTINGS:
+            if getattr(self.configuration.bridge_generic_config, self.EVENT_RECEIVE_SETTINGS[name]) is False:
+                return set()
+        return None
 
     def send_buffered_message(self, sender, target_channels, message, buffer_size, send_function):
         message_blocks = util.chunk_string(message, buffer_size)
-        if len(message_blocks) >= 2 or sender in self.long_block_buffers.keys():
-            self.long_block_buffers.setdefault(sender, [])
+        if len(message_blocks) >= 2 or sender in self.long_block_buffers:
+            first_block = 0
+            long_block_buffer = self.long_block_buffers.get(sender)
 
             # Send the first line if this is new
-            if sender not in self.last_long_block_process.keys():
-                message = message_blocks[0]
-                send_function(sender=sender, message=message, target_channels=target_channels)
-                message_blocks = message_blocks[1:]
+            if long_block_buffer is None:
+                self.flush_coalesced(target_channels)
+                send_function(sender=sender, message=message_blocks[0], target_channels=target_channels)
+                first_block = 1
+
+            # Never hold more blocks than the outbound queue would, dropping whatever does not fit.
+            available_blocks = max(self.configuration.bridge_generic_config.outbound_queue_capacity - self.long_block_count, 0)
+            last_block = len(message_blocks)
+            if last_block - first_block > available_blocks:
+                self.long_block_dropped_count += last_block - first_block - available_blocks
+                last_block = first_block + available_blocks
+
+            if last_block == first_block:
+                return
+
+            if long_block_buffer is None:
+                long_block_buffer = self.long_block_buffers[sender] = collections.deque()
+
+                now = time.monotonic()
+                self.last_long_block_process[sender] = now
+                self.long_block_schedule.append((now + self.get_long_block_delay().total_seconds(), sender))
+
+            timestamp = self.get_relay_timestamp()
+            long_block_buffer.extend((target_channels, message_blocks[index], send_function, timestamp) for index in range(first_block, last_block))
+            self.long_block_count += last_block - first_block
+            self.schedule_long_block_processing()
+        else:
+            self.send_coalesced(sender, target_channels, message, send_function)
 
-            self.long_block_buffers[sender] += [(target_channels, message_blocks, send_function)]
-            self.last_long_block_process.setdefault(sender, datetime.datetime.now())
+    def get_message_length(self, message):
+        """
+            Returns the length of a message as the bridge's remote measures it, used to keep coalesced messages within
+            COALESCE_LIMIT.
+        """
+        return len(message)
+
+    def send_coalesced(self, sender, target_channels, message, send_function):
+        """
+            Passes a message through the coalescing stage. When the bridge's coalesceWindowSeconds is set, messages to
+            the same channels that arrive within the window are merged up to COALESCE_LIMIT and sent with a single
+            call once the window after the first of them has passed. Otherwise the message is sent right away.
+
+            :param sender: The name of the sender, passed to the send function.
+            :param target_channels: The channels the message is for.
+            :param message: The message to send.
+            :param send_function: Called with sender, message and target_channels to send the message.
+        """
+        window = self.configuration.bridge_generic_config.coalesce_window_seconds
+        if self.COALESCE_LIMIT is None or not window:
+            send_function(sender=sender, message=message, target_channels=target_channels)
+            return
+
+        key = (send_function, tuple(target_channels))
+        message_length = self.get_message_length(message)
+
+        batch = self.coalesce_buffers.get(key)
+        if batch is not None:
+            merged_length = batch[2] + self.get_message_length(self.COALESCE_SEPARATOR) + message_length
+            if merged_length <= self.COALESCE_LIMIT:
+                batch[1].append(message)
+                batch[2] = merged_length
+                self.coalesced_message_count += 1
+                return
+            self.flush_coalesced_batch(key)
         else:
+            # Anything pending for an overlapping set of channels was received first, so it has to go out first.
+            self.flush_coalesced(target_channels)
+
+        if message_length >= self.COALESCE_LIMIT:
             send_function(sender=sender, message=message, target_channels=target_channels)
+            return
+
+        timer = self.application.timers.call_later(window, self.flush_coalesced_batch, key)
+        self.coalesce_buffers[key] = [sender, [message], message_length, self.get_relay_timestamp(), timer]
+
+    def flush_coalesced(self, target_channels=None):
+        """
+            Sends every batch waiting in the coalescing stage for any of the given channels.
+
+            :param target_channels: The channels to flush. If None, every batch is flushed.
+        """
+        if len(self.coalesce_buffers) == 0:
+            return
+
+        for key in list(self.coalesce_buffers.keys()):
+            if target_channels is None or any(channel in key[1] for channel in target_channels):
+                self.flush_coalesced_batch(key)
+
+    def flush_coalesced_batch(self, key):
+        """
+            Sends a single batch waiting in the coalescing stage. This is also the timer callback used once a batch's
+            window has passed.
+
+            :param key: The (send function, target channels) of the batch.
+        """
+        batch = self.coalesce_buffers.pop(key, None)
+        if batch is None:
+            return
+
+        sender, messages, length, timestamp, timer = batch
+        timer.cancel()
+
+        send_function, target_channels = key
+        self.relay_timestamp = timestamp
+        try:
+            send_function(sender=sender, message=self.COALESCE_SEPARATOR.join(messages), target_channels=list(target_channels))
+        finally:
+            self.relay_timestamp = None
+
+    @staticmethod
+    def get_rate_limit(default, rate, burst):
+        """
+            Resolves a configured rate limit against a bridge's default.
+
+            :param default: The bridge's default (sends per second, burst) or None if unlimited.
+            :param rate: The configured sends per second, or None to use the default.
+            :param burst: The configured burst, or None to use the default.
+            :return: A (sends per second, burst) tuple. The rate is None if unlimited.
+        """
+        default_rate, default_burst = (None, 1) if default is None else default
+        if rate is None:
+            rate = default_rate
+        if burst is None:
+            burst = default_burst
+        return rate, burst
+
+    def coalesce_outbound(self, queued_item, new_item):
+        """
+            Merges a new outbound item into the newest queued one when the outbound queue is full and its policy is
+            coalesce. Bridges override this to describe how their queued items may be combined.
+
+            :return: The merged item, or None if the items cannot be merged.
+        """
+        return None
+
+    def get_long_block_delay(self):
+        """
+            Returns the delay between long block sends as a timedelta.
+        """
+        delay = self.configuration.bridge_generic_config.large_block_delay_seconds
+        if isinstance(delay, datetime.timedelta) is False:
+            delay = datetime.timedelta(seconds=delay)
+        return delay
+
+    def schedule_long_block_processing(self):
+        """
+            Arms an application timer for when the next sender with pending long blocks is due, if one is not armed
+            already.
+        """
+        if self.long_block_timer is not None or len(self.long_block_schedule) == 0:
+            return
+
+        delay = max(self.long_block_schedule[0][0] - time.monotonic(), 0)
+        self.long_block_timer = self.application.timers.call_later(delay, self.process_long_block_timer)
+
+    def process_long_block_timer(self):
+        """
+            Timer callback used to send the long blocks that have come due.
+        """
+        self.long_block_timer = None
+        self.process_long_blocks()
+        self.schedule_long_block_processing()
 
     def update(self, delta_time):
-        # Process long block buffers
-        now = datetime.datetime.now()
-        removed_senders = []
-        for sender_name, last_sent in zip(self.last_long_block_process.keys(), self.last_long_block_process.values()):
-            # If there's nothing in the buffer, stop blocking
-            if len(self.long_block_buffers[sender_name]) == 0:
-                removed_senders.append(sender_name)
-                continue
-
-            # Process the next message
-            if now - last_sent >= self.configuration.bridge_generic_config.long_block_delay_seconds:
-                target_channels, block_data, send_function = self.long_block_buffers[sender_name][0]
-
-                # Read the first message
-                message = block_data[0]
+        """
+            Process an update tick.
+
+            :param delta_time: The time since the last time addon updates were processed.
+        """
+
+    def stop(self):
+        """
+            Stops the addon.
+        """
+        if self.long_block_timer is not None:
+            self.long_block_timer.cancel()
+            self.long_block_timer = None
+
+        for sender, messages, length, timestamp, timer in self.coalesce_buffers.values():
+            timer.cancel()
+        self.coalesce_buffers = {}
+        self.pending_relays.clear()
+        self.awaited_futures.clear()
+
+    def process_long_blocks(self):
+        """
+            Sends the next block of every sender that has waited long enough since its last one. Only the senders
+            that are due are touched.
+        """
+        schedule = self.long_block_schedule
+        if len(schedule) == 0:
+            return
+
+        # Senders rescheduled by this call go to the back, so each sends at most one block per call even with a
+        # zero delay.
+        now = time.monotonic()
+        next_due_time = now + self.get_long_block_delay().total_seconds()
+        for index in range(len(schedule)):
+            if schedule[0][0] > now:
+                break
+
+            due_time, sender_name = schedule.popleft()
+            long_block_buffer = self.long_block_buffers[sender_name]
+
+            # Read the next message
+            target_channels, message, send_function, timestamp = long_block_buffer.popleft()
+            self.long_block_count -= 1
+
+            # If there's nothing left in the buffer, stop blocking
+            if len(long_block_buffer) == 0:
+                del self.long_block_buffers[sender_name]
+                del self.last_long_block_process[sender_name]
+            else:
+                self.last_long_block_process[sender_name] = now
+                schedule.append((next_due_time, sender_name))
+
+            self.flush_coalesced(target_channels)
+
+            self.relay_timestamp = timestamp
+            try:
                 send_function(sender=sender_name, message=message, target_channels=target_channels)
+            finally:
+                self.relay_timestamp = None
+
+    def get_relay_timestamp(self):
+        """
+            Returns the monotonic receipt time of the event currently being relayed, or None if nothing is being
+            relayed. Bridges attach this to outbound items so the latency can be recorded once they are written.
+        """
+        if self.relay_timestamp is not None:
+            return self.relay_timestamp
+
+        event = self.application.current_event
+        return event.timestamp if event is not None else None
+
+    def record_relay_latency(self, timestamp):
+        """
+            Records the time from an event being received to its relayed message being written to the remote.
 
-                # Update the block data and remove if exhausted
-                block_data = block_data[1:]
-                if len(block_data) == 0:
-                    self.long_block_buffers[sender_name] = self.long_block_buffers[sender_name][1:]
-                else:
-                    self.long_block_buffers[sender_name][0] = (target_channels, block_data, send_function)
-                self.last_long_block_process[sender_name] = datetime.datetime.now()
+            :param timestamp: The timestamp returned by get_relay_timestamp when the message was queued. If None,
+                nothing is recorded.
+        """
+        if timestamp is not None:
+            self.application.metrics.observe("pybridge_relay_latency_seconds", self.metric_labels, time.monotonic() - timestamp)
 
-        for removed_sender in removed_senders:
-            del self.long_block_buffers[removed_sender]
-            del self.last_long_block_process[removed_sender]
+    def collect_metrics(self):
+        """
+            Reports this bridge's outbound queue, long block and rate limiting state to the application's metrics.
+        """
+        metrics = self.application.metrics
+        metrics.set_counter("pybridge_outbound_enqueued_total", self.metric_labels, self.outbound_queue.enqueued_count)
+        metrics.set_counter("pybridge_outbound_dropped_total", self.metric_labels, self.outbound_queue.dropped_count + self.long_block_dropped_count)
+        metrics.set_counter("pybridge_outbound_coalesced_total", self.metric_labels, self.outbound_queue.coalesced_count + self.coalesced_message_count)
+        metrics.set_gauge("pybridge_outbound_queue_depth", self.metric_labels, len(self.outbound_queue))
+        metrics.set_gauge("pybridge_outbound_queue_high_water_mark", self.metric_labels, self.outbound_queue.high_water_mark)
+        metrics.set_gauge("pybridge_long_block_depth", self.metric_labels, self.long_block_count)
+        metrics.set_counter("pybridge_rate_limited_total", self.metric_labels, self.rate_limiter.limited_count)
+        metrics.set_gauge("pybridge_rate_limit_wait_seconds", self.metric_labels, self.rate_limiter.get_wait())
 
     def get_data_path(self, path):
         # The bridge folder should exist
@@ -159,31 +560,80 @@ class BridgeBase(object):
         return os.path.join(bridge_path, path)
 
     def get_hosted_image_local_path(self, name):
-        return os.path.join(self.global_configuration.global_configuration.image_hosting.image_path_base, name)
+        return self.application.image_store.get_local_path(name)
 
     def get_hosted_image_url(self, name):
         return os.path.join(self.global_configuration.global_configuration.image_hosting.image_url_base, name)
 
-    def hosted_name_unused(self, name):
-        return os.path.exists(self.get_hosted_image_local_path(name)) is False
+    def host_image(self, download_function):
+        """
+            Hosts an image through the application's image pipeline. Decoding and encoding never run on the core thread.
 
-    def get_unused_hosted_image_name(self, extension=".png"):
-        generated_name = None
+            :param download_function: Called with a file-like object to write the image to.
+            :return: A future resolving to the name of the hosted image, or holding the exception if the image could not
+                be hosted. Pass the name to get_hosted_image_url for its URL.
+        """
+        return self.application.image_pipeline.host_image(download_function)
 
-        potential_symbols = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz123467890-"
-        while generated_name is None or self.hosted_name_unused(generated_name) is False:
-            symbol_count = random.randint(10, 32)
+    def relay_when_ready(self, futures, relay_function, key=None):
+        """
+            Relays something once all of the given futures are done and every earlier relay with the same key has
+            been relayed, so waiting on hosted images never reorders what one sender said.
 
-            generated_name = ""
-            for iteration in range(symbol_count):
-                generated_name += random.choice(potential_symbols)
-            generated_name = "%s%s" % (generated_name, extension)
-        return generated_name
+            :param futures: The futures to wait on, usually from host_image. May be empty.
+            :param relay_function: Called on the core thread with the futures once they are all done.
+            :param key: Relays with the same key, such as the follow-ups of one sender, are relayed in order. Relays
+                with different keys never wait on each other.
+        """
+        pending = self.pending_relays.get(key)
+        if pending is None:
+            if all(future.done() for future in futures):
+                relay_function(futures)
+                return
+            pending = self.pending_relays[key] = collections.deque()
+
+        pending.append((futures, relay_function))
+        if len(pending) == 1:
+            self.process_pending_relays(None, key)
+
+    def process_pending_relays(self, completed_future, key):
+        """
+            Relays every waiting entry from the front of the given key's queue whose futures are done, then waits on
+            the first future that is not.
+        """
+        pending = self.pending_relays.get(key)
+        while pending:
+            futures, relay_function = pending[0]
+            for future in futures:
+                if future.done() is False:
+                    if future is not self.awaited_futures.get(key):
+                        self.awaited_futures[key] = future
+                        self.application.image_pipeline.call_when_done(future, self.process_pending_relays, key)
+                    return
+
+            pending.popleft()
+            relay_function(futures)
+
+        self.pending_relays.pop(key, None)
+        self.awaited_futures.pop(key, None)
+
+    def get_hosted_image_from_download(self, download_function, extension=".png", convert_function=None):
+        """
+            Downloads an image into the application's image store.
 
-    def get_hosted_image_from_path(self, path, extension):
-        new_name = self.get_unused_hosted_image_name(extension=extension)
-        new_path = self.get_hosted_image_local_path(new_name)
+            :param download_function: Called with a file-like object to write the image to.
+            :param extension: The extension of the hosted image.
+            :param convert_function: If specified, called with the path of the download to convert it in place. It is
+                not called when the same image is already hosted.
+            :return: The name of the hosted image.
+        """
+        return self.application.image_store.store_download(download_function, extension, convert_function)
+
+    def get_hosted_image_from_path(self, path, extension, convert_function=None):
+        """
+            Moves an image into the application's image store. The file is removed instead if the same image is
+            already hosted.
 
-        shutil.move(path, new_path)
-        os.chmod(new_path, 0o664)
-        return new_name
+            :return: The name of the hosted image.
+        """
+        return self.application.image_store.store_path(path, extension, convert_function)
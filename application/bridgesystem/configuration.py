@@ -5,6 +5,9 @@
 import json
 import datetime
 
+from bridgesystem.queues import QUEUE_POLICIES
+from bridgesystem.supervisor import PROCESS_MODES
+
 class ConfigurationBase(object):
     class ConfigurationValue(object):
         value = None
@@ -142,6 +145,14 @@ class Domain(ConfigurationBase):
             broadcasting_channels = ConfigurationBase.ConfigurationValue(name="broadCastingChannels", default=None, value_constructor=list)
             receiving_channels = ConfigurationBase.ConfigurationValue(name="receivingChannels", default=None, value_constructor=list)
             large_block_delay_seconds = ConfigurationBase.ConfigurationValue(name="largeBlockDelaySeconds", default=None, value_constructor=float)
+            outbound_queue_capacity = ConfigurationBase.ConfigurationValue(name="outboundQueueCapacity", default=None, value_constructor=int)
+            outbound_queue_policy = ConfigurationBase.ConfigurationValue(name="outboundQueuePolicy", default=None, value_constructor=str, validator=lambda value: value is None or value in QUEUE_POLICIES)
+            outbound_queue_block_seconds = ConfigurationBase.ConfigurationValue(name="outboundQueueBlockSeconds", default=None, value_constructor=float)
+            rate_limit_per_second = ConfigurationBase.ConfigurationValue(name="rateLimitPerSecond", default=None, value_constructor=float)
+            rate_limit_burst = ConfigurationBase.ConfigurationValue(name="rateLimitBurst", default=None, value_constructor=int)
+            destination_rate_limit_per_second = ConfigurationBase.ConfigurationValue(name="destinationRateLimitPerSecond", default=None, value_constructor=float)
+            destination_rate_limit_burst = ConfigurationBase.ConfigurationValue(name="destinationRateLimitBurst", default=None, value_constructor=int)
+            coalesce_window_seconds = ConfigurationBase.ConfigurationValue(name="coalesceWindowSeconds", default=None, value_constructor=float)
 
             def __init__(self, configuration={}):
                 super(Domain.Bridge.BridgeGenericConfig, self).__init__(configuration)
@@ -207,6 +218,15 @@ class GlobalConfiguration(ConfigurationBase):
         def __init__(self, configuration={}):
             self.sleep_ms = ConfigurationBase.ConfigurationValue(name="sleepMS", default=32, value_type=int)
             self.auto_restart = ConfigurationBase.ConfigurationValue(name="autoRestart", default=False, value_type=bool)
+            self.event_driven = ConfigurationBase.ConfigurationValue(name="eventDriven", default=False, value_type=bool)
+            self.process_mode = ConfigurationBase.ConfigurationValue(name="processMode", default="single", value_type=str, validator=lambda value: value in PROCESS_MODES)
+            self.domain_groups = ConfigurationBase.ConfigurationValue(name="domainGroups", default=[], value_type=list)
+            self.heartbeat_seconds = ConfigurationBase.ConfigurationValue(name="heartbeatSeconds", default=5, value_type=int)
+            self.health_check_timeout_seconds = ConfigurationBase.ConfigurationValue(name="healthCheckTimeoutSeconds", default=30, value_type=int)
+            self.restart_delay_seconds = ConfigurationBase.ConfigurationValue(name="restartDelaySeconds", default=5, value_type=int)
+            self.profiling = ConfigurationBase.ConfigurationValue(name="profiling", default=False, value_type=bool)
+            self.tick_budget_ms = ConfigurationBase.ConfigurationValue(name="tickBudgetMS", default=100, value_type=int)
+            self.profile_window = ConfigurationBase.ConfigurationValue(name="profileWindow", default=1000, value_type=int)
 
             super(GlobalConfiguration.ProcessInternal, self).__init__(configuration)
 
@@ -220,11 +240,120 @@ class GlobalConfiguration(ConfigurationBase):
             If an internal error occurs, should the process attempt to restart itself.
         """
 
+        event_driven = None
+        """
+            Whether or not to run bridges on the event driven runtime. When enabled, bridges that support it are
+            woken by socket readiness and timers and only bridges that have not been ported are polled every sleepMS.
+        """
+
+        process_mode = None
+        """
+            Either single to run every domain in this process or perDomain to fork a supervised worker process per
+            domain group.
+        """
+
+        domain_groups = None
+        """
+            Lists of domain names that should share a worker process when running perDomain. Domains not listed
+            here run in a process of their own.
+        """
+
+        heartbeat_seconds = None
+        """
+            How often worker processes report a heartbeat to the supervisor.
+        """
+
+        health_check_timeout_seconds = None
+        """
+            How long the supervisor waits without a heartbeat before it restarts a worker process.
+        """
+
+        restart_delay_seconds = None
+        """
+            How long the supervisor waits before restarting a worker process that has died.
+        """
+
+        profiling = None
+        """
+            Whether or not to time every bridge update and event responder, logging ticks that exceed tickBudgetMS.
+        """
+
+        tick_budget_ms = None
+        """
+            When profiling, the longest a tick or event loop callback may take before it is logged.
+        """
+
+        profile_window = None
+        """
+            When profiling, how many timings are kept per bridge and call for the rolling percentiles.
+        """
+
+    class Metrics(ConfigurationBase):
+        def __init__(self, configuration={}):
+            self.enabled = ConfigurationBase.ConfigurationValue(name="enabled", default=False, value_type=bool)
+            self.host = ConfigurationBase.ConfigurationValue(name="host", default="127.0.0.1", value_type=str)
+            self.port = ConfigurationBase.ConfigurationValue(name="port", default=9464, value_type=int)
+            self.unix_socket_path = ConfigurationBase.ConfigurationValue(name="unixSocketPath", default="", value_type=str)
+
+            super(GlobalConfiguration.Metrics, self).__init__(configuration)
+
+        enabled = None
+        """
+            Whether or not the metrics are served.
+        """
+
+        host = None
+        """
+            The address the Prometheus text HTTP endpoint listens on. If empty, HTTP is not served.
+        """
+
+        port = None
+        """
+            The port the HTTP endpoint listens on. When running perDomain, each worker process listens on the port
+            following the previous worker's.
+        """
+
+        unix_socket_path = None
+        """
+            If set, the metrics are also written to every client connecting to a Unix socket at this path. When
+            running perDomain, each worker process appends its index to the path.
+        """
+
+    class Webhooks(ConfigurationBase):
+        def __init__(self, configuration={}):
+            self.host = ConfigurationBase.ConfigurationValue(name="host", default="127.0.0.1", value_type=str)
+            self.port = ConfigurationBase.ConfigurationValue(name="port", default=8443, value_type=int)
+
+            super(GlobalConfiguration.Webhooks, self).__init__(configuration)
+
+        host = None
+        """
+            The address the webhook listener binds to. It speaks plain HTTP, so it should sit behind a reverse proxy
+            terminating TLS.
+        """
+
+        port = None
+        """
+            The port the webhook listener binds to. It only listens when a bridge receives by webhook. When running
+            perDomain, each worker process listens on the port following the previous worker's.
+        """
+
     class ImageHosting(ConfigurationBase):
         def __init__(self, configuration={}):
             self.enabled = ConfigurationBase.ConfigurationValue(name="enabled", default=False, value_type=bool)
             self.image_path_base = ConfigurationBase.ConfigurationValue(name="imagePathBase", value_type=str)
             self.image_url_base = ConfigurationBase.ConfigurationValue(name="imageURLBase", value_type=str)
+            self.store_index_path = ConfigurationBase.ConfigurationValue(name="storeIndexPath", default="~/.pyBridge/imageStore.index", value_type=str)
+            self.eviction_max_megabytes = ConfigurationBase.ConfigurationValue(name="evictionMaxMegabytes", default=0.0, value_constructor=float)
+            self.eviction_max_age_days = ConfigurationBase.ConfigurationValue(name="evictionMaxAgeDays", default=0.0, value_constructor=float)
+            self.eviction_sweep_seconds = ConfigurationBase.ConfigurationValue(name="evictionSweepSeconds", default=3600.0, value_constructor=float)
+            self.max_image_pixels = ConfigurationBase.ConfigurationValue(name="maxImagePixels", default=16777216, value_constructor=int)
+            self.max_image_megabytes = ConfigurationBase.ConfigurationValue(name="maxImageMegabytes", default=5.0, value_constructor=float)
+            self.max_download_megabytes = ConfigurationBase.ConfigurationValue(name="maxDownloadMegabytes", default=25.0, value_constructor=float)
+            self.transcode_processes = ConfigurationBase.ConfigurationValue(name="transcodeProcesses", default=2, value_constructor=int)
+            self.download_threads = ConfigurationBase.ConfigurationValue(name="downloadThreads", default=4, value_constructor=int)
+            self.download_timeout_seconds = ConfigurationBase.ConfigurationValue(name="downloadTimeoutSeconds", default=30.0, value_constructor=float)
+            self.max_idle_connections_per_host = ConfigurationBase.ConfigurationValue(name="maxIdleConnectionsPerHost", default=2, value_constructor=int)
 
             super(GlobalConfiguration.ImageHosting, self).__init__(configuration)
 
@@ -233,6 +362,61 @@ class GlobalConfiguration(ConfigurationBase):
             If image hosting is enabled.
         """
 
+        store_index_path = None
+        """
+            The path of the hosted image store's index. This must not be served to the web.
+        """
+
+        eviction_max_megabytes = None
+        """
+            The size the hosted image store is evicted down to, least recently used first. Zero disables the limit.
+        """
+
+        eviction_max_age_days = None
+        """
+            How long a hosted image may go unused before it is evicted. Zero disables the limit.
+        """
+
+        eviction_sweep_seconds = None
+        """
+            The time between eviction sweeps.
+        """
+
+        max_image_pixels = None
+        """
+            The most pixels a hosted image may have. Larger images are downscaled.
+        """
+
+        max_image_megabytes = None
+        """
+            The largest a hosted image may be. Larger images are downscaled until they fit.
+        """
+
+        max_download_megabytes = None
+        """
+            The largest image that will be downloaded for hosting.
+        """
+
+        transcode_processes = None
+        """
+            The number of processes hosted images are decoded and encoded in.
+        """
+
+        download_threads = None
+        """
+            The number of attachments that may be downloaded at once.
+        """
+
+        download_timeout_seconds = None
+        """
+            The most time a single attachment download may take.
+        """
+
+        max_idle_connections_per_host = None
+        """
+            The most keep-alive connections kept open to each attachment host between downloads.
+        """
+
     class BridgeDefaultGenericConfig(ConfigurationBase):
         ignore_senders = ConfigurationBase.ConfigurationValue(name="ignoreSenders", default=[], value_constructor=list)
         broadcast_messages = ConfigurationBase.ConfigurationValue(name="broadcastMessages", default=True, value_constructor=bool)
@@ -244,6 +428,17 @@ class GlobalConfiguration(ConfigurationBase):
         receive_name_changes = ConfigurationBase.ConfigurationValue(name="receiveNameChanges", default=True, value_constructor=bool)
         receive_messages = ConfigurationBase.ConfigurationValue(name="receiveMessages", default=True, value_constructor=bool)
         receive_join_leaves = ConfigurationBase.ConfigurationValue(name="receiveJoinLeaves", default=True, value_constructor=bool)
+        outbound_queue_capacity = ConfigurationBase.ConfigurationValue(name="outboundQueueCapacity", default=1000, value_constructor=int)
+        outbound_queue_policy = ConfigurationBase.ConfigurationValue(name="outboundQueuePolicy", default="dropOldest", value_constructor=str, validator=lambda value: value in QUEUE_POLICIES)
+        outbound_queue_block_seconds = ConfigurationBase.ConfigurationValue(name="outboundQueueBlockSeconds", default=1.0, value_constructor=float)
+
+        # The rate limits default to None, in which case each bridge's own RATE_LIMIT and DESTINATION_RATE_LIMIT
+        # apply. A rate of zero disables the limit.
+        rate_limit_per_second = ConfigurationBase.ConfigurationValue(name="rateLimitPerSecond", default=None, value_constructor=float)
+        rate_limit_burst = ConfigurationBase.ConfigurationValue(name="rateLimitBurst", default=None, value_constructor=int)
+        destination_rate_limit_per_second = ConfigurationBase.ConfigurationValue(name="destinationRateLimitPerSecond", default=None, value_constructor=float)
+        destination_rate_limit_burst = ConfigurationBase.ConfigurationValue(name="destinationRateLimitBurst", default=None, value_constructor=int)
+        coalesce_window_seconds = ConfigurationBase.ConfigurationValue(name="coalesceWindowSeconds", default=0.0, value_constructor=float)
 
         def __init__(self, configuration={}):
             super(GlobalConfiguration.BridgeDefaultGenericConfig, self).__init__(configuration)
@@ -258,6 +453,16 @@ class GlobalConfiguration(ConfigurationBase):
         Image hosting configuration data.
     """
 
+    metrics = None
+    """
+        Metrics configuration data.
+    """
+
+    webhooks = None
+    """
+        Webhook listener configuration data.
+    """
+
     bridge_default_generic_config = None
     """
         Default bridge configuration data.
@@ -266,5 +471,7 @@ class GlobalConfiguration(ConfigurationBase):
     def __init__(self, configuration={}):
         self.process_internal = ConfigurationBase.ConfigurationValue(name="processInternal", default=GlobalConfiguration.ProcessInternal(), value_constructor=GlobalConfiguration.ProcessInternal)
         self.image_hosting = ConfigurationBase.ConfigurationValue(name="imageHosting", value_constructor=GlobalConfiguration.ImageHosting)
+        self.metrics = ConfigurationBase.ConfigurationValue(name="metrics", default=GlobalConfiguration.Metrics(), value_constructor=GlobalConfiguration.Metrics)
+        self.webhooks = ConfigurationBase.ConfigurationValue(name="webhooks", default=GlobalConfiguration.Webhooks(), value_constructor=GlobalConfiguration.Webhooks)
         self.bridge_default_generic_config = ConfigurationBase.ConfigurationValue(name="bridgeDefaultGenericConfig", default=GlobalConfiguration.BridgeDefaultGenericConfig(), value_constructor=GlobalConfiguration.BridgeDefaultGenericConfig)
         super(GlobalConfiguration, self).__init__(configuration)
@@ -0,0 +1,254 @@
+"""
+    Pooled attachment download programming.
+"""
+
+import time
+import threading
+import collections
+import http.client
+import concurrent.futures
+from urllib.parse import urlparse, urljoin
+
+DOWNLOAD_CHUNK_SIZE = 65536
+"""
+    The number of bytes read from a response at a time.
+"""
+
+MAX_REDIRECTS = 3
+"""
+    How many redirects a single download follows.
+"""
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+class Downloader(object):
+    """
+        Downloads attachments over keep-alive connections shared by every bridge. Idle connections are kept per host,
+        so a channel posting many attachments pays for a single TLS handshake, and responses are streamed to their
+        destination in chunks rather than read into memory. Downloads run on a bounded pool of threads.
+    """
+
+    timeout = None
+    """
+        The most seconds a single download may take, and the timeout of every socket operation within it.
+    """
+
+    max_size = None
+    """
+        The largest response body accepted in bytes, or None if unlimited.
+    """
+
+    max_idle_connections = None
+    """
+        The most idle connections kept per host.
+    """
+
+    download_threads = None
+    """
+        The number of downloads that may run at once.
+    """
+
+    idle_connections = None
+    """
+        A dictionary mapping (scheme, host) to a deque of idle connections, most recently used last.
+    """
+
+    executor = None
+    """
+        The thread pool downloads are submitted to. This is created on first use.
+    """
+
+    lock = None
+    """
+        The lock guarding the idle connections and statistics.
+    """
+
+    opened_count = None
+    """
+        The total number of connections opened.
+    """
+
+    reused_count = None
+    """
+        The total number of requests sent over an idle connection.
+    """
+
+    downloaded_bytes = None
+    """
+        The total number of bytes downloaded.
+    """
+
+    def __init__(self, timeout=30.0, max_size=None, max_idle_connections=2, download_threads=4):
+        """
+            Initializes a new downloader.
+
+            :param timeout: The most seconds a single download may take.
+            :param max_size: The largest response body accepted in bytes, or None if unlimited.
+            :param max_idle_connections: The most idle connections kept per host.
+            :param download_threads: The number of downloads that may run at once.
+        """
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_idle_connections = max_idle_connections
+        self.download_threads = download_threads
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+        self.opened_count = 0
+        self.reused_count = 0
+        self.downloaded_bytes = 0
+
+    def submit(self, function, *args):
+        """
+            Runs a function on one of the download threads.
+
+            :return: A concurrent.futures.Future holding the result of the function.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.download_threads, thread_name_prefix="downloader")
+        return self.executor.submit(function, *args)
+
+    def get_connection(self, key):
+        """
+            Returns an idle connection to the given host, or a new one if none are idle, along with whether it was
+            reused.
+        """
+        with self.lock:
+            connections = self.idle_connections.get(key)
+            if connections:
+                self.reused_count += 1
+                return connections.pop(), True
+            self.opened_count += 1
+
+        scheme, host = key
+        if scheme == "http":
+            return http.client.HTTPConnection(host, timeout=self.timeout), False
+        return http.client.HTTPSConnection(host, timeout=self.timeout), False
+
+    def release_connection(self, key, connection):
+        """
+            Returns a connection whose response has been read in full to the idle connections of its host.
+        """
+        with self.lock:
+            connections = self.idle_connections.setdefault(key, collections.deque())
+            if len(connections) < self.max_idle_connections:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def request(self, url, headers):
+        """
+            Sends a GET request over a pooled connection. A request on an idle connection the server has since
+            closed is retried once on a new connection.
+
+            :return: A tuple of the connection key, the connection and its response.
+        """
+        parsed_url = urlparse(url)
+        key = (parsed_url.scheme, parsed_url.netloc)
+        path = parsed_url.path if parsed_url.query == "" else "%s?%s" % (parsed_url.path, parsed_url.query)
+
+        while True:
+            connection, reused = self.get_connection(key)
+            try:
+                connection.request("GET", path, headers=headers)
+                return key, connection, connection.getresponse()
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.BadStatusLine) as e:
+                connection.close()
+                if reused is False:
+                    raise
+            except Exception:
+                connection.close()
+                raise
+
+    def download(self, url, handle, headers={}, max_size=None):
+        """
+            Downloads a URL, writing the body to the given file-like object in chunks. This blocks and may be called
+            from any thread.
+
+            :param url: The http or https URL to download.
+            :param handle: The file-like object to write the body to.
+            :param headers: Additional request headers.
+            :param max_size: The largest body accepted in bytes. If None, the downloader's max_size applies.
+            :return: The number of bytes downloaded.
+            :raises OSError: If the request fails, times out or the body is too large.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        deadline = time.monotonic() + self.timeout
+
+        for redirect in range(MAX_REDIRECTS + 1):
+            try:
+                key, connection, response = self.request(url, headers)
+            except http.client.HTTPException as e:
+                raise OSError("The request for %s failed: %s" % (url, repr(e)))
+
+            if response.status not in REDIRECT_STATUSES:
+                break
+
+            location = response.getheader("Location")
+            response.read()
+            self.finish_response(key, connection, response)
+            if location is None:
+                raise OSError("The redirect from %s has no location." % url)
+            url = urljoin(url, location)
+        else:
+            raise OSError("Too many redirects downloading %s." % url)
+
+        try:
+            if response.status != 200:
+                raise OSError("Downloading %s failed with HTTP status %u." % (url, response.status))
+
+            content_length = response.getheader("Content-Length")
+            if max_size is not None and content_length is not None and content_length.isdigit() and int(content_length) > max_size:
+                raise OSError("The download is larger than the %u byte limit." % max_size)
+
+            size = 0
+            while True:
+                response_data = response.read(DOWNLOAD_CHUNK_SIZE)
+                if len(response_data) == 0:
+                    break
+
+                size += len(response_data)
+                if max_size is not None and size > max_size:
+                    raise OSError("The download is larger than the %u byte limit." % max_size)
+                if time.monotonic() > deadline:
+                    raise OSError("Downloading %s took longer than %s seconds." % (url, self.timeout))
+                handle.write(response_data)
+        except http.client.HTTPException as e:
+            connection.close()
+            raise OSError("Downloading %s failed: %s" % (url, repr(e)))
+        except Exception:
+            # The rest of the body was never read, so the connection cannot be reused.
+            connection.close()
+            raise
+
+        self.finish_response(key, connection, response)
+        with self.lock:
+            self.downloaded_bytes += size
+        return size
+
+    def finish_response(self, key, connection, response):
+        if response.will_close:
+            connection.close()
+        else:
+            self.release_connection(key, connection)
+
+    def collect_metrics(self, metrics):
+        """
+            Reports the downloader's activity to the given metrics registry.
+        """
+        metrics.set_counter("pybridge_download_connections_opened_total", (), self.opened_count)
+        metrics.set_counter("pybridge_download_connections_reused_total", (), self.reused_count)
+        metrics.set_counter("pybridge_download_bytes_total", (), self.downloaded_bytes)
+
+    def close(self):
+        """
+            Closes every idle connection and stops the download threads, abandoning any queued downloads.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self.idle_connections = {}
@@ -0,0 +1,184 @@
+"""
+    Event driven runtime programming.
+"""
+
+import asyncio
+import datetime
+
+def to_seconds(delay):
+    """
+        Converts a delay specified as either a timedelta or a number of seconds to seconds.
+
+        :param delay: The delay to convert.
+    """
+    if isinstance(delay, datetime.timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+class EventLoop(object):
+    """
+        A class wrapping an asyncio event loop. Bridges register readiness callbacks and timers with this loop
+        instead of being polled on a fixed tick. Bridges that have not been ported continue to have their update
+        function called on an interval through call_every.
+    """
+
+    class PeriodicCall(object):
+        """
+            A handle representing a callback that is repeatedly called on an interval.
+        """
+
+        handle = None
+        """
+            The asyncio timer handle of the next scheduled call.
+        """
+
+        cancelled = None
+        """
+            Whether or not this periodic call has been cancelled.
+        """
+
+        def __init__(self):
+            self.handle = None
+            self.cancelled = False
+
+        def cancel(self):
+            """
+                Cancels all further calls.
+            """
+            self.cancelled = True
+            if self.handle is not None:
+                self.handle.cancel()
+
+    loop = None
+    """
+        The asyncio event loop in use.
+    """
+
+    exception = None
+    """
+        The first unhandled exception raised by a callback. This is re-raised by run so that errors behave the same
+        as they do on the fixed tick loop.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_exception_handler(self.handle_exception)
+
+    def handle_exception(self, loop, context):
+        """
+            Called by asyncio when a callback raises. Stops the loop so the exception may be re-raised by run.
+        """
+        if self.exception is None:
+            self.exception = context.get("exception", RuntimeError(context["message"]))
+        self.loop.stop()
+
+    def add_reader(self, fileobj, callback, *args):
+        """
+            Registers a callback to be called whenever the given file object is readable.
+
+            :param fileobj: The socket or file descriptor to watch.
+            :param callback: The function to call.
+            :param args: The positional arguments to pass to the callback.
+        """
+        self.loop.add_reader(fileobj, callback, *args)
+
+    def remove_reader(self, fileobj):
+        """
+            Stops watching the given file object for readability.
+
+            :param fileobj: The socket or file descriptor to stop watching.
+        """
+        return self.loop.remove_reader(fileobj)
+
+    def add_writer(self, fileobj, callback, *args):
+        """
+            Registers a callback to be called whenever the given file object is writable.
+
+            :param fileobj: The socket or file descriptor to watch.
+            :param callback: The function to call.
+            :param args: The positional arguments to pass to the callback.
+        """
+        self.loop.add_writer(fileobj, callback, *args)
+
+    def remove_writer(self, fileobj):
+        """
+            Stops watching the given file object for writability.
+
+            :param fileobj: The socket or file descriptor to stop watching.
+        """
+        return self.loop.remove_writer(fileobj)
+
+    def call_soon(self, callback, *args):
+        """
+            Schedules a callback to be called on the next iteration of the loop.
+        """
+        return self.loop.call_soon(callback, *args)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+            Schedules a callback to be called on the next iteration of the loop. This is safe to call from threads
+            other than the one running the loop and wakes the loop if it is waiting.
+        """
+        return self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        """
+            Schedules a callback to be called once after the given delay.
+
+            :param delay: A timedelta or number of seconds to wait.
+            :return: A handle that may be cancelled.
+        """
+        return self.loop.call_later(to_seconds(delay), callback, *args)
+
+    def call_every(self, interval, callback, *args):
+        """
+            Schedules a callback to be called repeatedly on an interval. The callback is given the time since it was
+            last called as a timedelta, followed by any additional arguments, matching the update contract.
+
+            :param interval: A timedelta or number of seconds between calls.
+            :return: A handle that may be cancelled.
+        """
+        interval = to_seconds(interval)
+        periodic_call = EventLoop.PeriodicCall()
+
+        def process_call(last_time):
+            if periodic_call.cancelled:
+                return
+
+            current_time = self.loop.time()
+            callback(datetime.timedelta(seconds=current_time - last_time), *args)
+
+            if periodic_call.cancelled is False:
+                periodic_call.handle = self.loop.call_later(interval, process_call, current_time)
+
+        periodic_call.handle = self.loop.call_later(interval, process_call, self.loop.time())
+        return periodic_call
+
+    def add_signal_handler(self, signum, callback, *args):
+        """
+            Registers a callback to be called within the loop when the given signal is received.
+        """
+        self.loop.add_signal_handler(signum, callback, *args)
+
+    def run(self):
+        """
+            Runs the loop until stop is called or a callback raises an unhandled exception.
+        """
+        self.loop.run_forever()
+
+        if self.exception is not None:
+            exception = self.exception
+            self.exception = None
+            raise exception
+
+    def stop(self):
+        """
+            Stops the loop. This is safe to call from any thread.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def close(self):
+        """
+            Releases all resources held by the loop.
+        """
+        self.loop.close()
@@ -0,0 +1,60 @@
+"""
+    Bridge event programming.
+"""
+
+import time
+
+EVENT_ARGUMENTS = {
+    "on_receive_message": ("sender_name", "message", "target_channels"),
+    "on_receive_join": ("joined_name", "target_channels"),
+    "on_receive_leave": ("left_name", "target_channels"),
+}
+"""
+    A dictionary mapping the standard event names to the keyword arguments their responders accept after the sender.
+"""
+
+class BridgeEvent(object):
+    """
+        A compact envelope for a single inbound event. One is created per inbound message and the same instance is
+        passed by reference to every receiver, which also gives tracing and metrics a single object to hang off.
+    """
+
+    __slots__ = ("name", "sender", "sender_name", "target_channels", "message", "attachments", "timestamp", "arguments")
+
+    def __init__(self, name, sender, sender_name, target_channels, message=None, attachments=()):
+        """
+            Initializes a new event.
+
+            :param name: The name of the event.
+            :param sender: The bridge the event originated from.
+            :param sender_name: The name of the user the event concerns. For joins and leaves this is the user
+                joining or leaving.
+            :param target_channels: The channels the event targets.
+            :param message: The message text, if any.
+            :param attachments: Any attachment URL's that accompany the message.
+        """
+        self.name = name
+        self.sender = sender
+        self.sender_name = sender_name
+        self.target_channels = target_channels
+        self.message = message
+        self.attachments = attachments
+        self.timestamp = time.monotonic()
+
+        # Build the positional responder arguments once so every receiver shares them.
+        if name == "on_receive_message":
+            self.arguments = (sender, sender_name, message, target_channels)
+        else:
+            self.arguments = (sender, sender_name, target_channels)
+
+    @staticmethod
+    def from_arguments(name, sender, arguments):
+        """
+            Creates an event from the keyword arguments of one of the standard events.
+
+            :param name: The name of the event. This must be a key of EVENT_ARGUMENTS.
+            :param sender: The bridge the event originated from.
+            :param arguments: The keyword arguments the event was broadcast with.
+        """
+        sender_name = arguments[EVENT_ARGUMENTS[name][0]]
+        return BridgeEvent(name, sender, sender_name, arguments["target_channels"], message=arguments.get("message"))
@@ -0,0 +1,307 @@
+"""
+    Hosted image transcoding programming.
+"""
+
+import os
+import threading
+import multiprocessing
+import concurrent.futures
+
+from bridgesystem.workers import Inbox
+
+OUTPUT_FORMATS = {
+    "JPEG": ("JPEG", ".jpg"),
+    "MPO": ("JPEG", ".jpg"),
+    "WEBP": ("WEBP", ".webp"),
+    "GIF": ("GIF", ".gif"),
+}
+"""
+    A dictionary mapping source image formats to the format and extension they are hosted as. Photographs stay lossy
+    and GIFs are kept so animations survive. Everything else, such as PNG and BMP, is hosted as an optimized PNG.
+"""
+
+DEFAULT_OUTPUT_FORMAT = ("PNG", ".png")
+"""
+    The format and extension of hosted images whose source format is not in OUTPUT_FORMATS.
+"""
+
+DOWNSCALE_STEP = 0.75
+"""
+    The factor both dimensions are scaled by each time an encoded image is still larger than the byte limit.
+"""
+
+MAX_ENCODE_ATTEMPTS = 4
+"""
+    How many times an image is downscaled to fit the byte limit before it is given up on.
+"""
+
+def transcode_image(source_path, max_pixels, max_bytes):
+    """
+        Decodes an image, downscales it to fit within the given limits and encodes it in its hosted format. This runs
+        in a transcoding process, so nothing but its arguments and result cross the process boundary.
+
+        :param source_path: The path of the downloaded image. It is removed once transcoded.
+        :param max_pixels: The most pixels a hosted image may have.
+        :param max_bytes: The largest a hosted image may be in bytes.
+        :return: A tuple of the path of the transcoded image and its extension.
+    """
+    from PIL import Image
+
+    # Refuse decompression bombs outright rather than spending memory on them. Anything within this is downscaled.
+    Image.MAX_IMAGE_PIXELS = max_pixels * 4
+
+    try:
+        with Image.open(source_path) as image:
+            output_format, extension = OUTPUT_FORMATS.get(image.format, DEFAULT_OUTPUT_FORMAT)
+            animated = getattr(image, "is_animated", False)
+
+            # Animations are only kept if they need no resizing, since resizing every frame is not worth the time.
+            if animated and output_format == "GIF" and image.width * image.height <= max_pixels and os.path.getsize(source_path) <= max_bytes:
+                output_path = source_path + extension
+                os.replace(source_path, output_path)
+                return output_path, extension
+
+            if output_format == "GIF":
+                output_format, extension = DEFAULT_OUTPUT_FORMAT
+
+            scale = min(1.0, (max_pixels / float(image.width * image.height)) ** 0.5)
+            if output_format == "JPEG":
+                # Let the decoder skip detail that would be scaled away anyway.
+                image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+                image = image.convert("RGB")
+            elif output_format == "WEBP":
+                image = image.convert("RGBA")
+            elif image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+                image = image.convert("RGBA")
+            image.load()
+
+            # Drafting may already have shrunk the image, so the scale is taken again from what was decoded.
+            scale = min(1.0, (max_pixels / float(image.width * image.height)) ** 0.5)
+
+            output_path = source_path + extension
+            for attempt in range(MAX_ENCODE_ATTEMPTS):
+                width = max(int(image.width * scale), 1)
+                height = max(int(image.height * scale), 1)
+                resized = image if (width, height) == image.size else image.resize((width, height), Image.LANCZOS)
+
+                if output_format == "JPEG":
+                    resized.save(output_path, output_format, quality=85, optimize=True, progressive=True)
+                elif output_format == "WEBP":
+                    resized.save(output_path, output_format, quality=85, method=4)
+                else:
+                    resized.save(output_path, output_format, optimize=True)
+
+                if os.path.getsize(output_path) <= max_bytes:
+                    return output_path, extension
+                scale *= DOWNSCALE_STEP
+
+            os.remove(output_path)
+            raise OSError("The image could not be made smaller than %u bytes." % max_bytes)
+    finally:
+        if os.path.exists(source_path):
+            os.remove(source_path)
+
+class ImagePipeline(object):
+    """
+        Hosts images from bridges without ever downloading or decoding them on the core thread. Downloads run on the
+        application's downloader threads and are hashed as they are written, so an image that is already hosted is
+        returned without being decoded at all. Anything new is handed to a pool of transcoding processes which enforce
+        the size limits, and the name of the hosted image is delivered through a future.
+    """
+
+    application = None
+    """
+        The application whose event loop is woken when a transcode completes.
+    """
+
+    image_store = None
+    """
+        The image store hosted images are kept in.
+    """
+
+    downloader = None
+    """
+        The downloader whose threads images are downloaded on.
+    """
+
+    max_pixels = None
+    """
+        The most pixels a hosted image may have. Larger images are downscaled.
+    """
+
+    max_bytes = None
+    """
+        The largest a hosted image may be in bytes. Larger images are downscaled.
+    """
+
+    max_download_bytes = None
+    """
+        The largest a download may be in bytes. Larger downloads are abandoned.
+    """
+
+    worker_processes = None
+    """
+        The number of transcoding processes.
+    """
+
+    executor = None
+    """
+        The process pool transcoding images. This is created on first use.
+    """
+
+    inbox = None
+    """
+        The inbox completion callbacks are delivered through.
+    """
+
+    lock = None
+    """
+        The lock guarding the process pool and statistics, as images are hosted from several download threads.
+    """
+
+    transcoded_count = None
+    """
+        The total number of images transcoded.
+    """
+
+    failed_count = None
+    """
+        The total number of images that could not be downloaded or transcoded.
+    """
+
+    def __init__(self, application, image_store, downloader, max_pixels, max_bytes, max_download_bytes, worker_processes=2):
+        """
+            Initializes a new image pipeline.
+
+            :param application: The application whose event loop is woken when a transcode completes.
+            :param image_store: The image store hosted images are kept in.
+            :param downloader: The downloader whose threads images are downloaded on.
+            :param max_pixels: The most pixels a hosted image may have.
+            :param max_bytes: The largest a hosted image may be in bytes.
+            :param max_download_bytes: The largest a download may be in bytes.
+            :param worker_processes: The number of transcoding processes.
+        """
+        self.application = application
+        self.image_store = image_store
+        self.downloader = downloader
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self.max_download_bytes = max_download_bytes
+        self.worker_processes = worker_processes
+        self.inbox = Inbox(application)
+        self.lock = threading.Lock()
+        self.transcoded_count = 0
+        self.failed_count = 0
+
+    def host_image(self, download_function):
+        """
+            Downloads an image and hosts it. The download runs on one of the downloader's threads and decoding and
+            encoding run in a transcoding process, so this returns immediately.
+
+            :param download_function: Called on a download thread with a file-like object to write the image to.
+            :return: A future resolving to the name of the hosted image in the store. If the image cannot be hosted,
+                the future holds the exception instead.
+        """
+        future = concurrent.futures.Future()
+        self.downloader.submit(self.download_image, download_function, future)
+        return future
+
+    def download_image(self, download_function, future):
+        """
+            Downloads an image and submits it for transcoding unless it is already hosted. This runs on a download
+            thread. The future always receives a result or an exception, as relays wait on it.
+        """
+        writer = None
+        executor = None
+        try:
+            writer = self.image_store.create_writer(max_size=self.max_download_bytes)
+            try:
+                download_function(writer)
+            finally:
+                writer.close()
+
+            digest = writer.get_digest()
+            name = self.image_store.lookup_digest(digest)
+            if name is not None:
+                os.remove(writer.path)
+                future.set_result(name)
+                return
+
+            with self.lock:
+                if self.executor is None:
+                    # Spawn rather than fork, as threads are already running by the time the first image arrives.
+                    self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.worker_processes, mp_context=multiprocessing.get_context("spawn"))
+                executor = self.executor
+                transcode = executor.submit(transcode_image, writer.path, self.max_pixels, self.max_bytes)
+        except Exception as e:
+            if isinstance(e, concurrent.futures.BrokenExecutor):
+                self.discard_executor(executor)
+            if writer is not None and os.path.exists(writer.path):
+                os.remove(writer.path)
+            with self.lock:
+                self.failed_count += 1
+            future.set_exception(e)
+            return
+
+        transcode.add_done_callback(lambda transcode: self.complete_transcode(transcode, digest, future, executor))
+
+    def discard_executor(self, executor):
+        """
+            Drops a process pool that has broken, such as when a transcoding process was killed, so the next image
+            starts a new one. Nothing happens if the pool has already been replaced.
+        """
+        with self.lock:
+            if executor is None or self.executor is not executor:
+                return
+            self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def complete_transcode(self, transcode, digest, future, executor):
+        """
+            Moves a transcoded image into the store. This runs on the thread that completed the transcode.
+        """
+        try:
+            output_path, extension = transcode.result()
+            name = self.image_store.add_file(output_path, self.image_store.get_name(digest, extension))
+        except Exception as e:
+            if isinstance(e, concurrent.futures.BrokenExecutor):
+                self.discard_executor(executor)
+            with self.lock:
+                self.failed_count += 1
+            future.set_exception(e)
+            return
+
+        with self.lock:
+            self.transcoded_count += 1
+        future.set_result(name)
+
+    def call_when_done(self, future, callback, *args):
+        """
+            Calls a callback on the core thread once a future from host_image is done.
+
+            :param future: The future to wait on.
+            :param callback: The function to call. It is given the future followed by any additional arguments.
+        """
+        future.add_done_callback(lambda future: self.inbox.put(callback, future, *args))
+
+    def drain(self):
+        """
+            Runs all completion callbacks that are ready. This must only be called from the core thread.
+        """
+        self.inbox.drain()
+
+    def collect_metrics(self, metrics):
+        """
+            Reports the pipeline's activity to the given metrics registry.
+        """
+        metrics.set_counter("pybridge_image_transcoded_total", (), self.transcoded_count)
+        metrics.set_counter("pybridge_image_failed_total", (), self.failed_count)
+
+    def shutdown(self):
+        """
+            Stops the transcoding processes, abandoning any queued transcodes.
+        """
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
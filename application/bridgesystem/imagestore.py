@@ -0,0 +1,422 @@
+"""
+    Hosted image store programming.
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import collections
+
+DOWNLOAD_CHUNK_SIZE = 65536
+"""
+    The number of bytes read at a time when hashing a file that is already on disk.
+"""
+
+INCOMING_DIRECTORY = ".incoming"
+"""
+    The directory within the store that downloads are written to before being moved into place. It lives on the same
+    file system as the store so moving a download in is a rename.
+"""
+
+class HashingWriter(object):
+    """
+        A file-like object writing to a temporary file in the store while hashing everything written to it, so the
+        content address of a download is known as soon as it completes.
+    """
+
+    path = None
+    """
+        The path of the temporary file.
+    """
+
+    handle = None
+    """
+        The open handle of the temporary file.
+    """
+
+    hash = None
+    """
+        The running hash of everything written so far.
+    """
+
+    size = None
+    """
+        The number of bytes written so far.
+    """
+
+    max_size = None
+    """
+        The most bytes that may be written, or None if unlimited.
+    """
+
+    def __init__(self, directory, max_size=None):
+        file_descriptor, self.path = tempfile.mkstemp(dir=directory)
+        self.handle = os.fdopen(file_descriptor, "wb")
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.max_size = max_size
+
+    def write(self, data):
+        if self.max_size is not None and self.size + len(data) > self.max_size:
+            raise OSError("The image is larger than the %u byte limit." % self.max_size)
+
+        self.hash.update(data)
+        self.handle.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def get_digest(self):
+        return self.hash.hexdigest()
+
+class ImageStore(object):
+    """
+        A content addressed store for hosted images. Every image is named after the SHA-256 digest of its downloaded
+        bytes and kept in a directory sharded by the first bytes of the digest, so reposted images are stored once.
+
+        Every stored image is recorded in an index kept in least recently used order and journaled to disk, so the
+        total size is always known and eviction never has to list the store's directories. Several worker processes
+        may share one store directory, each with its own index, so a hit is only trusted once the file is confirmed to
+        still exist.
+    """
+
+    base_path = None
+    """
+        The directory images are stored in. This is the directory served to the web.
+    """
+
+    index_path = None
+    """
+        The path of the index journal. This should not be within base_path.
+    """
+
+    max_size = None
+    """
+        The total size in bytes the store is evicted down to, or zero if the size is not limited.
+    """
+
+    max_age = None
+    """
+        How long in seconds an image may go unused before it is evicted, or zero if images never expire.
+    """
+
+    entries = None
+    """
+        An ordered dictionary mapping stored image names to [size, last used time] entries, least recently used first.
+    """
+
+    digest_names = None
+    """
+        A dictionary mapping the digest of every stored image to its name, whatever its extension.
+    """
+
+    total_size = None
+    """
+        The total size in bytes of every image in the index.
+    """
+
+    journal = None
+    """
+        The index journal opened for appending.
+    """
+
+    journal_length = None
+    """
+        The number of records in the index journal, used to decide when it should be compacted.
+    """
+
+    stored_count = None
+    """
+        The total number of images written to the store.
+    """
+
+    deduplicated_count = None
+    """
+        The total number of images that were already stored and so were not written again.
+    """
+
+    evicted_count = None
+    """
+        The total number of images evicted from the store.
+    """
+
+    lock = None
+    """
+        The lock guarding the index. Bridges may store images from their worker threads.
+    """
+
+    def __init__(self, base_path, index_path, max_size=0, max_age=0):
+        """
+            Initializes a new image store, loading its index.
+
+            :param base_path: The directory images are stored in.
+            :param index_path: The path of the index journal.
+            :param max_size: The total size in bytes the store is evicted down to, or zero if unlimited.
+            :param max_age: How long in seconds an image may go unused before it is evicted, or zero if unlimited.
+        """
+        self.base_path = base_path
+        self.index_path = index_path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = collections.OrderedDict()
+        self.digest_names = {}
+        self.total_size = 0
+        self.stored_count = 0
+        self.deduplicated_count = 0
+        self.evicted_count = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(self.base_path, INCOMING_DIRECTORY), exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        """
+            Replays the index journal and then compacts it. Each record is one of "A name size time" when an image is
+            added, "T name time" when it is used and "D name" when it is removed.
+        """
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as handle:
+                for line in handle:
+                    record = line.split()
+                    try:
+                        if record[0] == "A":
+                            self.entries.pop(record[1], None)
+                            self.entries[record[1]] = [int(record[2]), float(record[3])]
+                        elif record[0] == "T" and record[1] in self.entries:
+                            self.entries[record[1]][1] = float(record[2])
+                            self.entries.move_to_end(record[1])
+                        elif record[0] == "D":
+                            self.entries.pop(record[1], None)
+                    except (IndexError, ValueError) as e:
+                        # A record cut short by a crash. Everything before it is still good.
+                        print("!!! Ignoring a damaged image store index record: %s" % line.strip())
+
+        self.total_size = sum(entry[0] for entry in self.entries.values())
+        self.digest_names = {self.get_digest(name): name for name in self.entries.keys()}
+        self.compact_index()
+
+    def compact_index(self):
+        """
+            Rewrites the index journal to hold a single record per stored image.
+        """
+        if self.journal is not None:
+            self.journal.close()
+
+        index_directory = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(index_directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=index_directory)
+        with os.fdopen(file_descriptor, "w") as handle:
+            for name, (size, last_used) in self.entries.items():
+                handle.write("A %s %u %f\n" % (name, size, last_used))
+        os.replace(temporary_path, self.index_path)
+
+        self.journal = open(self.index_path, "a")
+        self.journal_length = len(self.entries)
+
+    def write_journal(self, record):
+        self.journal.write(record)
+        self.journal.flush()
+        self.journal_length += 1
+
+        if self.journal_length > 2 * len(self.entries) + 1024:
+            self.compact_index()
+
+    def get_name(self, digest, extension):
+        """
+            Returns the name of the image with the given digest, which is its path relative to the store.
+        """
+        return "%s/%s/%s%s" % (digest[0:2], digest[2:4], digest, extension)
+
+    def get_digest(self, name):
+        return os.path.splitext(os.path.basename(name))[0]
+
+    def get_local_path(self, name):
+        return os.path.join(self.base_path, name)
+
+    def lookup_digest(self, digest):
+        """
+            Returns the name of the stored image with the given digest, marking it as used and counting it as
+            deduplicated, or None if no such image is stored.
+        """
+        with self.lock:
+            name = self.digest_names.get(digest)
+        if name is None or self.lookup(name) is False:
+            return None
+
+        with self.lock:
+            self.deduplicated_count += 1
+        return name
+
+    def lookup(self, name):
+        """
+            Returns whether or not the given image is stored, marking it as used if so.
+        """
+        with self.lock:
+            exists = os.path.exists(self.get_local_path(name))
+            entry = self.entries.get(name)
+            now = time.time()
+
+            if entry is None:
+                # Stored by another process sharing the directory. Track it from here on.
+                if exists:
+                    self.add_entry(name, os.path.getsize(self.get_local_path(name)), now)
+                return exists
+
+            if exists is False:
+                self.remove_entry(name)
+                return False
+
+            entry[1] = now
+            self.entries.move_to_end(name)
+            self.write_journal("T %s %f\n" % (name, now))
+            return True
+
+    def add_entry(self, name, size, now):
+        self.entries[name] = [size, now]
+        self.digest_names[self.get_digest(name)] = name
+        self.total_size += size
+        self.write_journal("A %s %u %f\n" % (name, size, now))
+
+    def remove_entry(self, name):
+        size, last_used = self.entries.pop(name)
+        self.total_size -= size
+        if self.digest_names.get(self.get_digest(name)) == name:
+            del self.digest_names[self.get_digest(name)]
+        self.write_journal("D %s\n" % name)
+
+    def create_writer(self, max_size=None):
+        """
+            Returns a new HashingWriter to download an image into.
+
+            :param max_size: The most bytes that may be downloaded, or None if unlimited.
+        """
+        return HashingWriter(os.path.join(self.base_path, INCOMING_DIRECTORY), max_size=max_size)
+
+    def store_download(self, download_function, extension, convert_function=None):
+        """
+            Downloads an image straight into the store, hashing it as it is written. If an image with the same content
+            is already stored, the download is discarded without being converted or written again.
+
+            :param download_function: Called with a file-like object to write the image to.
+            :param extension: The extension of the stored image, including the dot.
+            :param convert_function: If specified, called with the path of the download to convert it in place before
+                it is stored. Raises OSError if the image cannot be converted.
+            :return: The name of the stored image.
+        """
+        writer = self.create_writer()
+        try:
+            download_function(writer)
+        except Exception:
+            writer.close()
+            os.remove(writer.path)
+            raise
+
+        writer.close()
+        return self.store_file(writer.path, writer.get_digest(), extension, convert_function)
+
+    def store_path(self, path, extension, convert_function=None):
+        """
+            Stores an image that is already on disk. The file is moved into the store or removed if an image with the
+            same content is already stored.
+
+            :param path: The path of the image.
+            :param extension: The extension of the stored image, including the dot.
+            :param convert_function: If specified, called with the path to convert the image in place before it is
+                stored.
+            :return: The name of the stored image.
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            while True:
+                data = handle.read(DOWNLOAD_CHUNK_SIZE)
+                if len(data) == 0:
+                    break
+                digest.update(data)
+        return self.store_file(path, digest.hexdigest(), extension, convert_function)
+
+    def store_file(self, path, digest, extension, convert_function):
+        name = self.get_name(digest, extension)
+        if self.lookup(name):
+            os.remove(path)
+            with self.lock:
+                self.deduplicated_count += 1
+            return name
+
+        try:
+            if convert_function is not None:
+                convert_function(path)
+        except Exception:
+            os.remove(path)
+            raise
+        return self.add_file(path, name)
+
+    def add_file(self, path, name):
+        """
+            Moves a file into the store under the given name.
+
+            :return: The name of the stored image.
+        """
+        try:
+            local_path = self.get_local_path(name)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            os.chmod(path, 0o664)
+            os.replace(path, local_path)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+        with self.lock:
+            if name in self.entries:
+                self.remove_entry(name)
+            self.add_entry(name, os.path.getsize(local_path), time.time())
+            self.stored_count += 1
+        return name
+
+    def sweep(self):
+        """
+            Evicts every image that has gone unused for longer than max_age and then the least recently used images
+            until the store is no larger than max_size. Only the index is consulted to find them.
+
+            :return: The number of images evicted.
+        """
+        evicted_names = []
+        with self.lock:
+            expiry_time = time.time() - self.max_age
+            while len(self.entries) != 0:
+                name, (size, last_used) = next(iter(self.entries.items()))
+                if (self.max_age == 0 or last_used >= expiry_time) and (self.max_size == 0 or self.total_size <= self.max_size):
+                    break
+
+                self.remove_entry(name)
+                evicted_names.append(name)
+            self.evicted_count += len(evicted_names)
+
+        for name in evicted_names:
+            try:
+                os.remove(self.get_local_path(name))
+            except FileNotFoundError as e:
+                pass
+        return len(evicted_names)
+
+    def collect_metrics(self, metrics):
+        """
+            Reports the store's size and activity to the given metrics registry.
+        """
+        metrics.set_gauge("pybridge_image_store_bytes", (), self.total_size)
+        metrics.set_gauge("pybridge_image_store_images", (), len(self.entries))
+        metrics.set_counter("pybridge_image_store_stored_total", (), self.stored_count)
+        metrics.set_counter("pybridge_image_store_deduplicated_total", (), self.deduplicated_count)
+        metrics.set_counter("pybridge_image_store_evicted_total", (), self.evicted_count)
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
@@ -0,0 +1,148 @@
+"""
+    Remote media cache programming.
+"""
+
+import os
+import tempfile
+import threading
+import collections
+
+class MediaCache(object):
+    """
+        A bounded least recently used cache mapping the stable identifiers remote services give their media, such as
+        Telegram's unique file ID, to the names of the images hosted for them. The cache is journaled to disk so
+        repeated media, like popular stickers, resolves without a request even after a restart.
+    """
+
+    path = None
+    """
+        The path of the cache journal.
+    """
+
+    capacity = None
+    """
+        The most entries kept. The least recently used entry is dropped to make room.
+    """
+
+    entries = None
+    """
+        An ordered dictionary mapping media identifiers to hosted image names, least recently used first.
+    """
+
+    journal = None
+    """
+        The cache journal opened for appending.
+    """
+
+    journal_length = None
+    """
+        The number of records in the journal, used to decide when it should be compacted.
+    """
+
+    hit_count = None
+    """
+        The total number of lookups answered by the cache.
+    """
+
+    miss_count = None
+    """
+        The total number of lookups the cache could not answer.
+    """
+
+    lock = None
+    """
+        The lock guarding the cache. Entries are added from download threads.
+    """
+
+    def __init__(self, path, capacity=4096):
+        """
+            Initializes a new media cache, loading its journal.
+
+            :param path: The path of the cache journal.
+            :param capacity: The most entries kept.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as handle:
+                for line in handle:
+                    record = line.split()
+                    if len(record) == 2:
+                        self.entries.pop(record[0], None)
+                        self.entries[record[0]] = record[1]
+                    elif len(record) == 1:
+                        self.entries.pop(record[0], None)
+
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        self.compact()
+
+    def compact(self):
+        """
+            Rewrites the journal to hold a single record per entry, least recently used first.
+        """
+        if self.journal is not None:
+            self.journal.close()
+
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(file_descriptor, "w") as handle:
+            for identifier, name in self.entries.items():
+                handle.write("%s %s\n" % (identifier, name))
+        os.replace(temporary_path, self.path)
+
+        self.journal = open(self.path, "a")
+        self.journal_length = len(self.entries)
+
+    def write_journal(self, record):
+        self.journal.write(record)
+        self.journal.flush()
+        self.journal_length += 1
+
+        if self.journal_length > 2 * self.capacity:
+            self.compact()
+
+    def get(self, identifier):
+        """
+            Returns the hosted image name cached for the given media, or None if there is none.
+        """
+        with self.lock:
+            name = self.entries.get(identifier)
+            if name is None:
+                self.miss_count += 1
+                return None
+
+            # Recency is only kept in memory. Losing it on a restart costs nothing but a slightly different eviction.
+            self.entries.move_to_end(identifier)
+            self.hit_count += 1
+            return name
+
+    def put(self, identifier, name):
+        """
+            Caches the hosted image name for the given media.
+        """
+        with self.lock:
+            self.entries.pop(identifier, None)
+            self.entries[identifier] = name
+            self.write_journal("%s %s\n" % (identifier, name))
+
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def remove(self, identifier):
+        """
+            Forgets the given media, such as when its hosted image has since been evicted.
+        """
+        with self.lock:
+            if self.entries.pop(identifier, None) is not None:
+                self.write_journal("%s\n" % identifier)
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
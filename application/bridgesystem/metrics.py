@@ -0,0 +1,320 @@
+"""
+    Metrics programming. Counters, gauges and histograms are collected for the relay path and exposed in the
+    Prometheus text format over a local HTTP endpoint and/or a Unix socket.
+"""
+
+import os
+import threading
+import socketserver
+import http.server
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+"""
+    The default histogram bucket upper bounds in seconds.
+"""
+
+METRIC_DESCRIPTIONS = {
+    "pybridge_events_received_total": ("counter", "Events received from a bridge, per channel."),
+    "pybridge_events_delivered_total": ("counter", "Events delivered to a receiving bridge, per channel."),
+    "pybridge_events_filtered_total": ("counter", "Events a bridge in the sender's domain did not accept, per channel."),
+    "pybridge_events_failed_total": ("counter", "Events whose responder raised an exception."),
+    "pybridge_outbound_enqueued_total": ("counter", "Items accepted by a bridge's outbound queue."),
+    "pybridge_outbound_dropped_total": ("counter", "Outbound items dropped because a bridge's outbound queue or long block buffers were full."),
+    "pybridge_outbound_coalesced_total": ("counter", "Outbound items merged into an already queued item."),
+    "pybridge_outbound_queue_depth": ("gauge", "Items currently waiting in a bridge's outbound queue."),
+    "pybridge_outbound_queue_high_water_mark": ("gauge", "The most items a bridge's outbound queue has held at once."),
+    "pybridge_long_block_depth": ("gauge", "Blocks currently waiting in a bridge's long block buffers."),
+    "pybridge_rate_limited_total": ("counter", "Sends a bridge's rate limiter told to wait."),
+    "pybridge_rate_limit_wait_seconds": ("gauge", "The expected wait before a bridge's rate limiter permits its next send."),
+    "pybridge_image_store_bytes": ("gauge", "The total size of the hosted image store."),
+    "pybridge_image_store_images": ("gauge", "The number of images in the hosted image store."),
+    "pybridge_image_store_stored_total": ("counter", "Images written to the hosted image store."),
+    "pybridge_image_store_deduplicated_total": ("counter", "Images that were already in the hosted image store and were not written again."),
+    "pybridge_image_store_evicted_total": ("counter", "Images evicted from the hosted image store."),
+    "pybridge_relay_latency_seconds": ("histogram", "Time from an event being received to the relayed message being written to the remote."),
+    "pybridge_tick_seconds": ("histogram", "Time spent processing a single update tick."),
+    "pybridge_profile_seconds": ("gauge", "Rolling percentiles of the time taken by each profiled bridge call."),
+    "pybridge_slow_ticks_total": ("counter", "Ticks that exceeded the profiling budget."),
+    "pybridge_image_transcoded_total": ("counter", "Images transcoded for hosting."),
+    "pybridge_image_failed_total": ("counter", "Images that could not be downloaded or transcoded for hosting."),
+    "pybridge_download_connections_opened_total": ("counter", "Connections opened by the downloader."),
+    "pybridge_download_connections_reused_total": ("counter", "Downloads that reused a pooled keep-alive connection."),
+    "pybridge_download_bytes_total": ("counter", "Bytes downloaded by the downloader."),
+    "pybridge_media_cache_hits_total": ("counter", "Media resolved to an already hosted image from the media cache."),
+    "pybridge_media_cache_misses_total": ("counter", "Media that was not in the media cache and had to be downloaded."),
+    "pybridge_discord_parked_channels": ("gauge", "Discord channels currently parked until their rate limit bucket resets."),
+    "pybridge_discord_global_parked": ("gauge", "Whether every Discord send is parked by a global rate limit."),
+    "pybridge_discord_rate_limited_total": ("counter", "Discord sends that were rejected with a rate limit."),
+    "pybridge_discord_bucket_waits_total": ("counter", "Discord sends that waited for a rate limit bucket to reset."),
+    "pybridge_discord_bucket_wait_seconds_total": ("counter", "Total time Discord sends waited for rate limit buckets to reset."),
+    "pybridge_discord_send_wait_seconds": ("histogram", "Time a Discord message waited on rate limits before it was sent."),
+    "pybridge_process_steady_state_resident_bytes": ("gauge", "The resident memory of the process once a Discord bridge has settled after its initial sync."),
+}
+"""
+    A dictionary mapping metric names to their Prometheus type and help text.
+"""
+
+class Histogram(object):
+    """
+        A class representing a single cumulative histogram.
+    """
+
+    buckets = None
+    """
+        The bucket upper bounds, in ascending order.
+    """
+
+    bucket_counts = None
+    """
+        The number of observations that fell into each bucket. The final entry counts observations above every bound.
+    """
+
+    count = None
+    """
+        The total number of observations.
+    """
+
+    total = None
+    """
+        The sum of every observation.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += value
+
+class Metrics(object):
+    """
+        The application wide metrics registry. Metrics are keyed by name and a tuple of (label, value) pairs so the
+        hot path never has to build or sort label dictionaries. Recording is thread safe so bridge threads may
+        report into the same registry as the core thread.
+    """
+
+    counters = None
+    """
+        A dictionary mapping (name, labels) to counter values.
+    """
+
+    gauges = None
+    """
+        A dictionary mapping (name, labels) to gauge values.
+    """
+
+    histograms = None
+    """
+        A dictionary mapping (name, labels) to histograms.
+    """
+
+    collectors = None
+    """
+        Functions called before rendering so they can update gauges and counters that are tracked elsewhere.
+    """
+
+    lock = None
+    """
+        The lock guarding every metric.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def increment(self, name, labels=(), amount=1):
+        """
+            Increments a counter.
+
+            :param name: The name of the counter.
+            :param labels: A tuple of (label, value) pairs.
+            :param amount: The amount to increment the counter by.
+        """
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def increment_each(self, name, labels_list):
+        """
+            Increments a counter once for each of the given label tuples, taking the lock only once.
+        """
+        counters = self.counters
+        with self.lock:
+            for labels in labels_list:
+                key = (name, labels)
+                counters[key] = counters.get(key, 0) + 1
+
+    def set_counter(self, name, labels, value):
+        """
+            Sets a counter that is tracked elsewhere, such as the counts kept by a BoundedQueue.
+        """
+        with self.lock:
+            self.counters[(name, labels)] = value
+
+    def set_gauge(self, name, labels, value):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        """
+            Records an observation in a histogram.
+
+            :param name: The name of the histogram.
+            :param labels: A tuple of (label, value) pairs.
+            :param value: The observed value.
+        """
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def clear_collectors(self):
+        self.collectors = []
+
+    def collect(self):
+        for collector in list(self.collectors):
+            try:
+                collector()
+            except Exception as e:
+                print("!!! Metrics collector failed: %s" % str(e))
+
+    @staticmethod
+    def format_labels(labels, extra_labels=()):
+        labels = labels + extra_labels
+        if len(labels) == 0:
+            return ""
+
+        formatted_labels = []
+        for label, value in labels:
+            value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+            formatted_labels.append("%s=\"%s\"" % (label, value))
+        return "{%s}" % ",".join(formatted_labels)
+
+    def render(self):
+        """
+            Renders every metric in the Prometheus text exposition format.
+        """
+        self.collect()
+
+        with self.lock:
+            metrics = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                metrics.setdefault(name, []).append("%s%s %s" % (name, Metrics.format_labels(labels), value))
+            for (name, labels), value in sorted(self.gauges.items()):
+                metrics.setdefault(name, []).append("%s%s %s" % (name, Metrics.format_labels(labels), value))
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                lines = metrics.setdefault(name, [])
+                cumulative_count = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append("%s_bucket%s %u" % (name, Metrics.format_labels(labels, (("le", repr(bound)),)), cumulative_count))
+                lines.append("%s_bucket%s %u" % (name, Metrics.format_labels(labels, (("le", "+Inf"),)), histogram.count))
+                lines.append("%s_sum%s %r" % (name, Metrics.format_labels(labels), histogram.total))
+                lines.append("%s_count%s %u" % (name, Metrics.format_labels(labels), histogram.count))
+
+        output = []
+        for name in sorted(metrics.keys()):
+            if name in METRIC_DESCRIPTIONS:
+                metric_type, description = METRIC_DESCRIPTIONS[name]
+                output.append("# HELP %s %s" % (name, description))
+                output.append("# TYPE %s %s" % (name, metric_type))
+            output += metrics[name]
+        return "\n".join(output) + "\n"
+
+class MetricsServer(object):
+    """
+        Serves a metrics registry on a local HTTP endpoint and/or a Unix socket from a background thread. The HTTP
+        endpoint answers GET requests with the Prometheus text format while the Unix socket writes the same text to
+        every client that connects.
+    """
+
+    class HTTPRequestHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = self.server.metrics.render().encode("utf8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class UnixRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(self.server.metrics.render().encode("utf8"))
+
+    metrics = None
+    """
+        The metrics registry being served.
+    """
+
+    servers = None
+    """
+        The running servers.
+    """
+
+    unix_socket_path = None
+    """
+        The path of the Unix socket being served, if any.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.servers = []
+
+    def start(self, host=None, port=None, unix_socket_path=None):
+        """
+            Starts serving the metrics.
+
+            :param host: The address to serve HTTP on. If None, HTTP is not served.
+            :param port: The port to serve HTTP on.
+            :param unix_socket_path: The path of the Unix socket to serve on. If None, no Unix socket is served.
+        """
+        if host is not None:
+            self.servers.append(http.server.ThreadingHTTPServer((host, port), MetricsServer.HTTPRequestHandler))
+
+        if unix_socket_path is not None:
+            if os.path.exists(unix_socket_path):
+                os.unlink(unix_socket_path)
+            self.servers.append(socketserver.UnixStreamServer(unix_socket_path, MetricsServer.UnixRequestHandler))
+            self.unix_socket_path = unix_socket_path
+
+        for server in self.servers:
+            server.metrics = self.metrics
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="PyBridge Metrics", daemon=True).start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+        if self.unix_socket_path is not None:
+            if os.path.exists(self.unix_socket_path):
+                os.unlink(self.unix_socket_path)
+            self.unix_socket_path = None
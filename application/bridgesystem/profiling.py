@@ -0,0 +1,151 @@
+"""
+    Main loop profiling programming.
+"""
+
+import time
+import threading
+import collections
+
+PROFILE_PERCENTILES = (50, 90, 99)
+"""
+    The percentiles reported for every profiled call.
+"""
+
+class Profiler(object):
+    """
+        Attributes main loop time to the bridges and calls responsible for it. Every timed call is kept in a rolling
+        window per (bridge, call) pair for percentiles and any tick exceeding the budget is logged along with the
+        calls that took the longest during it.
+    """
+
+    budget = None
+    """
+        The longest a tick may take in seconds before it is logged.
+    """
+
+    samples = None
+    """
+        A dictionary mapping (bridge name, call) pairs to a rolling window of durations in seconds.
+    """
+
+    window_size = None
+    """
+        How many durations are kept per (bridge name, call) pair.
+    """
+
+    tick_start = None
+    """
+        The monotonic time the current tick started at, or None when not inside a tick.
+    """
+
+    tick_calls = None
+    """
+        The (duration, bridge name, call) entries timed during the current tick.
+    """
+
+    slow_tick_count = None
+    """
+        How many ticks have exceeded the budget.
+    """
+
+    lock = None
+    """
+        The lock guarding the samples, as metrics are collected from the metrics server's thread.
+    """
+
+    def __init__(self, budget, window_size=1000):
+        """
+            Initializes a new profiler.
+
+            :param budget: The longest a tick may take in seconds before it is logged.
+            :param window_size: How many durations are kept per bridge and call for the percentiles.
+        """
+        self.budget = budget
+        self.window_size = window_size
+        self.samples = {}
+        self.tick_calls = []
+        self.slow_tick_count = 0
+        self.lock = threading.Lock()
+
+    def begin_tick(self):
+        """
+            Starts timing a tick unless one is already being timed, in which case the calls are attributed to it.
+
+            :return: True if a tick was started and end_tick should be called for it.
+        """
+        if self.tick_start is not None:
+            return False
+
+        self.tick_start = time.monotonic()
+        self.tick_calls = []
+        return True
+
+    def end_tick(self):
+        """
+            Ends the current tick, logging it if it exceeded the budget.
+        """
+        duration = time.monotonic() - self.tick_start
+        self.tick_start = None
+
+        if duration > self.budget:
+            self.report_slow_tick(duration, self.tick_calls)
+        self.tick_calls = []
+
+    def record(self, bridge_name, call, duration):
+        """
+            Records the duration of a single call. Calls made outside of a tick, such as those made from event loop
+            callbacks, are checked against the budget on their own.
+
+            :param bridge_name: The name of the bridge the time is attributed to.
+            :param call: A description of the call, such as update or the name of an event.
+            :param duration: The time the call took in seconds.
+        """
+        key = (bridge_name, call)
+        with self.lock:
+            samples = self.samples.get(key)
+            if samples is None:
+                samples = self.samples[key] = collections.deque(maxlen=self.window_size)
+            samples.append(duration)
+
+        if self.tick_start is not None:
+            self.tick_calls.append((duration, bridge_name, call))
+        elif duration > self.budget:
+            self.report_slow_tick(duration, [(duration, bridge_name, call)])
+
+    def report_slow_tick(self, duration, calls):
+        self.slow_tick_count += 1
+
+        slowest_calls = sorted(calls, reverse=True)[:3]
+        slowest_calls = ", ".join("%s %s %.1fms" % (bridge_name, call, call_duration * 1000.0) for call_duration, bridge_name, call in slowest_calls)
+        print("!!! Tick took %.1fms, over the %.1fms budget. Slowest calls: %s" % (duration * 1000.0, self.budget * 1000.0,
+                                                                                   slowest_calls if slowest_calls != "" else "none recorded"))
+
+    def get_percentiles(self, bridge_name, call):
+        """
+            Returns a dictionary mapping each of PROFILE_PERCENTILES to the duration in seconds of the given bridge's
+            call at that percentile over the rolling window, or None if the call has not been timed.
+        """
+        with self.lock:
+            samples = self.samples.get((bridge_name, call))
+            if samples is None or len(samples) == 0:
+                return None
+            samples = list(samples)
+
+        samples.sort()
+        return {percentile: samples[min(len(samples) - 1, len(samples) * percentile // 100)] for percentile in PROFILE_PERCENTILES}
+
+    def collect_metrics(self, metrics):
+        """
+            Reports the rolling percentiles of every timed call to the given metrics registry.
+        """
+        with self.lock:
+            keys = list(self.samples.keys())
+
+        for bridge_name, call in keys:
+            percentiles = self.get_percentiles(bridge_name, call)
+            if percentiles is None:
+                continue
+
+            for percentile, duration in percentiles.items():
+                metrics.set_gauge("pybridge_profile_seconds", (("bridge", bridge_name), ("call", call), ("quantile", "%.2f" % (percentile / 100.0))), duration)
+        metrics.set_counter("pybridge_slow_ticks_total", (), self.slow_tick_count)
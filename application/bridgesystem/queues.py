@@ -0,0 +1,164 @@
+"""
+    Bounded outbound queue programming.
+"""
+
+import threading
+import collections
+
+QUEUE_POLICIES = ("block", "dropOldest", "dropNewest", "coalesce")
+"""
+    The valid values for a bridge's outboundQueuePolicy. When the queue is full, block waits up to
+    outboundQueueBlockSeconds for room before dropping the new item, dropOldest discards the oldest queued item,
+    dropNewest discards the new item and coalesce merges the new item into the newest queued item if possible,
+    falling back to dropping the oldest. Block is only accepted for bridges whose queue is drained off the core
+    thread, as the core thread is the producer.
+"""
+
+class BoundedQueue(object):
+    """
+        A thread safe, bounded FIFO queue used for every bridge's outbound path. A stuck remote therefore costs a
+        bounded amount of memory, with drops and the high water mark recorded for the metrics.
+    """
+
+    capacity = None
+    """
+        The maximum number of items held at once.
+    """
+
+    policy = None
+    """
+        What to do with new items when the queue is full. One of QUEUE_POLICIES.
+    """
+
+    block_seconds = None
+    """
+        How long a put may wait for room when the policy is block.
+    """
+
+    coalesce_function = None
+    """
+        Called with the newest queued item and a new item when coalescing. Returns the merged item or None if the two
+        cannot be merged.
+    """
+
+    items = None
+    """
+        The queued items.
+    """
+
+    condition = None
+    """
+        The condition guarding the queued items, used to wake blocked producers.
+    """
+
+    enqueued_count = None
+    """
+        The total number of items accepted.
+    """
+
+    dropped_count = None
+    """
+        The total number of items dropped because the queue was full.
+    """
+
+    coalesced_count = None
+    """
+        The total number of items merged into an already queued item.
+    """
+
+    high_water_mark = None
+    """
+        The largest number of items that have been queued at once.
+    """
+
+    def __init__(self, capacity, policy="dropOldest", block_seconds=1.0, coalesce_function=None):
+        """
+            Initializes a new queue.
+
+            :param capacity: The maximum number of items held at once.
+            :param policy: What to do with new items when the queue is full. One of QUEUE_POLICIES.
+            :param block_seconds: How long a put may wait for room when the policy is block.
+            :param coalesce_function: Used to merge items when the policy is coalesce.
+        """
+        if policy not in QUEUE_POLICIES:
+            raise ValueError("Unknown queue policy '%s'." % policy)
+
+        self.capacity = capacity
+        self.policy = policy
+        self.block_seconds = block_seconds
+        self.coalesce_function = coalesce_function
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+
+        self.enqueued_count = 0
+        self.dropped_count = 0
+        self.coalesced_count = 0
+        self.high_water_mark = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        """
+            Queues an item, applying the queue policy if the queue is full.
+
+            :param item: The item to queue.
+            :return: True if the item was queued or merged, False if it was dropped.
+        """
+        with self.condition:
+            if len(self.items) >= self.capacity:
+                if self.policy == "block":
+                    self.condition.wait_for(lambda: len(self.items) < self.capacity, self.block_seconds)
+                    if len(self.items) >= self.capacity:
+                        self.dropped_count += 1
+                        return False
+                elif self.policy == "dropNewest":
+                    self.dropped_count += 1
+                    return False
+                elif self.policy == "coalesce" and self.coalesce_function is not None and len(self.items) != 0:
+                    merged_item = self.coalesce_function(self.items[-1], item)
+                    if merged_item is not None:
+                        self.items[-1] = merged_item
+                        self.coalesced_count += 1
+                        return True
+
+                    self.items.popleft()
+                    self.dropped_count += 1
+                else:
+                    self.items.popleft()
+                    self.dropped_count += 1
+
+            self.items.append(item)
+            self.enqueued_count += 1
+            if len(self.items) > self.high_water_mark:
+                self.high_water_mark = len(self.items)
+            return True
+
+    def get(self):
+        """
+            Removes and returns the oldest item, or None if the queue is empty.
+        """
+        with self.condition:
+            if len(self.items) == 0:
+                return None
+
+            item = self.items.popleft()
+            self.condition.notify()
+            return item
+
+    def push_front(self, item):
+        """
+            Returns an item that could not be processed to the front of the queue, ignoring the capacity.
+        """
+        with self.condition:
+            self.items.appendleft(item)
+
+    def drain(self):
+        """
+            Removes and returns every queued item, oldest first.
+        """
+        with self.condition:
+            items = list(self.items)
+            self.items.clear()
+            self.condition.notify_all()
+            return items
@@ -0,0 +1,174 @@
+"""
+    Outbound rate limiting programming.
+"""
+
+import time
+import threading
+
+MAX_IDLE_BUCKETS = 1024
+"""
+    How many destination buckets are kept before full, and therefore idle, buckets are discarded. A full bucket
+    behaves exactly like a new one so discarding them changes nothing.
+"""
+
+class TokenBucket(object):
+    """
+        A class representing a single token bucket. Tokens refill continuously at the bucket's rate up to its burst
+        and every send takes one.
+    """
+
+    rate = None
+    """
+        The number of tokens added per second.
+    """
+
+    burst = None
+    """
+        The most tokens the bucket holds, which is how many sends may go out back to back after a quiet period.
+    """
+
+    tokens = None
+    """
+        The number of tokens available as of last_time.
+    """
+
+    last_time = None
+    """
+        The monotonic time tokens were last refilled.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_time = time.monotonic()
+
+    def refill(self, now):
+        if now > self.last_time:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+
+    def get_wait(self, count, now):
+        """
+            Returns how many seconds until the given number of tokens are available.
+        """
+        self.refill(now)
+        if self.tokens >= count:
+            return 0.0
+        return (count - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+class RateLimiter(object):
+    """
+        Limits a bridge's outbound sends with token buckets. Every send takes a token from the bridge wide network
+        bucket and from the bucket of its destination, such as an IRC channel or a Telegram chat ID, and is only
+        permitted if both have one. Either bucket may be disabled by giving it no rate. The limiter is thread safe so
+        bridges may send from their own threads.
+    """
+
+    network_bucket = None
+    """
+        The bucket shared by every send of the bridge, or None if the bridge as a whole is not limited.
+    """
+
+    destination_rate = None
+    """
+        The rate of every destination bucket in sends per second, or None if destinations are not limited.
+    """
+
+    destination_burst = None
+    """
+        The burst of every destination bucket.
+    """
+
+    destination_buckets = None
+    """
+        A dictionary mapping destinations to their buckets.
+    """
+
+    limited_count = None
+    """
+        How many times a send has been told to wait.
+    """
+
+    lock = None
+    """
+        The lock guarding the buckets.
+    """
+
+    def __init__(self, rate=None, burst=1, destination_rate=None, destination_burst=1):
+        """
+            Initializes a new rate limiter.
+
+            :param rate: The sends per second permitted for the bridge as a whole. If None or zero, unlimited.
+            :param burst: How many sends the bridge may make back to back.
+            :param destination_rate: The sends per second permitted per destination. If None or zero, unlimited.
+            :param destination_burst: How many sends may be made to a single destination back to back.
+        """
+        if rate:
+            self.network_bucket = TokenBucket(rate, max(burst, 1))
+        if destination_rate:
+            self.destination_rate = destination_rate
+            self.destination_burst = max(destination_burst, 1)
+
+        self.destination_buckets = {}
+        self.limited_count = 0
+        self.lock = threading.Lock()
+
+    def get_destination_bucket(self, destination, now):
+        bucket = self.destination_buckets.get(destination)
+        if bucket is None:
+            if len(self.destination_buckets) >= MAX_IDLE_BUCKETS:
+                self.destination_buckets = {key: value for key, value in self.destination_buckets.items() if value.is_full(now) is False}
+            bucket = self.destination_buckets[destination] = TokenBucket(self.destination_rate, self.destination_burst)
+        return bucket
+
+    def get_wait(self, destination=None, count=1):
+        """
+            Returns how many seconds until a send of the given size to the given destination would be permitted,
+            without taking any tokens.
+
+            :param destination: The destination of the send. If None, only the network bucket is considered.
+            :param count: The number of sends.
+        """
+        if self.network_bucket is None and (destination is None or self.destination_rate is None):
+            return 0.0
+
+        with self.lock:
+            return self.get_wait_locked(destination, count, time.monotonic())
+
+    def get_wait_locked(self, destination, count, now):
+        wait = 0.0
+        if self.network_bucket is not None:
+            wait = self.network_bucket.get_wait(count, now)
+        if destination is not None and self.destination_rate is not None:
+            wait = max(wait, self.get_destination_bucket(destination, now).get_wait(count, now))
+        return wait
+
+    def acquire(self, destination=None, count=1):
+        """
+            Takes the tokens for a send if it is permitted right away. Otherwise nothing is taken and the caller
+            should try again once the returned wait has passed.
+
+            :param destination: The destination of the send. If None, only the network bucket is considered.
+            :param count: The number of sends.
+            :return: Zero if the send is permitted, otherwise the expected wait in seconds.
+        """
+        if self.network_bucket is None and (destination is None or self.destination_rate is None):
+            return 0.0
+
+        with self.lock:
+            now = time.monotonic()
+            wait = self.get_wait_locked(destination, count, now)
+            if wait > 0:
+                self.limited_count += 1
+                return wait
+
+            if self.network_bucket is not None:
+                self.network_bucket.tokens -= count
+            if destination is not None and self.destination_rate is not None:
+                self.destination_buckets[destination].tokens -= count
+            return 0.0
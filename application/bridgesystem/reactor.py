@@ -0,0 +1,140 @@
+"""
+    Shared socket reactor programming.
+"""
+
+import time
+import selectors
+
+class Reactor(object):
+    """
+        A shared I/O reactor that raw socket bridges register their sockets with. Rather than every connection
+        blocking on its own recv timeout in series, a single select/epoll call services every registered socket.
+
+        When an event loop is in use, registrations are handed to it directly since it is already driven by the
+        platform selector. Otherwise the reactor owns a selector which the fixed tick loop polls in place of sleeping.
+    """
+
+    selector = None
+    """
+        The selector in use when running on the fixed tick loop.
+    """
+
+    event_loop = None
+    """
+        The event loop registrations are forwarded to, if any.
+    """
+
+    def __init__(self, event_loop=None):
+        """
+            Initializes a new reactor.
+
+            :param event_loop: The event loop to forward registrations to. If None, a selector is created instead.
+        """
+        self.event_loop = event_loop
+        if self.event_loop is None:
+            self.selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, callback):
+        """
+            Registers a callback to be called whenever the given socket is readable.
+
+            :param fileobj: The socket to watch.
+            :param callback: The function to call. It is called with no arguments.
+        """
+        if self.event_loop is not None:
+            self.event_loop.add_reader(fileobj, callback)
+        else:
+            self.selector.register(fileobj, selectors.EVENT_READ, [callback, None])
+
+    def unregister(self, fileobj):
+        """
+            Stops watching the given socket for both reads and writes. Sockets that were never registered are quietly
+            ignored.
+
+            :param fileobj: The socket to stop watching.
+        """
+        if self.event_loop is not None:
+            self.event_loop.remove_reader(fileobj)
+            self.event_loop.remove_writer(fileobj)
+            return
+
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError) as e:
+            pass
+
+    def set_writer(self, fileobj, callback):
+        """
+            Registers a callback to be called whenever the given registered socket is writable. This is used to
+            flush outbound data that could not be written immediately.
+
+            :param fileobj: The socket to watch. It must already be registered for reads.
+            :param callback: The function to call. It is called with no arguments.
+        """
+        if self.event_loop is not None:
+            self.event_loop.add_writer(fileobj, callback)
+            return
+
+        key = self.selector.get_key(fileobj)
+        self.selector.modify(fileobj, selectors.EVENT_READ | selectors.EVENT_WRITE, [key.data[0], callback])
+
+    def clear_writer(self, fileobj):
+        """
+            Stops watching the given socket for writability.
+
+            :param fileobj: The socket to stop watching.
+        """
+        if self.event_loop is not None:
+            self.event_loop.remove_writer(fileobj)
+            return
+
+        try:
+            key = self.selector.get_key(fileobj)
+        except (KeyError, ValueError) as e:
+            return
+
+        if key.data[1] is not None:
+            self.selector.modify(fileobj, selectors.EVENT_READ, [key.data[0], None])
+
+    def poll(self, timeout):
+        """
+            Waits up to the given timeout for any registered socket to become readable, dispatching callbacks as
+            sockets become ready. This returns once the timeout has elapsed.
+
+            :param timeout: The time to wait in seconds.
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            # Some platforms refuse to select on nothing, so just sleep when nothing is registered.
+            if len(self.selector.get_map()) == 0:
+                time.sleep(remaining)
+                return
+
+            for key, mask in self.selector.select(remaining):
+                read_callback, write_callback = key.data
+
+                # An earlier callback in this batch may have unregistered or replaced this socket.
+                if mask & selectors.EVENT_WRITE and write_callback is not None and self.is_registered(key):
+                    write_callback()
+                if mask & selectors.EVENT_READ and self.is_registered(key):
+                    read_callback()
+
+    def is_registered(self, key):
+        """
+            Returns whether the socket of the given selector key is still registered.
+        """
+        current_key = self.selector.get_map().get(key.fd)
+        return current_key is not None and current_key.fileobj is key.fileobj
+
+    def close(self):
+        """
+            Releases the selector, if any.
+        """
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
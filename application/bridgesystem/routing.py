@@ -0,0 +1,125 @@
+"""
+    Event routing programming.
+"""
+
+class RoutingTable(object):
+    """
+        A precompiled routing table mapping (sender, event name, channel) to the receiving bridges and responders that
+        will actually accept the event. This is built once the broadcast domains are known and is rebuilt for the
+        affected senders whenever a bridge's responders change, so broadcasting does no per receiver filtering.
+    """
+
+    connection_bridges = None
+    """
+        The application's mapping of senders to the bridges in their broadcast domain.
+    """
+
+    routes = None
+    """
+        A dictionary mapping (sender, event name, channel) to a tuple of (bridge, responders, envelope responders)
+        entries. The channel None holds the bridges that accept the event on any channel.
+    """
+
+    route_keys = None
+    """
+        A dictionary mapping senders to the set of route keys compiled for them, so they can be rebuilt.
+    """
+
+    def __init__(self, connection_bridges):
+        """
+            Initializes a new routing table.
+
+            :param connection_bridges: The application's mapping of senders to the bridges in their domain.
+        """
+        self.connection_bridges = connection_bridges
+        self.routes = {}
+        self.route_keys = {}
+
+    def rebuild(self):
+        """
+            Recompiles the routes for every sender.
+        """
+        self.routes = {}
+        self.route_keys = {}
+        for sender in self.connection_bridges.keys():
+            self.update_sender(sender)
+
+    def update_bridge(self, bridge):
+        """
+            Recompiles the routes of every sender that can reach the given bridge. Called when the bridge's responders
+            or accepted channels change.
+        """
+        for sender, receivers in zip(self.connection_bridges.keys(), self.connection_bridges.values()):
+            if bridge in receivers:
+                self.update_sender(sender)
+
+    def update_sender(self, sender):
+        """
+            Recompiles the routes for events sent by the given sender.
+        """
+        for route_key in self.route_keys.pop(sender, ()):
+            del self.routes[route_key]
+
+        # Gather what every receiver accepts, keeping the domain order.
+        accepted_events = {}
+        for receiver in self.connection_bridges.get(sender, []):
+            for name in set(receiver.event_map.keys()) | set(receiver.envelope_map.keys()):
+                responders = receiver.event_map.get(name, [])
+                envelope_responders = receiver.envelope_map.get(name, [])
+                if len(responders) == 0 and len(envelope_responders) == 0:
+                    continue
+
+                channels = receiver.get_event_channels(name)
+                if channels is not None and len(channels) == 0:
+                    continue
+                accepted_events.setdefault(name, []).append((receiver, responders, envelope_responders, channels))
+
+        route_keys = set()
+        for name, receivers in zip(accepted_events.keys(), accepted_events.values()):
+            known_channels = set()
+            for receiver, responders, envelope_responders, channels in receivers:
+                if channels is not None:
+                    known_channels.update(channels)
+
+            for channel in known_channels:
+                route_key = (sender, name, channel)
+                self.routes[route_key] = tuple((receiver, responders, envelope_responders) for receiver, responders, envelope_responders, channels in receivers if channels is None or channel in channels)
+                route_keys.add(route_key)
+
+            route_key = (sender, name, None)
+            self.routes[route_key] = tuple((receiver, responders, envelope_responders) for receiver, responders, envelope_responders, channels in receivers if channels is None)
+            route_keys.add(route_key)
+
+        self.route_keys[sender] = route_keys
+
+    def get_receivers(self, sender, name, target_channels):
+        """
+            Returns the (bridge, responders, envelope responders) entries that accept the given event.
+
+            :param sender: The bridge that dispatched the event.
+            :param name: The name of the event.
+            :param target_channels: The channels the event targets or None if the event is not channel specific.
+        """
+        routes = self.routes
+        if target_channels is None:
+            return routes.get((sender, name, None), ())
+
+        if len(target_channels) == 1:
+            receivers = routes.get((sender, name, target_channels[0]))
+            if receivers is None:
+                receivers = routes.get((sender, name, None), ())
+            return receivers
+
+        # Merge the receivers of every channel, delivering to each bridge once.
+        merged_receivers = []
+        seen_receivers = set()
+        for channel in target_channels:
+            receivers = routes.get((sender, name, channel))
+            if receivers is None:
+                receivers = routes.get((sender, name, None), ())
+
+            for entry in receivers:
+                if entry[0] not in seen_receivers:
+                    seen_receivers.add(entry[0])
+                    merged_receivers.append(entry)
+        return merged_receivers
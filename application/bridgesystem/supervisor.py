@@ -0,0 +1,273 @@
+"""
+    Process supervisor programming for running broadcast domains in separate worker processes.
+"""
+
+import copy
+import time
+import signal
+import traceback
+import multiprocessing
+import multiprocessing.connection
+
+PROCESS_MODES = ("single", "perDomain")
+"""
+    The valid values for processMode. Single runs every domain in this process while perDomain forks a worker
+    process per domain group.
+"""
+
+HEARTBEAT_MESSAGE = "heartbeat"
+"""
+    The message workers send to the supervisor to report that their main loop is still running.
+"""
+
+class Supervisor(object):
+    """
+        Forks one worker process per group of domains, each running its own application loop. Since bridges only
+        relay within their own domain, this is transparent to the bridges while allowing throughput to scale with
+        cores. Workers report heartbeats over a pipe and are restarted if they die or stop reporting.
+    """
+
+    class WorkerProcess(object):
+        """
+            A class representing a single supervised worker process.
+        """
+
+        domain_names = None
+        """
+            The names of the domains this worker runs.
+        """
+
+        process = None
+        """
+            The running process, if any.
+        """
+
+        connection = None
+        """
+            The supervisor's end of the heartbeat pipe.
+        """
+
+        last_heartbeat_time = None
+        """
+            The monotonic time of the last heartbeat received from this worker.
+        """
+
+        restart_time = None
+        """
+            The monotonic time at which this worker should be restarted, if it is waiting to be restarted.
+        """
+
+        restart_count = None
+        """
+            How many times this worker has been restarted.
+        """
+
+        def __init__(self, domain_names):
+            self.domain_names = domain_names
+            self.restart_count = 0
+
+        def get_name(self):
+            return ", ".join(self.domain_names)
+
+    configuration_data = None
+    """
+        The root configuration.
+    """
+
+    worker_function = None
+    """
+        The function ran in each worker process. It is called with the worker's configuration and its end of the
+        heartbeat pipe.
+    """
+
+    workers = None
+    """
+        All supervised workers.
+    """
+
+    should_run = None
+    """
+        Whether or not the supervisor should continue to run.
+    """
+
+    def __init__(self, configuration_data, worker_function):
+        """
+            Initializes a new supervisor.
+
+            :param configuration_data: The root configuration.
+            :param worker_function: The function to run in each worker process.
+        """
+        self.configuration_data = configuration_data
+        self.worker_function = worker_function
+        self.should_run = True
+        self.workers = [Supervisor.WorkerProcess(domain_names) for domain_names in self.get_domain_groups()]
+
+    def get_domain_groups(self):
+        """
+            Returns the list of domain name groups to run in separate processes. Domains listed together in
+            domainGroups share a process and every other domain runs in a process of its own.
+        """
+        domain_names = [domain.name for domain in self.configuration_data.domains]
+
+        domain_groups = []
+        grouped_names = set()
+        for domain_group in self.configuration_data.global_configuration.process_internal.domain_groups:
+            domain_group = [domain_name for domain_name in domain_group if domain_name in domain_names and domain_name not in grouped_names]
+            if len(domain_group) != 0:
+                domain_groups.append(domain_group)
+                grouped_names.update(domain_group)
+
+        for domain_name in domain_names:
+            if domain_name not in grouped_names:
+                domain_groups.append([domain_name])
+        return domain_groups
+
+    def get_worker_configuration(self, worker):
+        """
+            Returns a copy of the root configuration holding only the domains run by the given worker. Each worker
+            serves its metrics and webhooks on its own ports and Unix socket and keeps its own hosted image store
+            index.
+        """
+        worker_configuration = copy.copy(self.configuration_data)
+        worker_configuration.domains = [domain for domain in self.configuration_data.domains if domain.name in worker.domain_names]
+
+        worker_index = self.workers.index(worker)
+        metrics = copy.copy(self.configuration_data.global_configuration.metrics)
+        metrics.port += worker_index
+        if metrics.unix_socket_path != "":
+            metrics.unix_socket_path = "%s.%u" % (metrics.unix_socket_path, worker_index)
+
+        webhooks = copy.copy(self.configuration_data.global_configuration.webhooks)
+        webhooks.port += worker_index
+
+        image_hosting = self.configuration_data.global_configuration.image_hosting
+        if image_hosting is not None and image_hosting.enabled:
+            image_hosting = copy.copy(image_hosting)
+            image_hosting.store_index_path = "%s.%u" % (image_hosting.store_index_path, worker_index)
+
+        worker_configuration.global_configuration = copy.copy(self.configuration_data.global_configuration)
+        worker_configuration.global_configuration.metrics = metrics
+        worker_configuration.global_configuration.webhooks = webhooks
+        worker_configuration.global_configuration.image_hosting = image_hosting
+        return worker_configuration
+
+    def run_worker_process(self, worker_configuration, connection):
+        """
+            The entry point of a worker process.
+        """
+        # Drop the supervisor's signal handlers so the worker application can install its own.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        try:
+            self.worker_function(worker_configuration, connection)
+        finally:
+            connection.close()
+
+    def start_worker(self, worker):
+        """
+            Forks a new process for the given worker.
+        """
+        context = multiprocessing.get_context("fork")
+        supervisor_connection, worker_connection = context.Pipe(duplex=False)
+
+        worker.connection = supervisor_connection
+        worker.process = context.Process(target=self.run_worker_process, args=(self.get_worker_configuration(worker), worker_connection),
+                                         name="PyBridge: %s" % worker.get_name())
+        worker.process.start()
+        worker_connection.close()
+
+        worker.last_heartbeat_time = time.monotonic()
+        worker.restart_time = None
+        print("!!! Started worker process %u for domains: %s" % (worker.process.pid, worker.get_name()))
+
+    def stop_worker(self, worker):
+        """
+            Terminates the given worker, killing it if it does not exit in a timely fashion.
+        """
+        if worker.process is not None:
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(self.get_process_internal().health_check_timeout_seconds)
+
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+            worker.process = None
+
+        if worker.connection is not None:
+            worker.connection.close()
+            worker.connection = None
+
+    def get_process_internal(self):
+        return self.configuration_data.global_configuration.process_internal
+
+    def receive_heartbeats(self, timeout):
+        """
+            Waits up to the given timeout for heartbeats from any worker.
+        """
+        connections = {worker.connection: worker for worker in self.workers if worker.connection is not None}
+        if len(connections) == 0:
+            time.sleep(timeout)
+            return
+
+        for connection in multiprocessing.connection.wait(list(connections.keys()), timeout):
+            worker = connections[connection]
+            try:
+                while connection.poll():
+                    if connection.recv() == HEARTBEAT_MESSAGE:
+                        worker.last_heartbeat_time = time.monotonic()
+            except (EOFError, OSError) as e:
+                # The worker has exited. This is picked up by the health check.
+                worker.connection.close()
+                worker.connection = None
+
+    def check_worker(self, worker, now):
+        """
+            Restarts the given worker if it has died or stopped reporting heartbeats.
+        """
+        process_internal = self.get_process_internal()
+
+        if worker.restart_time is not None:
+            if now >= worker.restart_time:
+                worker.restart_count += 1
+                self.start_worker(worker)
+            return
+
+        reason = None
+        if worker.process.is_alive() is False:
+            reason = "exited with code %s" % worker.process.exitcode
+        elif now - worker.last_heartbeat_time >= process_internal.health_check_timeout_seconds:
+            reason = "has not reported a heartbeat in %u seconds" % process_internal.health_check_timeout_seconds
+
+        if reason is not None:
+            print("!!! Worker process for domains %s %s. Restarting in %u seconds." % (worker.get_name(), reason, process_internal.restart_delay_seconds))
+            self.stop_worker(worker)
+            worker.restart_time = now + process_internal.restart_delay_seconds
+
+    def run(self):
+        """
+            Starts every worker and supervises them until SIGTERM or SIGINT is received.
+        """
+        def termination_handler(signum, frame):
+            self.should_run = False
+        signal.signal(signal.SIGTERM, termination_handler)
+        signal.signal(signal.SIGINT, termination_handler)
+
+        for worker in self.workers:
+            self.start_worker(worker)
+
+        health_check_interval = self.get_process_internal().heartbeat_seconds
+        try:
+            while self.should_run:
+                self.receive_heartbeats(health_check_interval)
+
+                now = time.monotonic()
+                for worker in self.workers:
+                    self.check_worker(worker, now)
+        except Exception as e:
+            print("!!! Supervisor encountered an unhandled exception: %s" % traceback.format_exc())
+
+        print("!!! Stopping worker processes ....")
+        for worker in self.workers:
+            self.stop_worker(worker)
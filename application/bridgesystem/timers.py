@@ -0,0 +1,346 @@
+"""
+    Timer service programming.
+"""
+
+import math
+import time
+import datetime
+
+from bridgesystem.eventloop import to_seconds
+
+TIMER_RESOLUTION = 0.01
+"""
+    The length of a single timer wheel tick in seconds. Timers never fire early and fire at most this late after the
+    wheel has been advanced.
+"""
+
+WHEEL_BITS = 6
+"""
+    Each wheel level holds 2 ** WHEEL_BITS slots.
+"""
+
+WHEEL_LEVELS = 4
+"""
+    The number of wheel levels. Each level covers 2 ** WHEEL_BITS times the span of the level below it, so four
+    levels of 64 slots at 10ms cover roughly 46 hours. Longer timers wait in the top level until they are in range.
+"""
+
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+
+class Timer(object):
+    """
+        A handle representing a scheduled callback.
+    """
+
+    service = None
+    """
+        The timer service this timer belongs to.
+    """
+
+    callback = None
+    """
+        The function to call when the timer fires.
+    """
+
+    args = None
+    """
+        The positional arguments to pass to the callback.
+    """
+
+    interval = None
+    """
+        For repeating timers, the interval between calls in seconds. None for one shot timers.
+    """
+
+    expiry_tick = None
+    """
+        The wheel tick at which this timer fires.
+    """
+
+    last_time = None
+    """
+        For repeating timers, the monotonic time of the previous call.
+    """
+
+    slot = None
+    """
+        The wheel slot this timer is currently held in, if any.
+    """
+
+    cancelled = None
+    """
+        Whether or not this timer has been cancelled.
+    """
+
+    def __init__(self, service, callback, args, interval=None):
+        self.service = service
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        """
+            Cancels the timer. Cancelling a timer that has already fired or been cancelled does nothing.
+        """
+        self.cancelled = True
+        if self.slot is not None:
+            del self.slot[self]
+            self.slot = None
+            self.service.timer_count -= 1
+
+class TimerService(object):
+    """
+        The core timer service. Timers are held in a hierarchical timer wheel on the monotonic clock, so scheduling,
+        cancelling and rescheduling are constant time no matter how many timers are pending, and advancing the wheel
+        only touches the slots that have come due.
+
+        On the fixed tick loop, the application advances the wheel every tick and waits no longer than
+        get_timeout. With an event loop, the service arms a single event loop timer for its next deadline.
+    """
+
+    start_time = None
+    """
+        The monotonic time of wheel tick zero.
+    """
+
+    resolution = None
+    """
+        The length of a single wheel tick in seconds.
+    """
+
+    current_tick = None
+    """
+        The last wheel tick that has been processed.
+    """
+
+    wheels = None
+    """
+        The wheel levels, each a list of slots. Every slot is a dictionary used as an insertion ordered set of timers.
+    """
+
+    timer_count = None
+    """
+        The number of timers currently held in the wheel.
+    """
+
+    event_loop = None
+    """
+        The event loop used to wake the service when a timer is due. If None, the application advances the wheel.
+    """
+
+    wakeup_handle = None
+    """
+        The pending event loop timer used to advance the wheel, if any.
+    """
+
+    wakeup_tick = None
+    """
+        The wheel tick the pending event loop timer is armed for.
+    """
+
+    clock = None
+    """
+        The function returning the current monotonic time in seconds.
+    """
+
+    def __init__(self, event_loop=None, resolution=TIMER_RESOLUTION, clock=time.monotonic):
+        """
+            Initializes a new timer service.
+
+            :param event_loop: The event loop to arm wakeups on. If None, run_due must be called periodically.
+            :param resolution: The length of a single wheel tick in seconds.
+            :param clock: The function returning the current monotonic time in seconds.
+        """
+        self.event_loop = event_loop
+        self.resolution = resolution
+        self.clock = clock
+        self.start_time = self.clock()
+        self.current_tick = 0
+        self.timer_count = 0
+        self.wheels = [[{} for index in range(WHEEL_SIZE)] for level in range(WHEEL_LEVELS)]
+
+    def call_later(self, delay, callback, *args):
+        """
+            Schedules a callback to be called once after the given delay.
+
+            :param delay: A timedelta or number of seconds to wait.
+            :return: A Timer that may be cancelled.
+        """
+        timer = Timer(self, callback, args)
+        self.schedule(timer, self.clock() + to_seconds(delay))
+        return timer
+
+    def call_every(self, interval, callback, *args):
+        """
+            Schedules a callback to be called repeatedly on an interval. The callback is given the time since it was
+            last called as a timedelta, followed by any additional arguments, matching the update contract.
+
+            :param interval: A timedelta or number of seconds between calls.
+            :return: A Timer that may be cancelled.
+        """
+        timer = Timer(self, callback, args, interval=to_seconds(interval))
+        timer.last_time = self.clock()
+        self.schedule(timer, timer.last_time + timer.interval)
+        return timer
+
+    def schedule(self, timer, deadline):
+        """
+            Places a timer in the wheel to fire at the given monotonic time.
+        """
+        # Round up so timers never fire early. The current tick has already been processed.
+        expiry_tick = int(math.ceil((deadline - self.start_time) / self.resolution))
+        timer.expiry_tick = max(expiry_tick, self.current_tick + 1)
+
+        self.insert(timer)
+        self.timer_count += 1
+
+        if self.event_loop is not None and (self.wakeup_tick is None or timer.expiry_tick < self.wakeup_tick):
+            self.arm_wakeup(timer.expiry_tick)
+
+    def insert(self, timer):
+        """
+            Places a timer in the slot covering its expiry tick at the lowest level whose span reaches it.
+        """
+        delta = timer.expiry_tick - self.current_tick
+        placement_tick = timer.expiry_tick
+
+        level = 0
+        while level < WHEEL_LEVELS - 1 and delta >= 1 << (WHEEL_BITS * (level + 1)):
+            level += 1
+
+        # Timers beyond the top level wait in its furthest slot and are placed again when it is cascaded.
+        if delta >= 1 << (WHEEL_BITS * WHEEL_LEVELS):
+            placement_tick = self.current_tick + (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1
+
+        slot = self.wheels[level][(placement_tick >> (WHEEL_BITS * level)) & WHEEL_MASK]
+        slot[timer] = None
+        timer.slot = slot
+
+    def get_tick_time(self, tick):
+        return self.start_time + tick * self.resolution
+
+    def run_due(self):
+        """
+            Advances the wheel to the current time, calling every timer that has come due in deadline order.
+        """
+        target_tick = int((self.clock() - self.start_time) / self.resolution)
+
+        while self.current_tick < target_tick:
+            # Nothing is pending, so there is nothing to walk past.
+            if self.timer_count == 0:
+                self.current_tick = target_tick
+                break
+
+            self.current_tick += 1
+            tick = self.current_tick
+
+            # Whenever a level wraps, move the timers in the next slot of the level above down into range.
+            level = 1
+            while level < WHEEL_LEVELS and tick & ((1 << (WHEEL_BITS * level)) - 1) == 0:
+                wheel = self.wheels[level]
+                slot_index = (tick >> (WHEEL_BITS * level)) & WHEEL_MASK
+                cascaded_slot = wheel[slot_index]
+                if len(cascaded_slot) != 0:
+                    wheel[slot_index] = {}
+                    for timer in cascaded_slot:
+                        self.insert(timer)
+                level += 1
+
+            slot_index = tick & WHEEL_MASK
+            due_slot = self.wheels[0][slot_index]
+            if len(due_slot) != 0:
+                # Detach every due timer before firing any, so a callback cancelling another timer due in this slot
+                # neither changes the slot being walked nor counts that timer twice.
+                self.wheels[0][slot_index] = {}
+                due_timers = list(due_slot)
+                for timer in due_timers:
+                    timer.slot = None
+                    self.timer_count -= 1
+
+                for timer in due_timers:
+                    if timer.cancelled is False:
+                        self.fire(timer)
+
+    def fire(self, timer):
+        """
+            Calls a due timer, rescheduling it first if it repeats so the callback may cancel it.
+        """
+        if timer.interval is None:
+            timer.callback(*timer.args)
+            return
+
+        current_time = self.clock()
+        delta_time = datetime.timedelta(seconds=current_time - timer.last_time)
+        timer.last_time = current_time
+        self.schedule(timer, current_time + timer.interval)
+        timer.callback(delta_time, *timer.args)
+
+    def get_next_tick(self):
+        """
+            Returns the next wheel tick that needs processing, or None if no timers are pending. This is either the
+            expiry of the earliest timer in the lowest level or the point at which a higher level slot holding timers
+            is cascaded, whichever comes first.
+        """
+        if self.timer_count == 0:
+            return None
+
+        next_tick = None
+        for level in range(WHEEL_LEVELS):
+            shift = WHEEL_BITS * level
+            position = self.current_tick >> shift
+
+            # Anything in a higher level cannot come due before this level's earliest slot.
+            if next_tick is not None and (position + 1) << shift >= next_tick:
+                break
+
+            wheel = self.wheels[level]
+            for offset in range(1, WHEEL_SIZE + 1):
+                if len(wheel[(position + offset) & WHEEL_MASK]) != 0:
+                    slot_tick = (position + offset) << shift
+                    if next_tick is None or slot_tick < next_tick:
+                        next_tick = slot_tick
+                    break
+        return next_tick
+
+    def get_timeout(self):
+        """
+            Returns the number of seconds until the wheel next needs advancing, or None if no timers are pending.
+        """
+        next_tick = self.get_next_tick()
+        if next_tick is None:
+            return None
+        return max(self.get_tick_time(next_tick) - self.clock(), 0)
+
+    def arm_wakeup(self, tick):
+        """
+            Arms the event loop timer used to advance the wheel at the given tick, replacing any pending one.
+        """
+        if self.wakeup_handle is not None:
+            self.wakeup_handle.cancel()
+
+        self.wakeup_tick = tick
+        self.wakeup_handle = self.event_loop.call_later(max(self.get_tick_time(tick) - self.clock(), 0), self.process_wakeup)
+
+    def process_wakeup(self):
+        """
+            Event loop callback that advances the wheel and arms the next wakeup.
+        """
+        self.wakeup_handle = None
+        self.wakeup_tick = None
+        self.run_due()
+
+        # Callbacks may already have armed a wakeup for a new timer, but an earlier one may still be pending.
+        next_tick = self.get_next_tick()
+        if next_tick is not None and (self.wakeup_tick is None or next_tick < self.wakeup_tick):
+            self.arm_wakeup(next_tick)
+
+    def close(self):
+        """
+            Cancels the pending event loop wakeup, if any.
+        """
+        if self.wakeup_handle is not None:
+            self.wakeup_handle.cancel()
+            self.wakeup_handle = None
+            self.wakeup_tick = None
@@ -1,3 +1,5 @@
+import os
+
 def chunk_string(string, chunk_size=450):
     # Limit = 462, cutting off at 450 to be safe.
     string_chunks = []
@@ -7,3 +9,14 @@ def chunk_string(string, chunk_size=450):
         string_chunks.append(current_chunk)
         string = string[len(current_chunk):]
     return string_chunks
+
+def get_resident_bytes():
+    """
+        Returns the resident set size of this process in bytes, or None if it cannot be measured on this platform.
+    """
+    try:
+        with open("/proc/self/statm", "r") as handle:
+            resident_pages = int(handle.read().split()[1])
+    except (OSError, IndexError, ValueError) as e:
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
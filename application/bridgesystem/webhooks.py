@@ -0,0 +1,139 @@
+"""
+    Webhook listener programming.
+"""
+
+import hmac
+import json
+import threading
+import http.server
+
+MAX_BODY_SIZE = 1048576
+"""
+    The largest webhook request body accepted in bytes.
+"""
+
+class WebhookServer(object):
+    """
+        Receives webhook deliveries for every bridge in the process on a single local HTTP listener running on a
+        background thread. Each bridge registers a path, and optionally a secret token the sender must present in a
+        header, along with a callback. Requests are decoded from JSON and handed to the callback on the listener's
+        thread, so callbacks must pass them on to the core thread themselves, usually through an inbox.
+
+        The listener speaks plain HTTP and is meant to sit behind a reverse proxy terminating TLS.
+    """
+
+    class HTTPRequestHandler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            route = self.server.webhook_server.get_route(self.path)
+            if route is None:
+                self.send_error(404)
+                return
+
+            callback, secret_header, secret_token = route
+            if secret_token is not None and hmac.compare_digest(self.headers.get(secret_header, ""), secret_token) is False:
+                self.send_error(403)
+                return
+
+            try:
+                content_length = int(self.headers.get("Content-Length", ""))
+            except ValueError as e:
+                self.send_error(411)
+                return
+            if content_length > MAX_BODY_SIZE:
+                self.send_error(413)
+                return
+
+            try:
+                payload = json.loads(self.rfile.read(content_length).decode("utf8"))
+            except ValueError as e:
+                self.send_error(400)
+                return
+
+            try:
+                callback(payload)
+            except Exception as e:
+                print("!!! Webhook callback for %s threw an exception: %s" % (self.path, str(e)))
+                self.send_error(500)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    host = None
+    """
+        The address the listener binds to.
+    """
+
+    port = None
+    """
+        The port the listener binds to.
+    """
+
+    routes = None
+    """
+        A dictionary mapping request paths to (callback, secret header, secret token) routes.
+    """
+
+    server = None
+    """
+        The running HTTP server, if any.
+    """
+
+    lock = None
+    """
+        The lock guarding the routes, as requests are served on their own threads.
+    """
+
+    def __init__(self, host, port):
+        """
+            Initializes a new webhook server. Nothing listens until start is called.
+
+            :param host: The address to listen on.
+            :param port: The port to listen on.
+        """
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def register(self, path, callback, secret_header=None, secret_token=None):
+        """
+            Routes the webhook requests posted to the given path to a callback.
+
+            :param path: The request path, such as "/telegram/bridge".
+            :param callback: Called on a listener thread with the decoded JSON body of every accepted request.
+            :param secret_header: The request header holding the secret token.
+            :param secret_token: If specified, requests without this token in secret_header are refused.
+        """
+        with self.lock:
+            self.routes[path] = (callback, secret_header, secret_token)
+
+    def unregister(self, path):
+        with self.lock:
+            self.routes.pop(path, None)
+
+    def get_route(self, path):
+        with self.lock:
+            return self.routes.get(path)
+
+    def start(self):
+        """
+            Starts listening if any routes are registered. Raises OSError if the address cannot be bound.
+        """
+        if self.server is not None or len(self.routes) == 0:
+            return
+
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), WebhookServer.HTTPRequestHandler)
+        self.server.webhook_server = self
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="PyBridge Webhooks", daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
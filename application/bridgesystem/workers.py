@@ -0,0 +1,144 @@
+"""
+    Background worker programming for bridges that perform blocking I/O.
+"""
+
+import threading
+import traceback
+import collections
+import concurrent.futures
+
+class Inbox(object):
+    """
+        A thread safe inbox of completions waiting to be run on the core thread.
+    """
+
+    lock = None
+    """
+        A thread lock for the pending completions.
+    """
+
+    pending = None
+    """
+        All completions waiting to be run.
+    """
+
+    application = None
+    """
+        The application whose event loop is woken when a completion arrives.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+
+    def put(self, callback, *args):
+        """
+            Queues a callback to be called on the core thread. This may be called from any thread.
+
+            :param callback: The function to call.
+            :param args: The positional arguments to pass to the callback.
+        """
+        self.lock.acquire()
+        self.pending.append((callback, args))
+        self.lock.release()
+
+        # On the event driven runtime, wake the loop immediately rather than waiting for the next update.
+        event_loop = self.application.event_loop
+        if event_loop is not None:
+            event_loop.call_soon_threadsafe(self.drain)
+
+    def drain(self):
+        """
+            Runs all pending completions. A completion that raises is logged and the rest still run. This must only be
+            called from the core thread.
+        """
+        self.lock.acquire()
+        pending = self.pending
+        self.pending = collections.deque()
+        self.lock.release()
+
+        # One failing completion must not lose the rest of the batch.
+        for callback, args in pending:
+            try:
+                callback(*args)
+            except Exception as e:
+                print("!!! Completion callback failed: %s" % traceback.format_exc())
+
+class BridgeWorker(object):
+    """
+        Runs a bridge's blocking calls on a dedicated thread or thread pool and hands the results back to the core
+        thread through an inbox, so that one slow remote does not stall every other bridge.
+    """
+
+    executor = None
+    """
+        The executor running blocking calls. This is created on first use.
+    """
+
+    worker_threads = None
+    """
+        The number of threads blocking calls are spread across.
+    """
+
+    inbox = None
+    """
+        The inbox results are delivered through.
+    """
+
+    name = None
+    """
+        The name used for worker threads.
+    """
+
+    def __init__(self, application, name, worker_threads=1):
+        """
+            Initializes a new worker.
+
+            :param application: The application whose event loop is woken when results arrive.
+            :param name: The name used for worker threads.
+            :param worker_threads: The number of worker threads. A single thread runs calls in submission order.
+        """
+        self.name = name
+        self.worker_threads = worker_threads
+        self.inbox = Inbox(application)
+
+    def submit(self, function, *args, on_complete=None):
+        """
+            Runs a function on a worker thread.
+
+            :param function: The blocking function to run.
+            :param args: The positional arguments to pass to the function.
+            :param on_complete: If specified, called on the core thread with the result of the function and any
+                exception the function raised is re-raised on the core thread. Otherwise exceptions are only logged.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.worker_threads, thread_name_prefix=self.name)
+
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda future: self.inbox.put(self.complete, future, on_complete))
+        return future
+
+    def complete(self, future, on_complete):
+        """
+            Called on the core thread once a submitted function has finished.
+        """
+        if on_complete is not None:
+            on_complete(future.result())
+        elif future.exception() is not None:
+            exception = future.exception()
+            print("!!! Worker '%s' call failed: %s" % (self.name, "".join(traceback.format_exception(type(exception), exception, exception.__traceback__))))
+
+    def drain(self):
+        """
+            Delivers all finished results. This must only be called from the core thread.
+        """
+        self.inbox.drain()
+
+    def shutdown(self):
+        """
+            Stops the worker threads after letting any queued calls finish.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
@@ -37,11 +37,94 @@ class Application(object):
 
     connection_bridges = None
 
+    event_loop = None
+    """
+        The event loop in use when running on the event driven runtime. This is None when running on the fixed tick loop.
+    """
+
+    reactor = None
+    """
+        The shared reactor that raw socket bridges register their sockets with.
+    """
+
+    timers = None
+    """
+        The core timer service bridges schedule pings, heartbeats, reconnects and delays with instead of polling.
+    """
+
+    routing_table = None
+    """
+        The precompiled routing table used to broadcast events.
+    """
+
+    heartbeat_connection = None
+    """
+        When running as a supervised worker process, the pipe heartbeats are reported to the supervisor over.
+    """
+
+    heartbeat_interval = None
+    """
+        The time between heartbeats as a timedelta.
+    """
+
+    metrics = None
+    """
+        The metrics registry every bridge reports into.
+    """
+
+    metrics_server = None
+    """
+        The server exposing the metrics, if enabled.
+    """
+
+    current_event = None
+    """
+        The event currently being dispatched, if any. Bridges use its timestamp to measure relay latency.
+    """
+
+    profiler = None
+    """
+        The profiler attributing main loop time to bridges when processInternal.profiling is enabled, otherwise None.
+    """
+
+    image_store = None
+    """
+        The content addressed store hosted images are kept in when image hosting is enabled, otherwise None.
+    """
+
+    downloader = None
+    """
+        The pooled downloader shared by every bridge hosting attachments when image hosting is enabled, otherwise None.
+    """
+
+    webhook_server = None
+    """
+        The listener receiving webhook deliveries for bridges that register with it. It only listens once one has.
+    """
+
+    image_pipeline = None
+    """
+        The pipeline transcoding hosted images in worker processes when image hosting is enabled, otherwise None.
+    """
+
     def __init__(self):
         self.should_run = True
         self.loaded_addons = []
         self.connections = []
         self.connection_bridges = {}
+        self.event_loop = None
+        self.reactor = None
+        self.timers = bridgesystem.TimerService()
+        self.heartbeat_connection = None
+        self.routing_table = None
+        self.metrics = bridgesystem.Metrics()
+        self.metrics_server = None
+        self.current_event = None
+        self.profiler = None
+        self.image_store = None
+        self.downloader = None
+        self.webhook_server = None
+        self.image_pipeline = None
 
     def on_receive_join(self, sender, joined_name, target_channels):
         print(joined_name)
@@ -60,6 +143,38 @@ class Application(object):
 
         # Load the addons
         self.loaded_addons = []
+        self.connection_bridges = {}
+        self.routing_table = None
+        self.metrics.clear_collectors()
+
+        process_internal = configuration_data.global_configuration.process_internal
+        if process_internal.profiling:
+            if self.profiler is None:
+                self.profiler = bridgesystem.Profiler(process_internal.tick_budget_ms / 1000.0, window_size=process_internal.profile_window)
+            self.metrics.add_collector(lambda: self.profiler.collect_metrics(self.metrics))
+
+        image_hosting = configuration_data.global_configuration.image_hosting
+        if image_hosting is not None and image_hosting.enabled:
+            self.image_store = bridgesystem.ImageStore(image_hosting.image_path_base, os.path.expanduser(image_hosting.store_index_path),
+                                                       max_size=int(image_hosting.eviction_max_megabytes * 1024 * 1024),
+                                                       max_age=image_hosting.eviction_max_age_days * 86400)
+            self.metrics.add_collector(lambda: self.image_store.collect_metrics(self.metrics))
+
+            self.downloader = bridgesystem.Downloader(timeout=image_hosting.download_timeout_seconds,
+                                                      max_size=int(image_hosting.max_download_megabytes * 1024 * 1024),
+                                                      max_idle_connections=image_hosting.max_idle_connections_per_host,
+                                                      download_threads=image_hosting.download_threads)
+            self.metrics.add_collector(lambda: self.downloader.collect_metrics(self.metrics))
+
+            self.image_pipeline = bridgesystem.ImagePipeline(self, self.image_store, self.downloader,
+                                                             max_pixels=image_hosting.max_image_pixels,
+                                                             max_bytes=int(image_hosting.max_image_megabytes * 1024 * 1024),
+                                                             max_download_bytes=int(image_hosting.max_download_megabytes * 1024 * 1024),
+                                                             worker_processes=image_hosting.transcode_processes)
+            self.metrics.add_collector(lambda: self.image_pipeline.collect_metrics(self.metrics))
+
+        webhooks = configuration_data.global_configuration.webhooks
+        self.webhook_server = bridgesystem.WebhookServer(webhooks.host, webhooks.port)
 
         # Process each bridge and load the appropriate bridge code and assemble the broadcast domains.
         for domain in configuration_data.domains:
@@ -76,6 +191,7 @@ class Application(object):
                 except ImportError as e:
                     print("!!! Failed to initialize bridge '%s': " % bridge_name)
                     print(traceback.format_exc())
+                    self.close_runtime()
                     return False
 
             # For all bridges, construct the domain
@@ -87,11 +203,60 @@ class Application(object):
                     self.connection_bridges.setdefault(target_bridge, [])
                     self.connection_bridges[target_bridge].append(added_bridge)
 
+        # Compile the routes. Bridges registering responders as they start update this incrementally.
+        self.routing_table = bridgesystem.RoutingTable(self.connection_bridges)
+        self.routing_table.rebuild()
+
+        process_sleepms = datetime.timedelta(milliseconds=configuration_data.global_configuration.process_internal.sleep_ms)
+        self.heartbeat_interval = datetime.timedelta(seconds=configuration_data.global_configuration.process_internal.heartbeat_seconds)
+
+        # Bridges register their readiness callbacks and timers as they start, so the loop must exist first.
+        if configuration_data.global_configuration.process_internal.event_driven:
+            self.event_loop = bridgesystem.EventLoop()
+        self.reactor = bridgesystem.Reactor(event_loop=self.event_loop)
+        self.timers = bridgesystem.TimerService(event_loop=self.event_loop)
+
         # Once everything is mapped, start up all of the loaded addons.
         for loaded_addon in self.loaded_addons:
             loaded_addon.start()
 
-        process_sleepms = datetime.timedelta(milliseconds=configuration_data.global_configuration.process_internal.sleep_ms)
+        # Bridges receiving by webhook have registered their routes as they started.
+        try:
+            self.webhook_server.start()
+        except OSError as e:
+            print("!!! Failed to start the webhook listener on %s:%u: %s" % (webhooks.host, webhooks.port, str(e)))
+
+        if self.heartbeat_connection is not None:
+            self.timers.call_every(self.heartbeat_interval, lambda delta_time: self.send_heartbeat())
+
+        if self.image_store is not None:
+            self.image_store.sweep()
+            self.timers.call_every(image_hosting.eviction_sweep_seconds, lambda delta_time: self.image_store.sweep())
+
+        if self.event_loop is not None:
+            self.run_event_loop(process_sleepms)
+        else:
+            self.run_tick_loop(process_sleepms)
+
+        print("!!! Deinitializing Bot ....")
+
+        # Stop all running addons
+        for addon in self.loaded_addons:
+            addon.stop()
+
+        # Stop all connections
+        for connection in self.connections:
+            connection.disconnect()
+
+        self.close_runtime()
+        return True
+
+    def run_tick_loop(self, process_sleepms):
+        """
+            Runs all addons on a fixed tick, calling every update function and then sleeping until the next tick.
+
+            :param process_sleepms: The minimum time between ticks as a timedelta.
+        """
 
         # Handle sigterm to tear everything down
         def termination_handler(signum, frame):
@@ -103,45 +268,284 @@ class Application(object):
             current_time = datetime.datetime.now()
             delta_time = current_time - last_time
 
-            for addon in self.loaded_addons:
-                addon.update(delta_time)
-
-            for connection in self.connections:
-                connection.update(delta_time)
+            self.update_addons(delta_time)
+            self.timers.run_due()
 
+            # Rather than sleeping, wait on every registered socket at once so data is processed as it arrives. The
+            # wait is cut short if a timer comes due first.
             if delta_time < process_sleepms:
-                slept_time = process_sleepms - delta_time
-                time.sleep(slept_time.total_seconds())
+                slept_time = (process_sleepms - delta_time).total_seconds()
+                timer_timeout = self.timers.get_timeout()
+                self.reactor.poll(slept_time if timer_timeout is None else min(slept_time, timer_timeout))
 
             last_time = current_time
 
-        print("!!! Deinitializing Bot ....")
+    def run_event_loop(self, process_sleepms):
+        """
+            Runs all addons on the event driven runtime. Addons that are not polled are only woken by the readiness
+            callbacks and timers they registered while addons that still rely on update are called every tick.
+
+            :param process_sleepms: The time between update calls for polled addons as a timedelta.
+        """
+
+        # Handle sigterm to tear everything down
+        def termination_handler():
+            self.should_run = False
+            self.event_loop.stop()
+        self.event_loop.add_signal_handler(signal.SIGTERM, termination_handler)
+
+        # When every bridge has been ported, the loop only wakes for sockets and timers.
+        if len(self.connections) != 0 or any(addon.polled for addon in self.loaded_addons):
+            self.event_loop.call_every(process_sleepms, self.update_addons, True)
+
+        self.event_loop.run()
+
+    def update_addons(self, delta_time, polled_only=False):
+        """
+            Calls the update function of every addon and connection, recording the time taken as the tick duration.
+
+            :param delta_time: The time since the last update as a timedelta.
+            :param polled_only: If True, only addons that rely on being polled are updated.
+        """
+        tick_start = time.monotonic()
+
+        profiler = self.profiler
+        started_tick = profiler is not None and profiler.begin_tick()
+
+        # On the event driven runtime completed transcodes wake the loop themselves, so this only catches stragglers.
+        if self.image_pipeline is not None:
+            self.image_pipeline.drain()
 
-        # Stop all running addons
         for addon in self.loaded_addons:
-            addon.stop()
+            if polled_only is False or addon.polled:
+                if profiler is None:
+                    addon.update(delta_time)
+                else:
+                    call_start = time.monotonic()
+                    addon.update(delta_time)
+                    profiler.record(addon.configuration.name, "update", time.monotonic() - call_start)
 
-        # Stop all connections
         for connection in self.connections:
-            connection.disconnect()
-        return True
+            connection.update(delta_time)
+
+        self.metrics.observe("pybridge_tick_seconds", (), time.monotonic() - tick_start)
+        if started_tick:
+            profiler.end_tick()
+
+    def send_heartbeat(self):
+        """
+            Reports to the supervisor that the main loop is still running. If the supervisor has gone away, this
+            worker shuts down.
+        """
+        try:
+            self.heartbeat_connection.send(bridgesystem.supervisor.HEARTBEAT_MESSAGE)
+        except OSError as e:
+            print("!!! Lost the connection to the supervisor. Shutting down.")
+            self.heartbeat_connection = None
+            self.should_run = False
+
+            if self.event_loop is not None:
+                self.event_loop.stop()
+
+    def close_runtime(self):
+        """
+            Releases the reactor, timers, event loop, webhook listener, image pipeline, downloader and image store, if
+            any.
+        """
+        if self.timers is not None:
+            self.timers.close()
+
+        if self.webhook_server is not None:
+            self.webhook_server.stop()
+            self.webhook_server = None
+
+        if self.image_pipeline is not None:
+            self.image_pipeline.shutdown()
+            self.image_pipeline = None
+
+        if self.downloader is not None:
+            self.downloader.close()
+            self.downloader = None
+
+        if self.image_store is not None:
+            self.image_store.close()
+            self.image_store = None
+
+        if self.reactor is not None:
+            self.reactor.close()
+            self.reactor = None
+
+        if self.event_loop is not None:
+            self.event_loop.close()
+            self.event_loop = None
 
     def broadcast_event(self, name, sender, *args, **kwargs):
         """
-            Broadcasts an event globally across all addons.
+            Broadcasts an event to every addon in the sender's broadcast domain that accepts it, as compiled in the
+            routing table.
 
             :param name: The event to broadcast. Addons that don't know about this event simply ignore it.
             :param sender: The addon instance that dispatched this event. This is used for mapping broadcast domains.
             :param args: The positional arguments to pass to the addons.
             :param kwargs: The keyword arguments to pass to the addons.
         """
-        for addon in self.connection_bridges[sender]:
-            addon.receive_event(sender=sender, name=name, *args, **kwargs)
+        # The standard events travel as a single envelope shared by every receiver.
+        if len(args) == 0 and name in bridgesystem.EVENT_ARGUMENTS:
+            self.dispatch_event(bridgesystem.BridgeEvent.from_arguments(name, sender, kwargs))
+            return
+
+        profiler = self.profiler
+        if profiler is not None:
+            started_tick = profiler.begin_tick()
+            broadcast_start = time.monotonic()
+
+        for addon, responders, envelope_responders in self.routing_table.get_receivers(sender, name, kwargs.get("target_channels")):
+            if profiler is not None:
+                call_start = time.monotonic()
+
+            for responder in responders:
+                try:
+                    responder(sender=sender, *args, **kwargs)
+                except Exception as e:
+                    self.metrics.increment("pybridge_events_failed_total", addon.metric_labels + (("event", name),))
+                    # FIXME: Process and log the error in some way.
+
+            if profiler is not None:
+                profiler.record(addon.configuration.name, name, time.monotonic() - call_start)
+
+        if profiler is not None:
+            profiler.record(sender.configuration.name, "broadcast %s" % name, time.monotonic() - broadcast_start)
+            if started_tick:
+                profiler.end_tick()
+
+    def dispatch_event(self, event):
+        """
+            Dispatches a BridgeEvent to every addon in the sender's broadcast domain that accepts it. The same event
+            instance and argument tuple are passed to every receiver.
+
+            :param event: The event to dispatch.
+        """
+        arguments = event.arguments
+        receivers = self.routing_table.get_receivers(event.sender, event.name, event.target_channels)
+        self.record_event_metrics(event, receivers)
+
+        # Dispatches made from event loop callbacks are checked against the budget as a tick of their own.
+        profiler = self.profiler
+        if profiler is not None:
+            started_tick = profiler.begin_tick()
+            broadcast_start = time.monotonic()
+
+        previous_event = self.current_event
+        self.current_event = event
+        for addon, responders, envelope_responders in receivers:
+            if profiler is not None:
+                call_start = time.monotonic()
+
+            for responder in responders:
+                try:
+                    responder(*arguments)
+                except Exception as e:
+                    self.metrics.increment("pybridge_events_failed_total", addon.metric_labels + (("event", event.name),))
+                    # FIXME: Process and log the error in some way.
+
+            for responder in envelope_responders:
+                try:
+                    responder(event)
+                except Exception as e:
+                    self.metrics.increment("pybridge_events_failed_total", addon.metric_labels + (("event", event.name),))
+                    # FIXME: Process and log the error in some way.
+
+            if profiler is not None:
+                profiler.record(addon.configuration.name, event.name, time.monotonic() - call_start)
+        self.current_event = previous_event
+
+        if profiler is not None:
+            profiler.record(event.sender.configuration.name, "broadcast %s" % event.name, time.monotonic() - broadcast_start)
+            if started_tick:
+                profiler.end_tick()
+
+    def record_event_metrics(self, event, receivers):
+        """
+            Counts an event as received from its sender and as delivered to or filtered by every other bridge in the
+            sender's domain, per target channel.
+
+            :param event: The event being dispatched.
+            :param receivers: The routing table entries the event is being delivered to.
+        """
+        domain_bridges = self.connection_bridges.get(event.sender, ())
+        filtered_bridges = ()
+        if len(receivers) != len(domain_bridges):
+            receiving_bridges = set(entry[0] for entry in receivers)
+            filtered_bridges = [bridge for bridge in domain_bridges if bridge not in receiving_bridges]
+
+        metrics = self.metrics
+        for channel in event.target_channels if event.target_channels is not None else ("",):
+            event_labels = (("channel", channel), ("event", event.name))
+            metrics.increment("pybridge_events_received_total", event.sender.metric_labels + event_labels)
+            metrics.increment_each("pybridge_events_delivered_total", [entry[0].metric_labels + event_labels for entry in receivers])
+            if len(filtered_bridges) != 0:
+                metrics.increment_each("pybridge_events_filtered_total", [bridge.metric_labels + event_labels for bridge in filtered_bridges])
 
     def main(self):
         configuration_data = bridgesystem.Configuration.from_file("configuration.json")
+
+        # Each domain only relays within itself, so domains may be spread across supervised worker processes.
+        if configuration_data.global_configuration.process_internal.process_mode == "perDomain":
+            bridgesystem.Supervisor(configuration_data, Application.run_worker).run()
+        else:
+            self.run(configuration_data)
+
+    @staticmethod
+    def run_worker(configuration_data, heartbeat_connection):
+        """
+            Entry point of a supervised worker process running a subset of the configured domains.
+
+            :param configuration_data: The configuration holding only the domains this worker runs.
+            :param heartbeat_connection: The pipe to report heartbeats to the supervisor over.
+        """
+        application = Application()
+        application.heartbeat_connection = heartbeat_connection
+        application.run(configuration_data)
+
+    def start_metrics_server(self, configuration_data):
+        """
+            Starts serving the metrics if enabled by the configuration.
+        """
+        metrics_configuration = configuration_data.global_configuration.metrics
+        if metrics_configuration.enabled is False:
+            return
+
+        self.metrics_server = bridgesystem.MetricsServer(self.metrics)
+        try:
+            self.metrics_server.start(host=metrics_configuration.host if metrics_configuration.host != "" else None,
+                                      port=metrics_configuration.port,
+                                      unix_socket_path=metrics_configuration.unix_socket_path if metrics_configuration.unix_socket_path != "" else None)
+        except OSError as e:
+            print("!!! Failed to start the metrics server: %s" % str(e))
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def stop_metrics_server(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def run(self, configuration_data):
+        """
+            Runs the bridging system with the given configuration, restarting it on errors if autoRestart is set.
+        """
+        self.start_metrics_server(configuration_data)
+        try:
+            self.run_bridges(configuration_data)
+        finally:
+            self.stop_metrics_server()
+
+    def run_bridges(self, configuration_data):
+        """
+            Runs the configured bridges, restarting them on errors if autoRestart is set.
+        """
         if configuration_data.global_configuration.process_internal.auto_restart is True:
-            while configuration_data.global_configuration.process_internal.auto_restart is True:
+            while configuration_data.global_configuration.process_internal.auto_restart is True and self.should_run:
                 try:
                     self.setup_and_run(configuration_data)
                 except Exception as e:
@@ -156,6 +560,8 @@ class Application(object):
                     for connection in self.connections:
                         connection.disconnect()
 
+                    self.close_runtime()
+
                     self.connections = []
         else:
             try:
@@ -173,5 +579,7 @@ class Application(object):
                 for connection in self.connections:
                     connection.disconnect()
 
+                self.close_runtime()
+
 if __name__ == "__main__":
     Application().main()
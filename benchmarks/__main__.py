@@ -0,0 +1,38 @@
+"""
+    Runs the benchmark suite.
+
+    python -m benchmarks [--output results.json] [--compare baseline.json] [--threshold 0.25]
+
+    Results are written as JSON tagged with the current commit. When a baseline is given, every benchmark that is
+    slower than the baseline by more than the threshold is flagged and the exit code is nonzero.
+"""
+
+import sys
+import argparse
+
+from benchmarks import harness
+from benchmarks import hotpaths
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Runs the PyBridge hot path benchmarks.")
+    parser.add_argument("--output", default=None, help="The path to write the JSON results to.")
+    parser.add_argument("--compare", default=None, help="The path of a previous JSON results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="The fractional slowdown that is flagged as a regression.")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this text.")
+    parser.add_argument("--repeats", type=int, default=5, help="The number of timed repeats of each benchmark.")
+    arguments = parser.parse_args()
+
+    results = harness.run_benchmarks(name_filter=arguments.filter, repeats=arguments.repeats)
+    if arguments.output is not None:
+        harness.save_results(results, arguments.output)
+
+    if arguments.compare is not None:
+        print("")
+        regressions = harness.compare_results(results, harness.load_results(arguments.compare), arguments.threshold)
+        if len(regressions) != 0:
+            print("!!! %u benchmark(s) regressed by more than %u%%." % (len(regressions), arguments.threshold * 100))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
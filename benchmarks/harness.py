@@ -0,0 +1,154 @@
+"""
+    Benchmark harness programming. Times the registered benchmarks, stores results as JSON and compares runs so
+    that slowdowns between commits are flagged.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import subprocess
+
+BENCHMARKS = []
+"""
+    Every registered benchmark, in registration order.
+"""
+
+class Benchmark(object):
+    """
+        A class representing a single registered benchmark.
+    """
+
+    name = None
+    """
+        The unique name results are stored under.
+    """
+
+    setup = None
+    """
+        A function returning (operation, operation_count). The operation is the callable being timed and the
+        operation count is how many units of work a single call performs, so results are reported per unit.
+    """
+
+    description = None
+    """
+        A short description of what is being measured.
+    """
+
+    def __init__(self, name, setup, description):
+        self.name = name
+        self.setup = setup
+        self.description = description
+
+def benchmark(name):
+    """
+        Decorator registering a benchmark setup function under the given name. The setup function's docstring is
+        used as the benchmark's description.
+    """
+    def register(setup):
+        description = " ".join((setup.__doc__ or "").split())
+        BENCHMARKS.append(Benchmark(name, setup, description))
+        return setup
+    return register
+
+def time_benchmark(registered_benchmark, repeats=5, minimum_seconds=0.2):
+    """
+        Times a single benchmark. The number of calls per repeat is calibrated so each repeat takes at least the given
+        minimum time, and the fastest repeat is reported since it carries the least scheduling noise.
+
+        :return: The best observed time per unit of work in seconds.
+    """
+    operation, operation_count = registered_benchmark.setup()
+
+    # Calibrate the number of calls per repeat.
+    call_count = 1
+    while True:
+        start_time = time.perf_counter()
+        for iteration in range(call_count):
+            operation()
+        elapsed_time = time.perf_counter() - start_time
+
+        if elapsed_time >= minimum_seconds:
+            break
+        call_count *= 2
+
+    best_time = elapsed_time / call_count
+    for repeat in range(repeats - 1):
+        start_time = time.perf_counter()
+        for iteration in range(call_count):
+            operation()
+        best_time = min(best_time, (time.perf_counter() - start_time) / call_count)
+
+    return best_time / operation_count
+
+def get_commit():
+    """
+        Returns the current git commit, or None if it cannot be determined.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        return None
+
+def run_benchmarks(name_filter=None, repeats=5, minimum_seconds=0.2):
+    """
+        Runs every registered benchmark whose name contains the given filter.
+
+        :return: The results document.
+    """
+    results = {}
+    for registered_benchmark in BENCHMARKS:
+        if name_filter is not None and name_filter not in registered_benchmark.name:
+            continue
+
+        seconds_per_operation = time_benchmark(registered_benchmark, repeats=repeats, minimum_seconds=minimum_seconds)
+        results[registered_benchmark.name] = {
+            "description": registered_benchmark.description,
+            "secondsPerOperation": seconds_per_operation,
+            "operationsPerSecond": 1.0 / seconds_per_operation if seconds_per_operation > 0 else None,
+        }
+        print("%-40s %12.3f us/op" % (registered_benchmark.name, seconds_per_operation * 1000000.0))
+
+    return {
+        "commit": get_commit(),
+        "created": datetime.datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+def save_results(results, path):
+    directory = os.path.dirname(path)
+    if directory != "" and os.path.exists(directory) is False:
+        os.makedirs(directory)
+
+    with open(path, "w") as handle:
+        handle.write(json.dumps(results, sort_keys=True, separators=(", ", ":"), indent=4))
+
+def load_results(path):
+    with open(path, "r") as handle:
+        return json.loads(handle.read())
+
+def compare_results(results, baseline, threshold):
+    """
+        Compares a run against a baseline run.
+
+        :param threshold: The fractional slowdown at which a benchmark is flagged, such as 0.25 for 25% slower.
+        :return: A list of (name, ratio) pairs for every benchmark slower than the threshold allows.
+    """
+    regressions = []
+    for name, result in sorted(results["results"].items()):
+        if name not in baseline["results"]:
+            continue
+
+        baseline_time = baseline["results"][name]["secondsPerOperation"]
+        ratio = result["secondsPerOperation"] / baseline_time if baseline_time > 0 else 1.0
+
+        flagged = ratio > 1.0 + threshold
+        print("%-40s %7.2fx%s" % (name, ratio, "  <-- REGRESSION" if flagged else ""))
+        if flagged:
+            regressions.append((name, ratio))
+    return regressions
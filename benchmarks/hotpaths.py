@@ -0,0 +1,187 @@
+"""
+    Benchmarks of the relay hot paths.
+"""
+
+import os
+import sys
+import socket
+import datetime
+import tempfile
+
+# The application modules import each other relative to the application folder.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "application"))
+
+import main
+import bridgesystem
+from bridges.ircbridge.irc import Connection
+from bridges.ircbridge.ircbridge import Bridge as IRCBridge
+
+from benchmarks.harness import benchmark
+
+FANOUT_BRIDGE_COUNT = 32
+"""
+    The number of bridges in the broadcast domain used by the fan out benchmark.
+"""
+
+CONCURRENT_SENDER_COUNT = 200
+"""
+    The number of senders pasting long messages at once in the long block benchmark.
+"""
+
+class SyntheticBridge(bridgesystem.BridgeBase):
+    """
+        A bridge that only counts what it is asked to send.
+    """
+
+    sent_count = None
+    """
+        The number of messages this bridge has been asked to send.
+    """
+
+    def start(self):
+        self.sent_count = 0
+        self.register_event("on_receive_message", self.on_receive_message)
+
+    def on_receive_message(self, sender, sender_name, message, target_channels):
+        self.send_buffered_message(sender_name, target_channels, message, 450, self.send)
+
+    def send(self, sender, message, target_channels):
+        self.sent_count += 1
+
+def create_configuration(bridge_count, bridge="ircbridge", generic_config={}, internal_config={}):
+    """
+        Builds a configuration holding a single domain of the given number of bridges.
+    """
+    return bridgesystem.Configuration.from_configuration_data({
+        "globalConfiguration": {
+            "imageHosting": {
+                "imagePathBase": tempfile.gettempdir(),
+                "imageURLBase": "http://localhost/images",
+            },
+        },
+        "domains": [
+            {
+                "name": "benchmark",
+                "bridges": [
+                    {
+                        "name": "bridge%u" % index,
+                        "bridge": bridge,
+                        "bridgeGenericConfig": dict(generic_config),
+                        "bridgeInternalConfig": dict(internal_config),
+                    }
+                    for index in range(bridge_count)
+                ],
+            }
+        ],
+    })
+
+def create_domain(application, configuration, bridge_class):
+    """
+        Creates and starts a bridge for every configured bridge, mapping them into a single broadcast domain the same
+        way the application does.
+    """
+    home_path = tempfile.mkdtemp(prefix="pybridge-benchmark-")
+    bridges = [bridge_class(application, home_path, bridge, configuration) for bridge in configuration.domains[0].bridges]
+
+    for sender in bridges:
+        application.connection_bridges[sender] = [receiver for receiver in bridges if receiver is not sender]
+    application.routing_table = bridgesystem.RoutingTable(application.connection_bridges)
+    application.routing_table.rebuild()
+
+    for bridge in bridges:
+        bridge.start()
+    return bridges
+
+@benchmark("chunk_string_long_paste")
+def chunk_string_long_paste():
+    """
+        Splitting a 64KB paste into 450 character IRC sized chunks.
+    """
+    paste = ("All work and no play makes Jack a dull boy. " * 1500)[:65536]
+    return lambda: bridgesystem.chunk_string(paste, 450), 1
+
+@benchmark("irc_discord_formatting")
+def irc_discord_formatting():
+    """
+        Translating Discord markdown to IRC formatting codes for a single message.
+    """
+    configuration = create_configuration(1)
+    bridge = IRCBridge(main.Application(), tempfile.gettempdir(), configuration.domains[0].bridges[0], configuration)
+    bridge.initialize_formats()
+
+    message = "Some **bold** text, some *italic* text, __underlined__ and ~~struck through~~ words and ***both*** at once."
+    return lambda: bridge.convert_discord_formatting(message), 1
+
+@benchmark("irc_line_parsing")
+def irc_line_parsing():
+    """
+        Parsing buffered IRC protocol lines into events, per line.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    received_messages = []
+    connection = Connection("127.0.0.1", listener.getsockname()[1], "benchmark", ["benchmark"],
+                            event_handlers={"OnReceive": lambda username, message, channel: received_messages.append(message)})
+
+    line_count = 1000
+    buffer = ":user%u!user@example.com PRIVMSG #benchmark :This is benchmark message number %u.\r\n"
+    buffer = "".join(buffer % (index, index) for index in range(line_count))
+
+    def parse_lines():
+        connection.buffer = buffer
+        connection.process_buffer()
+        del received_messages[:]
+    return parse_lines, line_count
+
+@benchmark("broadcast_event_fanout")
+def broadcast_event_fanout():
+    """
+        Broadcasting a message to every bridge of a domain, per receiving bridge.
+    """
+    application = main.Application()
+    configuration = create_configuration(FANOUT_BRIDGE_COUNT, generic_config={"receivingChannels": ["benchmark"]})
+    bridges = create_domain(application, configuration, SyntheticBridge)
+
+    sender = bridges[0]
+    return lambda: application.broadcast_event("on_receive_message", sender=sender, sender_name="benchmark",
+                                               message="Hello there.", target_channels=["benchmark"]), FANOUT_BRIDGE_COUNT - 1
+
+@benchmark("long_block_concurrent_senders")
+def long_block_concurrent_senders():
+    """
+        Buffering and draining long pastes from many concurrent senders, per block sent.
+    """
+    application = main.Application()
+    configuration = create_configuration(1, generic_config={"largeBlockDelaySeconds": 0, "outboundQueueCapacity": 1000000})
+    bridge = create_domain(application, configuration, SyntheticBridge)[0]
+
+    paste = "x" * (450 * 4)
+
+    def paste_and_drain():
+        for index in range(CONCURRENT_SENDER_COUNT):
+            bridge.send_buffered_message("sender%u" % index, ["benchmark"], paste, 450, bridge.send)
+
+        while len(bridge.last_long_block_process) != 0:
+            bridge.process_long_blocks()
+    return paste_and_drain, CONCURRENT_SENDER_COUNT * 4
+
+@benchmark("long_block_waiting_tick")
+def long_block_waiting_tick():
+    """
+        A main loop tick while many senders have long blocks waiting on the block delay, per tick.
+    """
+    application = main.Application()
+    configuration = create_configuration(1, generic_config={"largeBlockDelaySeconds": 3600, "outboundQueueCapacity": 1000000})
+    bridge = create_domain(application, configuration, SyntheticBridge)[0]
+
+    for index in range(CONCURRENT_SENDER_COUNT):
+        bridge.send_buffered_message("sender%u" % index, ["benchmark"], "x" * (450 * 50), 450, bridge.send)
+
+    delta_time = datetime.timedelta(milliseconds=32)
+
+    def tick():
+        bridge.update(delta_time)
+        application.timers.run_due()
+    return tick, 1
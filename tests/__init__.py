@@ -0,0 +1,10 @@
+"""
+    The PyBridge unit tests.
+
+    python -m unittest discover -s tests -t .
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "application"))
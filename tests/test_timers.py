@@ -0,0 +1,91 @@
+"""
+    Timer wheel tests.
+"""
+
+import unittest
+
+from bridgesystem.timers import TimerService, WHEEL_BITS
+
+class FakeClock(object):
+    """
+        A monotonic clock the tests advance by hand.
+    """
+
+    now = None
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+class TimerServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.service = TimerService(clock=self.clock.monotonic)
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        self.service.run_due()
+
+    def test_cancel_during_fire(self):
+        fired = []
+        second = None
+
+        def cancel_second():
+            fired.append("first")
+            second.cancel()
+
+        self.service.call_later(0.05, cancel_second)
+        second = self.service.call_later(0.05, lambda: fired.append("second"))
+        self.advance(0.06)
+
+        self.assertEqual(fired, ["first"])
+        self.assertEqual(self.service.timer_count, 0)
+
+    def test_cancel_repeating_timer_during_fire(self):
+        fired = []
+        repeating = self.service.call_every(0.05, lambda delta_time: fired.append("repeating"))
+        self.service.call_later(0.05, repeating.cancel)
+        self.advance(0.06)
+        self.advance(0.1)
+
+        self.assertLessEqual(len(fired), 1)
+        self.assertEqual(self.service.timer_count, 0)
+
+    def test_cascade_between_levels(self):
+        fired = []
+        level_span = (1 << WHEEL_BITS) * self.service.resolution
+        self.service.call_later(level_span * 1.5, lambda: fired.append(self.clock.now))
+
+        # Step through tick by tick so the timer is cascaded down rather than found by a single jump.
+        for step in range(int(level_span * 1.5 / self.service.resolution) - 1):
+            self.advance(self.service.resolution)
+        self.assertEqual(fired, [])
+
+        self.advance(self.service.resolution * 3)
+        self.assertEqual(len(fired), 1)
+        self.assertEqual(self.service.timer_count, 0)
+
+    def test_deadline_beyond_level_zero(self):
+        fired = []
+        delay = (1 << (WHEEL_BITS * 2)) * self.service.resolution + 0.5
+        self.service.call_later(delay, lambda: fired.append(True))
+
+        self.advance(delay - 0.1)
+        self.assertEqual(fired, [])
+        self.advance(0.2)
+        self.assertEqual(fired, [True])
+
+    def test_never_fires_early(self):
+        fired = []
+        self.service.call_later(0.5, lambda: fired.append(True))
+        self.advance(0.49)
+        self.assertEqual(fired, [])
+        self.assertIsNotNone(self.service.get_timeout())
+        self.advance(0.02)
+        self.assertEqual(fired, [True])
+        self.assertIsNone(self.service.get_timeout())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+    Webhook listener tests. A fake Bot API posts updates to the listener the way Telegram delivers them.
+"""
+
+import json
+import socket
+import unittest
+import http.client
+
+from bridgesystem.webhooks import WebhookServer
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class FakeBotAPI(object):
+    """
+        Delivers webhook updates to a listener as Telegram's Bot API would.
+    """
+
+    host = None
+    port = None
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def post(self, path, payload, secret_token=None, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=5)
+        headers = {"Content-Type": "application/json"}
+        if secret_token is not None:
+            headers[SECRET_HEADER] = secret_token
+
+        try:
+            connection.request("POST", path, body=body if body is not None else json.dumps(payload).encode("utf8"), headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+def get_free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+class WebhookServerTests(unittest.TestCase):
+    def setUp(self):
+        self.deliveries = []
+        self.server = WebhookServer("127.0.0.1", get_free_port())
+        self.server.register("/telegram/bridge", self.deliveries.append, secret_header=SECRET_HEADER, secret_token="secret")
+        self.server.start()
+        self.bot_api = FakeBotAPI(self.server.host, self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_delivers_update(self):
+        update = {"update_id": 1, "message": {"message_id": 2, "text": "hello"}}
+        self.assertEqual(self.bot_api.post("/telegram/bridge", update, secret_token="secret"), 200)
+        self.assertEqual(self.deliveries, [update])
+
+    def test_rejects_wrong_secret(self):
+        self.assertEqual(self.bot_api.post("/telegram/bridge", {"update_id": 1}, secret_token="wrong"), 403)
+        self.assertEqual(self.bot_api.post("/telegram/bridge", {"update_id": 1}), 403)
+        self.assertEqual(self.deliveries, [])
+
+    def test_rejects_unknown_path(self):
+        self.assertEqual(self.bot_api.post("/elsewhere", {"update_id": 1}, secret_token="secret"), 404)
+
+    def test_rejects_malformed_body(self):
+        self.assertEqual(self.bot_api.post("/telegram/bridge", None, secret_token="secret", body=b"{not json"), 400)
+
+    def test_responds_when_callback_raises(self):
+        def fail(payload):
+            raise ValueError("broken")
+
+        self.server.register("/failing", fail)
+        self.assertEqual(self.bot_api.post("/failing", {"update_id": 1}), 500)
+
+        # The listener keeps serving afterwards.
+        self.assertEqual(self.bot_api.post("/telegram/bridge", {"update_id": 2}, secret_token="secret"), 200)
+
+if __name__ == "__main__":
+    unittest.main()